@@ -3,13 +3,20 @@ import sys
 import io
 import tempfile
 import tkinter as tk
+from collections import OrderedDict
 from tkinter import filedialog, messagebox, ttk
 
-import pymupdf
-from PIL import Image, ImageTk
+from PIL import Image, ImageOps, ImageTk
 
-from create_file import add_images_to_pdf_in_grid, create_pdf_with_best_orientation_images, extract_and_merge_pdfs
-from printer_utils import PrinterManager
+from create_file import (COLOR_MODES, RASTER_DPI, SAVE_PROFILES, add_images_to_pdf_in_grid,
+                         create_pdf_with_best_orientation_images, extract_and_merge_pdfs, open_pdf_source, source_name)
+from instrumentation import progress_observer
+from job_journal import resume_job, run_job, unfinished_jobs
+from job_model import ImageJobItems, PDFJobItems
+from page_index import PageIndex, selection_matches
+from page_selection import PageSelection
+from preview import ThumbnailRenderer
+from printer_utils import PrinterManager, printer_registry
 
 
 def resource_path(relative_path):
@@ -40,12 +47,30 @@ class App(tk.Tk):
         # Position the window at the center
         self.geometry(f"{window_width}x{window_height}+{center_x}+{center_y}")
 
+        # Start discovering printers, so the print window opens with the cached list
+        printer_registry.refresh()
+
         # widgets
         self.start_menu = StartMenu(self)
 
+        # Offer to finish the print jobs a crash interrupted, once the window is shown
+        self.after_idle(self.resume_unfinished_jobs)
+
         # run
         self.mainloop()
 
+    def resume_unfinished_jobs(self):
+        jobs = unfinished_jobs()
+        if not jobs or not messagebox.askyesno(
+                "Unfinished jobs", f"{len(jobs)} job(s) did not finish the last time. Resume them now?"):
+            return
+        for directory, summary in jobs:
+            try:
+                resume_job(directory)
+            except Exception as exception:
+                messagebox.showerror("Error", f"The {summary['engine']} job could not be resumed: \"{exception}\"")
+        messagebox.showinfo("Success", "The unfinished jobs are done.")
+
 
 class StartMenu(tk.Frame):
     def __init__(self, master_parent):
@@ -83,10 +108,10 @@ class ImagesWindow(tk.Toplevel):
         self.rows_number = tk.IntVar(value=1)
         self.page_margin = tk.IntVar(value=0)
         self.image_margin = tk.IntVar(value=0)
+        self.color_mode = tk.StringVar(value="color")
         self.output_path_file = None
-        self.image_paths = []
-        self.thumbnails = []  # Store thumbnails to avoid garbage collection
-        self.angle_entries = {}
+        self.images = ImageJobItems()  # The images and their angles, passed to the engines as they are
+        self.thumbnails = OrderedDict()  # Store thumbnails of recently shown images to avoid garbage collection
 
         self.angles_needed.trace_add("write", self.update_angles_needed)
         self.best_orientation.trace_add("write", self.update_best_orientation)
@@ -106,8 +131,11 @@ class ImagesWindow(tk.Toplevel):
         self.margins = MarginInterface(self)
         self.margins.grid(row=5, column=0, pady=10, sticky="w")
 
+        self.color_mode_options = ColorModeInterface(self)
+        self.color_mode_options.grid(row=6, column=0, pady=10, sticky="w")
+
         self.file_creation = ImagesFileCreation(self)
-        self.file_creation.grid(row=6, column=0, columnspan=5, pady=10)
+        self.file_creation.grid(row=7, column=0, columnspan=5, pady=10)
 
         # Enable row and column resizing
         self.grid_rowconfigure(0, weight=1)
@@ -136,6 +164,8 @@ class ImagesWindow(tk.Toplevel):
 
 
 class InputImagesInterface(tk.Frame):
+    thumbnails_cache_size = 256
+
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
@@ -159,9 +189,12 @@ class InputImagesInterface(tk.Frame):
         # Frame to hold ScrollableCanvas
 
         # Scrollable canvas setup inside frame
-        self.scrollable_canvas = ScrollableCanvas(self)
+        self.scrollable_canvas = ScrollableCanvas(self, self.create_image_row, self.bind_image_row, row_height=64)
         self.scrollable_canvas.grid(row=0, column=1, sticky="nsew")
 
+        # Bind to release focus if clicked outside of an entry widget
+        self.scrollable_canvas.canvas.bind("<Button-1>", lambda event: self.scrollable_canvas.focus_set())
+
     def create_buttons(self):
         tk.Label(self, text="Images").grid(row=0, column=0, sticky="we")
 
@@ -174,75 +207,98 @@ class InputImagesInterface(tk.Frame):
         self.angles_cb.grid(row=2, column=1, sticky="w")
 
     def select_image_path(self):
-        file_paths = filedialog.askopenfilenames(filetypes=[("Image Files", "*.jpg *.jpeg *.png")])
+        file_paths = filedialog.askopenfilenames(filetypes=[("Image Files", "*.jpg *.jpeg *.png *.tif *.tiff")])
         for file_path in file_paths:
             if file_path:
-                self.parent.image_paths.append(file_path)
-                self.display_image_list()
+                self.parent.images.append(file_path)
+        self.display_image_list()
 
     def display_image_list(self):
-        # Remove only widgets within `scrollable_content`, not the `scrollable_canvas` itself
-        for widget in self.scrollable_canvas.scrollable_content.winfo_children():
-            widget.destroy()
+        self.scrollable_canvas.set_model(self.parent.images.paths)
+
+    def create_image_row(self, parent):
+        row = tk.Frame(parent)
+        row.index = None
+
+        # Thumbnail and image title
+        row.thumbnail_label = tk.Label(row)
+        row.thumbnail_label.grid(row=0, column=0, padx=5, pady=5)
+        row.title_label = tk.Label(row, relief="ridge", padx=5, pady=5)
+        row.title_label.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+
+        row.delete_button = tk.Button(row, text="X", command=lambda: self.delete_image(row.index))
+        row.delete_button.grid(row=0, column=2, padx=2)
+
+        # Up and Down buttons to reorder images
+        row.up_button = tk.Button(row, text="↑", command=lambda: self.move_image_up(row.index))
+        row.up_button.grid(row=0, column=3, padx=2)
+        row.down_button = tk.Button(row, text="↓", command=lambda: self.move_image_down(row.index))
+        row.down_button.grid(row=0, column=4, padx=2)
+
+        row.angle_entry = tk.Entry(row, width=5)
+        row.angle_entry.grid(row=0, column=5, padx=2)
+        row.angle_entry.bind("<KeyRelease>", lambda event: self.store_angle(row))
+        # Bind focus-out behavior to lose focus when clicked outside
+        row.angle_entry.bind("<FocusOut>", lambda event: row.angle_entry.selection_clear())
+        return row
+
+    def bind_image_row(self, row, index, file_path):
+        row.index = index
+        row.thumbnail_label.config(image=self.get_thumbnail(file_path))
+        row.title_label.config(text=os.path.basename(file_path))
+
+        # "Up" button is only shown if it's not the first item, "Down" button if it's not the last item
+        if index > 0:
+            row.up_button.grid()
+        else:
+            row.up_button.grid_remove()
+        if index < len(self.parent.images) - 1:
+            row.down_button.grid()
+        else:
+            row.down_button.grid_remove()
 
-        self.parent.thumbnails.clear()
+        if self.parent.angles_needed.get() and self.angles_cb.cget("state") != "disabled":
+            angle = self.parent.images.angles[index]
+            row.angle_entry.delete(0, tk.END)
+            row.angle_entry.insert(0, str(angle) if angle else "")
+            row.angle_entry.grid()
+        else:
+            row.angle_entry.grid_remove()
 
-        for index, file_path in enumerate(self.parent.image_paths):
-            img_title = os.path.basename(file_path)
+    def get_thumbnail(self, file_path):
+        """Returns the thumbnail of an image, loading it only when its row becomes visible."""
+        thumbnail = self.parent.thumbnails.get(file_path)
+        if thumbnail is not None:
+            self.parent.thumbnails.move_to_end(file_path)
+            return thumbnail
 
-            # Load image and create a thumbnail
-            image = Image.open(file_path)
+        with Image.open(file_path) as image:
+            image.draft("RGB", (50, 50))  # Let JPEG decoder skip the full resolution
             image.thumbnail((50, 50))  # Resize image to 50x50 pixels
-            thumbnail = ImageTk.PhotoImage(image)
-            self.parent.thumbnails.append(thumbnail)  # Save reference to prevent garbage collection
-
-            # Display thumbnail
-            thumbnail_label = tk.Label(self.scrollable_canvas.scrollable_content, image=thumbnail)
-            thumbnail_label.grid(row=index * 2, column=0, padx=5, pady=(5, 0))
-
-            # Display image title below the thumbnail
-            label = tk.Label(self.scrollable_canvas.scrollable_content, text=img_title, relief="ridge", padx=5, pady=5)
-            label.grid(row=index * 2 + 1, column=0, padx=5, pady=5, sticky="nsew")
-
-            delete_button = tk.Button(self.scrollable_canvas.scrollable_content, text="X",
-                                      command=lambda idx=index: self.delete_image(idx))
-            delete_button.grid(row=index * 2 + 1, column=1, padx=2)
-
-            # Up and Down buttons to reorder images
-            if index > 0:  # "Up" button is only enabled if it"s not the first item
-                up_button = tk.Button(self.scrollable_canvas.scrollable_content, text="↑",
-                                      command=lambda idx=index: self.move_image_up(idx))
-                up_button.grid(row=index * 2 + 1, column=2, padx=2)
-
-            if index < len(self.parent.image_paths) - 1:  # "Down" button is only enabled if it"s not the last item
-                down_button = tk.Button(self.scrollable_canvas.scrollable_content, text="↓",
-                                        command=lambda idx=index: self.move_image_down(idx))
-                down_button.grid(row=index * 2 + 1, column=3, padx=2)
-
-            if self.parent.angles_needed.get() and self.angles_cb.cget("state") != "disabled":
-                angle_entry = tk.Entry(self.scrollable_canvas.scrollable_content, width=5)
-                angle_entry.grid(row=index * 2 + 1, column=4, padx=2)
-                self.parent.angle_entries[file_path] = angle_entry
-                # Bind focus-out behavior to lose focus when clicked outside
-                angle_entry.bind("<FocusOut>", lambda e: angle_entry.selection_clear())
-
-        # Bind to release focus if clicked outside of an entry widget
-        self.scrollable_canvas.bind("<Button-1>", lambda event: self.scrollable_canvas.focus_set())
+            # Shown upright like in the PDF, the thumbnail keeps the EXIF orientation of the photo
+            thumbnail = ImageTk.PhotoImage(ImageOps.exif_transpose(image))
+        # Save reference to prevent garbage collection, but only for a limited number of images
+        self.parent.thumbnails[file_path] = thumbnail
+        if len(self.parent.thumbnails) > self.thumbnails_cache_size:
+            self.parent.thumbnails.popitem(last=False)
+        return thumbnail
+
+    def store_angle(self, row):
+        value = row.angle_entry.get()
+        self.parent.images.set_angle(row.index, int(value) if value.lstrip("-").isdigit() else 0)
 
     def move_image_up(self, index):
         if index > 0:
-            self.parent.image_paths[index], self.parent.image_paths[index - 1] = self.parent.image_paths[index - 1], \
-                                                                                 self.parent.image_paths[index]
+            self.parent.images.swap(index, index - 1)
             self.display_image_list()
 
     def move_image_down(self, index):
-        if index < len(self.parent.image_paths) - 1:
-            self.parent.image_paths[index], self.parent.image_paths[index + 1] = self.parent.image_paths[index + 1], \
-                                                                                 self.parent.image_paths[index]
+        if index < len(self.parent.images) - 1:
+            self.parent.images.swap(index, index + 1)
             self.display_image_list()
 
     def delete_image(self, index):
-        del self.parent.image_paths[index]
+        self.parent.images.delete(index)
         self.display_image_list()
 
     def toggle_angles_option(self):
@@ -422,11 +478,12 @@ class ImagesFileCreation(tk.Frame):
         self.parent = parent
 
         tk.Button(self, text="Generate PDF", command=self.generate_pdf).grid(row=0, column=0, columnspan=1, pady=10)
+        self.progress_bar = ttk.Progressbar(self, length=200, mode="determinate")
 
     def generate_pdf(self):
         # Retrieve values from GUI fields
         output_path = self.parent.output_path_file if self.parent.output_path.get() else None
-        image_paths = self.parent.image_paths
+        images = self.parent.images
         columns = int(self.parent.columns_number.get()) if self.parent.multiple_pages.get() else 1
         rows = int(self.parent.rows_number.get()) if self.parent.multiple_pages.get() else 1
         try:
@@ -440,27 +497,39 @@ class ImagesFileCreation(tk.Frame):
         if self.parent.best_orientation.get():
             self.generated_pdf = create_pdf_with_best_orientation_images(
                 output_path=output_path,
-                image_paths=image_paths,
+                image_paths=images.paths,
                 columns=columns,  # Columns and rows set to 1 as grid mode is not compatible
                 rows=rows,
                 orientation=self.parent.orientation.get(),
                 page_margin=page_margin,
-                image_margin=image_margin
+                image_margin=image_margin,
+                color_mode=self.parent.color_mode.get(),
+                observer=self.create_progress_observer()
             )
+            arguments = {}
         else:
             # Otherwise, use the add_images_to_pdf_in_grid function
-            angles = [int(entry.get()) if entry.get().isdigit() else 0 for entry in
-                      self.parent.angle_entries.values()] if self.parent.angles_needed.get() else None
+            angles = images.angles if self.parent.angles_needed.get() else None
             self.generated_pdf = add_images_to_pdf_in_grid(
                 output_path=output_path,
-                image_paths=image_paths,
+                image_paths=images.paths,
                 columns=columns,
                 rows=rows,
                 angles=angles,
                 orientation=self.parent.orientation.get(),
                 page_margin=page_margin,
-                image_margin=image_margin
+                image_margin=image_margin,
+                color_mode=self.parent.color_mode.get(),
+                observer=self.create_progress_observer()
             )
+            # Copied, so rotating images after the generation doesn't change the printed job
+            arguments = {"angles": angles[:] if angles is not None else None}
+        self.progress_bar.grid_remove()
+        # The same job is printed through the job journal, see PrintWindow
+        arguments.update(image_paths=list(images.paths), columns=columns, rows=rows,
+                         orientation=self.parent.orientation.get(), page_margin=page_margin,
+                         image_margin=image_margin, color_mode=self.parent.color_mode.get())
+        self.job = ("best_orientation" if self.parent.best_orientation.get() else "grid", arguments)
 
         # Optional feedback for success
         messagebox.showinfo("Success", "PDF generated successfully!")
@@ -469,28 +538,54 @@ class ImagesFileCreation(tk.Frame):
         self.print_button = tk.Button(self, text="Print", command=self.open_print_window)
         self.print_button.grid(row=1, column=0, padx=10, pady=10)
 
+    def create_progress_observer(self):
+        self.progress_bar.grid(row=2, column=0, padx=10, pady=5)
+        return progress_observer(self.show_progress)
+
+    def show_progress(self, done, total):
+        self.progress_bar.config(maximum=max(total, 1), value=done)
+        # The job runs in the GUI thread, so the bar has to be redrawn explicitly
+        self.progress_bar.update_idletasks()
+
     def open_print_window(self):
-        PrintWindow(self, self.generated_pdf)
+        PrintWindow(self, self.generated_pdf, self.job)
 
 
 class ScrollableCanvas(tk.Frame):
-    def __init__(self, parent, height=None):
+    """
+    A vertically scrollable list of rows of equal height.
+
+    Rows are not created for every item of the model: only the visible ones, plus `overscan` rows above and
+    below, exist as widgets. When the list is scrolled, rows which left the view are moved to the newly
+    visible positions and filled with the data of their new items, so the number of widgets stays the same
+    for any length of the list.
+
+    :param create_row: Function creating an empty row widget, called with the parent widget for the row
+    :param bind_row: Function filling a row with the item of the model, called with (row, index, item)
+    :param row_height: Height of every row in pixels
+    """
+    overscan = 3
+
+    def __init__(self, parent, create_row, bind_row, row_height, height=None):
         super().__init__(parent)
+        self.create_row = create_row
+        self.bind_row = bind_row
+        self.row_height = row_height
+        self.model = []
+        self.rows = {}  # model index -> row widget shown for it
+        self.spare_rows = []  # hidden row widgets ready for reuse
+
         # Canvas and scrollbars setup
-        self.canvas = tk.Canvas(self, height=height, highlightthickness=0)
-        self.vertical_scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas = tk.Canvas(self, height=height, highlightthickness=0, yscrollincrement=row_height)
+        self.vertical_scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scroll)
         self.canvas.configure(yscrollcommand=self.vertical_scrollbar.set)
 
         # Layout
         self.canvas.pack(side="left", fill="both", expand=True)
         self.vertical_scrollbar.pack(side="right", fill="y")
 
-        # Placeholder for the content frame (will be set by another class)
-        self.scrollable_content = tk.Frame(self.canvas)
-        self.canvas.create_window((0, 0), window=self.scrollable_content, anchor="nw", tags="self.scrollable_content")
-
         # Bind resize events
-        self.scrollable_content.bind("<Configure>", self.on_configure)
+        self.canvas.bind("<Configure>", self.on_configure)
 
         # Bind mouse wheel scroll only when hovering over the scrollbars
         self.vertical_scrollbar.bind("<Enter>", self.enable_vertical_scroll)
@@ -500,16 +595,53 @@ class ScrollableCanvas(tk.Frame):
         self.scroll_direction = None
         self.vertical_scroll_enabled = False
 
-    def on_configure(self, event=None):
-        # Update the scroll region to match the size of the content frame
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+    def set_model(self, model):
+        """Shows the items of `model`, any sequence, and fills all visible rows again."""
+        self.model = model
+        self.refresh(rebind=True)
 
-        # Check if scrolling is needed based on content size vs. canvas size
-        content_height = self.scrollable_content.winfo_reqheight()
-        canvas_height = self.canvas.winfo_height()
+    def refresh(self, rebind=False):
+        """Places rows at the visible positions. If `rebind` is True, rows already shown are filled again too."""
+        content_height = len(self.model) * self.row_height
+        canvas_width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(0, 0, canvas_width, content_height))
 
         # Enable or disable vertical scrolling based on height
-        self.vertical_scroll_enabled = content_height > canvas_height
+        self.vertical_scroll_enabled = content_height > self.canvas.winfo_height()
+
+        top = self.canvas.canvasy(0)
+        first = max(int(top // self.row_height) - self.overscan, 0)
+        last = min(int((top + self.canvas.winfo_height()) // self.row_height) + self.overscan, len(self.model) - 1)
+        visible = range(first, last + 1)
+
+        # Hide the rows which scrolled out of the view
+        for index in [index for index in self.rows if index not in visible]:
+            row = self.rows.pop(index)
+            self.canvas.itemconfigure(row.window_id, state="hidden")
+            self.spare_rows.append(row)
+
+        for index in visible:
+            row = self.rows.get(index)
+            if row is None:
+                if self.spare_rows:
+                    row = self.spare_rows.pop()
+                else:
+                    row = self.create_row(self.canvas)
+                    row.window_id = self.canvas.create_window(0, 0, window=row, anchor="nw")
+                self.rows[index] = row
+                self.canvas.coords(row.window_id, 0, index * self.row_height)
+                self.canvas.itemconfigure(row.window_id, state="normal", width=canvas_width,
+                                          height=self.row_height)
+                self.bind_row(row, index, self.model[index])
+            elif rebind:
+                self.bind_row(row, index, self.model[index])
+
+    def on_configure(self, event=None):
+        self.refresh(rebind=True)
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
 
     def enable_vertical_scroll(self, event):
         if self.vertical_scroll_enabled:
@@ -523,6 +655,7 @@ class ScrollableCanvas(tk.Frame):
     def on_mouse_wheel(self, event):
         if self.scroll_direction == "vertical":
             self.canvas.yview_scroll(-1 * (event.delta // 120), "units")
+            self.refresh()
 
 
 class PDFWindow(tk.Toplevel):
@@ -532,19 +665,35 @@ class PDFWindow(tk.Toplevel):
         self.iconbitmap(resource_path("printer.ico"))
 
         self.output_path = tk.BooleanVar()
-        self.pdf_paths = []
-        self.page_selections = None
+        self.save_profile = tk.StringVar(value="fast")
+        self.deduplicate = tk.BooleanVar()
+        self.color_mode = tk.StringVar(value="color")
+        self.rasterize_heavy_pages = tk.BooleanVar()
+        self.raster_dpi = tk.IntVar(value=RASTER_DPI)
+        self.pdfs = PDFJobItems()  # The sources, their selections and page counts, passed to the engine as they are
         self.output_path_file = None
-        self.pages_entries = {}
+        self.page_index = PageIndex()  # Resolves "text:" selections, keeps the file hashes between generations
 
         self.input_interface = InputPDFInterface(self)
         self.input_interface.grid(row=0, column=0, columnspan=5, sticky="nsew")
 
+        self.page_preview = PagePreviewStrip(self)
+        self.page_preview.grid(row=1, column=0, columnspan=5, sticky="we")
+
         self.output_options = OutputOptionsInterface(self)
-        self.output_options.grid(row=1, column=0, sticky="w")
+        self.output_options.grid(row=2, column=0, sticky="w")
+
+        self.save_profile_options = SaveProfileInterface(self)
+        self.save_profile_options.grid(row=3, column=0, pady=10, sticky="w")
+
+        self.color_mode_options = ColorModeInterface(self)
+        self.color_mode_options.grid(row=4, column=0, pady=10, sticky="w")
+
+        self.raster_options = RasterInterface(self)
+        self.raster_options.grid(row=5, column=0, pady=10, sticky="w")
 
         self.file_creation = PDFsFileCreation(self)
-        self.file_creation.grid(row=2, column=0, columnspan=5, pady=10)
+        self.file_creation.grid(row=6, column=0, columnspan=5, pady=10)
 
         # Enable row and column resizing
         self.grid_rowconfigure(0, weight=1)
@@ -564,168 +713,380 @@ class InputPDFInterface(tk.Frame):
         self.create_buttons()
 
     def create_frames(self):
-        self.scrollable_canvas = ScrollableCanvas(self)
+        self.scrollable_canvas = ScrollableCanvas(self, self.create_pdf_row, self.bind_pdf_row, row_height=60)
         self.scrollable_canvas.grid(row=0, column=1, sticky="nsew")
 
+        # Bind to release focus if clicked outside of an entry widget
+        self.scrollable_canvas.canvas.bind("<Button-1>", lambda event: self.scrollable_canvas.focus_set())
+
     def create_buttons(self):
         tk.Label(self, text="PDF files").grid(row=0, column=0, sticky="w")
 
         self.image_paths_button = tk.Button(self, text="Select PDFs", command=self.select_pdf_path)
         self.image_paths_button.grid(row=1, column=1, pady=10, sticky="w")
 
+        # Select the pages containing a text in every file at once
+        search_frame = tk.Frame(self)
+        search_frame.grid(row=2, column=1, pady=5, sticky="w")
+        tk.Label(search_frame, text="Pages containing:").grid(row=0, column=0, padx=5)
+        self.search_entry = tk.Entry(search_frame, width=30)
+        self.search_entry.grid(row=0, column=1, padx=5)
+        search_button = tk.Button(search_frame, text="Select in all files", command=self.select_text_pages)
+        search_button.grid(row=0, column=2, padx=5)
+
     def select_pdf_path(self):
         file_paths = filedialog.askopenfilenames(filetypes=[("PDF Files", "*.pdf")])
-        for file_path in file_paths:
-            if file_path:
-                self.parent.pdf_paths.append(file_path)
-                self.display_pdf_list()
+        self.add_pdf_sources(file_path for file_path in file_paths if file_path)
+
+    def select_text_pages(self):
+        query = self.search_entry.get().strip()
+        if not query:
+            return
+        try:
+            selection = PageSelection.parse(f"text:{query}")
+        except ValueError as error:
+            messagebox.showwarning("Warning!", str(error))
+            return
+        self.parent.pdfs.select_all(selection)
+        self.display_pdf_list()
+
+    def add_pdf_sources(self, sources):
+        """
+        Adds PDF sources to the list: file paths or in-memory buffers (bytes, memoryview, mmap.mmap or BytesIO),
+        e.g. handed over by another application without writing temporary files.
+        """
+        for source in sources:
+            self.parent.pdfs.append(source)  # Its pages are counted when the row is shown for the first time
+        self.display_pdf_list()
 
     def display_pdf_list(self):
-        for widget in self.scrollable_canvas.scrollable_content.winfo_children():
-            widget.destroy()
+        self.scrollable_canvas.set_model(self.parent.pdfs.paths)
 
-        for index, file_path in enumerate(self.parent.pdf_paths):
-            pdf_title = os.path.basename(file_path)
-            last_page = self.get_pdf_page_count(file_path)
+        # Indexes of the entries could change, so the preview is shown again on the next click
+        self.parent.page_preview.clear()
 
-            # Label for the PDF file name
-            label = tk.Label(self.scrollable_canvas.scrollable_content, text=pdf_title, relief="ridge", padx=5, pady=5)
-            label.grid(row=index * 2, column=1, padx=5, pady=5, sticky="w")
+    def create_pdf_row(self, parent):
+        row = tk.Frame(parent)
+        row.index = None
 
-            delete_button = tk.Button(self.scrollable_canvas.scrollable_content, text="X",
-                                      command=lambda idx=index: self.delete_pdf(idx))
-            delete_button.grid(row=index * 2, column=2, padx=2)
+        # Label for the PDF file name
+        row.title_label = tk.Label(row, relief="ridge", padx=5, pady=5)
+        row.title_label.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+        # Show the pages of the file in the preview strip when its name is clicked
+        row.title_label.bind("<Button-1>", lambda event: self.show_preview(row.index))
 
-            # Up and Down buttons to reorder images
-            if index > 0:  # "Up" button is only enabled if it"s not the first item
-                up_button = tk.Button(self.scrollable_canvas.scrollable_content, text="↑",
-                                      command=lambda idx=index: self.move_pdf_up(idx))
-                up_button.grid(row=index * 2, column=3, padx=2)
+        row.delete_button = tk.Button(row, text="X", command=lambda: self.delete_pdf(row.index))
+        row.delete_button.grid(row=0, column=2, padx=2)
 
-            if index < len(self.parent.pdf_paths) - 1:  # "Down" button is only enabled if it"s not the last item
-                down_button = tk.Button(self.scrollable_canvas.scrollable_content, text="↓",
-                                        command=lambda idx=index: self.move_pdf_down(idx))
-                down_button.grid(row=index * 2, column=4, padx=2)
+        # Up and Down buttons to reorder files
+        row.up_button = tk.Button(row, text="↑", command=lambda: self.move_pdf_up(row.index))
+        row.up_button.grid(row=0, column=3, padx=2)
+        row.down_button = tk.Button(row, text="↓", command=lambda: self.move_pdf_down(row.index))
+        row.down_button.grid(row=0, column=4, padx=2)
 
-            pages_entry = tk.Entry(self.scrollable_canvas.scrollable_content, width=30)
-            pages_entry.grid(row=index * 2, column=5, padx=2)
+        row.pages_entry = tk.Entry(row, width=30)
+        row.pages_entry.grid(row=0, column=5, padx=2)
 
-            pages_entry_example = tk.Label(self.scrollable_canvas.scrollable_content,
-                                           text="Enter page ranges (e.g., 1-3,7,10-12):")
-            pages_entry_example.grid(row=index * 2 + 1, column=5, padx=10)
+        pages_entry_example = tk.Label(row, text="Enter page ranges (e.g., 1-3,7,10-12,last-2,even,text:Summary):")
+        pages_entry_example.grid(row=1, column=5, padx=10)
 
-            # Red warning label, initially hidden
-            warning_label = tk.Label(self.scrollable_canvas.scrollable_content, text="", fg="red")
-            warning_label.grid(row=index * 2, column=6, padx=5, pady=5, sticky="w")
+        # Red warning label, initially hidden
+        row.warning_label = tk.Label(row, text="", fg="red")
+        row.warning_label.grid(row=0, column=6, padx=5, pady=5, sticky="w")
 
-            # Bind the Entry widget to trigger validation on key release
-            pages_entry.bind("<KeyRelease>",
-                             lambda event, entry=pages_entry, warning_label=warning_label, file_path=file_path,
-                                    last_page=last_page:
-                             self.validate_input(event, entry, warning_label, file_path, last_page))
+        # Bind the Entry widget to trigger validation on key release
+        row.pages_entry.bind("<KeyRelease>", lambda event: self.validate_input(row))
+        row.pages_entry.bind("<FocusIn>", lambda event: self.show_preview(row.index))
 
-            # Bind focus-out behavior to lose focus when clicked outside
-            pages_entry.bind("<FocusOut>", lambda e: pages_entry.selection_clear())
+        # Bind focus-out behavior to lose focus when clicked outside
+        row.pages_entry.bind("<FocusOut>", lambda event: row.pages_entry.selection_clear())
+        return row
 
-        # Bind to release focus if clicked outside of an entry widget
-        self.scrollable_canvas.bind("<Button-1>", lambda event: self.scrollable_canvas.focus_set())
+    def bind_pdf_row(self, row, index, file_path):
+        row.index = index
+        row.title_label.config(text=source_name(file_path))
+
+        # "Up" button is only shown if it's not the first item, "Down" button if it's not the last item
+        if index > 0:
+            row.up_button.grid()
+        else:
+            row.up_button.grid_remove()
+        if index < len(self.parent.pdfs) - 1:
+            row.down_button.grid()
+        else:
+            row.down_button.grid_remove()
+
+        selection = self.parent.pdfs.selections[index]
+        row.pages_entry.delete(0, tk.END)
+        row.pages_entry.insert(0, selection.expression)
+        # An invalid expression is kept as typed, so its warning is shown again
+        error_message = self.parse_page_ranges(selection.expression, self.get_page_count(index))[1]
+        row.warning_label.config(text=error_message)
+
+    def get_page_count(self, index):
+        return self.parent.pdfs.page_count(index, self.get_pdf_page_count)
+
+    def show_preview(self, index):
+        self.parent.page_preview.show_source(index, self.parent.pdfs.paths[index], self.get_page_count(index),
+                                             self.parent.pdfs.selections[index])
 
     def get_pdf_page_count(self, pdf_path):
         try:
-            pdf_document = pymupdf.open(pdf_path)
-            page_count = pdf_document.page_count
-            pdf_document.close()
-            return page_count
+            # Big scans are memory-mapped rather than read, so counting their pages stays cheap
+            with open_pdf_source(pdf_path, use_mmap="auto") as pdf_document:
+                return pdf_document.page_count
         except Exception:
             return 0  # Return 0 if there was an error opening the file
 
-    def validate_input(self, event, entry, warning_label, file_path, last_page):
-        input_string = entry.get()
-        result, error_message = InputPDFInterface.parse_page_ranges(input_string, last_page)
+    def validate_input(self, row):
+        index = row.index
+        input_string = row.pages_entry.get()
+        result, error_message = InputPDFInterface.parse_page_ranges(input_string, self.get_page_count(index))
         if result is None:
             # Show warning label with the error message if validation fails
-            warning_label.config(text=error_message)
+            row.warning_label.config(text=error_message)
+            # Invalid input selects all pages, as an empty entry does, but the text is kept for the row
+            result = PageSelection(input_string)
         else:
             # Hide warning label if validation succeeds
-            warning_label.config(text="")
-        self.parent.pages_entries[file_path] = result
+            row.warning_label.config(text="")
+        self.parent.pdfs.selections[index] = result
+        if self.parent.page_preview.entry_index == index:
+            self.parent.page_preview.set_selection(result)
 
     @staticmethod
     def parse_page_ranges(input_str, last_page):
-        # Initial validations
-        if input_str.startswith("-") or "--" in input_str or "-," in input_str or ",-" in input_str:
-            return None, "Invalid format: Cannot start with '-', and '-' or ',' cannot be adjacent."
-        
-        page_ranges = []
-        if input_str == "":
-            return page_ranges, ""
-        
-        parts = input_str.split(",")
-        for part in parts:
-            # Check for range (e.g., "1-3" or "10-")
-            if "-" in part:
-                start, end = part.split("-")
-                # Validate the start and end page numbers
-                if not start.isdigit():
-                    return None, f"Invalid range start: '{start}' is not a number."
-                start = int(start)
-                # Handle open-ended range like "10-" as (10, last_page)
-                if end == "":
-                    end = last_page
-                elif not end.isdigit():
-                    return None, f"Invalid range end: '{end}' is not a number."
-                else:
-                    end = int(end)
-                if start > end:
-                    return None, f"Invalid range: Start page {start} cannot be greater than end page {end}."
-                # Ensure pages don"t exceed the last page number
-                if start > last_page or end > last_page:
-                    return None, f"Invalid range: Pages cannot exceed the last page ({last_page})."
-                page_ranges.append((start, end))
-            else:
-                # Validate single page entry
-                if not part.isdigit():
-                    return None, f"Invalid page: '{part}' is not a number."
-                page_num = int(part)
+        """
+        Parses a page selection expression of a file with `last_page` pages.
 
-                # Ensure single page doesn"t exceed the last page number
-                if page_num > last_page:
-                    return None, f"Invalid page: Page {page_num} exceeds the last page ({last_page})."
-                page_ranges.append((page_num,))
-        return page_ranges, ""  # Return the parsed ranges if valid
+        Returns:
+        - tuple: (PageSelection, "") if the expression is valid, otherwise (None, error message).
+        """
+        try:
+            return PageSelection.parse(input_str, last_page), ""
+        except ValueError as error:
+            return None, str(error)
 
     def move_pdf_up(self, index):
         if index > 0:
-            self.parent.pdf_paths[index], self.parent.pdf_paths[index - 1] = self.parent.pdf_paths[index - 1], \
-                                                                             self.parent.pdf_paths[index]
+            self.parent.pdfs.swap(index, index - 1)
             self.display_pdf_list()
 
     def move_pdf_down(self, index):
-        if index < len(self.parent.pdf_paths) - 1:
-            self.parent.pdf_paths[index], self.parent.pdf_paths[index + 1] = self.parent.pdf_paths[index + 1], \
-                                                                             self.parent.pdf_paths[index]
+        if index < len(self.parent.pdfs) - 1:
+            self.parent.pdfs.swap(index, index + 1)
             self.display_pdf_list()
 
     def delete_pdf(self, index):
-        del self.parent.pdf_paths[index]
+        self.parent.pdfs.delete(index)
         self.display_pdf_list()
 
 
+class SaveProfileInterface(tk.Frame):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+
+        self.profile_frame = tk.LabelFrame(self, text="Output optimization")
+        self.profile_frame.grid(row=0, column=0, sticky="w")
+
+        profile_labels = {"fast": "Fast", "compact": "Compact", "web": "Web (linearized)"}
+        for profile in SAVE_PROFILES:
+            tk.Radiobutton(self.profile_frame, text=profile_labels.get(profile, profile),
+                           variable=self.parent.save_profile, value=profile).pack(side="left")
+        # Files made by the same generator embed the same fonts and logos, which are then stored once
+        tk.Checkbutton(self.profile_frame, text="Share identical fonts and images",
+                       variable=self.parent.deduplicate).pack(side="left")
+
+
+class ColorModeInterface(tk.Frame):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+
+        self.color_mode_frame = tk.LabelFrame(self, text="Colors")
+        self.color_mode_frame.grid(row=0, column=0, sticky="w")
+
+        color_mode_labels = {"color": "Color", "gray": "Grayscale", "mono": "Black and white"}
+        for color_mode in COLOR_MODES:
+            tk.Radiobutton(self.color_mode_frame, text=color_mode_labels.get(color_mode, color_mode),
+                           variable=self.parent.color_mode, value=color_mode).pack(side="left")
+
+
+class RasterInterface(tk.Frame):
+    """
+    Option to print heavy vector pages (CAD drawings, maps) as images at the printer resolution,
+    which old printers print much faster than they interpret the original drawing instructions.
+    """
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+
+        tk.Checkbutton(self, text="Rasterize heavy pages at", variable=self.parent.rasterize_heavy_pages,
+                       command=self.toggle_dpi).grid(row=0, column=0, sticky="w")
+        self.dpi_spinbox = tk.Spinbox(self, values=(150, 300, 600, 1200), width=6,
+                                      textvariable=self.parent.raster_dpi, state="disabled")
+        self.parent.raster_dpi.set(RASTER_DPI)
+        self.dpi_spinbox.grid(row=0, column=1)
+        tk.Label(self, text="dpi").grid(row=0, column=2, sticky="w")
+
+    def toggle_dpi(self):
+        self.dpi_spinbox.config(state="normal" if self.parent.rasterize_heavy_pages.get() else "disabled")
+
+
+class PagePreviewStrip(tk.Frame):
+    """
+    A horizontal strip of page thumbnails of one PDF file. Only the thumbnails of visible pages are drawn
+    and rendered (in the background by ThumbnailRenderer), and the pages picked by the page selection of
+    the file are highlighted. The text queries of the selection are resolved through the page index of the
+    window, like the merge engine resolves them, on the thread of the renderer: indexing a file takes seconds,
+    so the highlight follows once the matches are known.
+    """
+    cell_width = 150
+    cell_height = 215
+    overscan = 2  # Number of pages rendered ahead on both sides of the visible ones
+    poll_interval = 50  # ms between checks for newly rendered thumbnails
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.renderer = ThumbnailRenderer()
+        self.page_index = parent.page_index
+        self.entry_index = None
+        self.source = None
+        self.page_count = 0
+        self.selected_pages = set()
+        self.selection_key = 0  # Increased for every selection, so results for an older one are dropped
+        self.photos = {}  # page index -> PhotoImage of the currently drawn thumbnails
+
+        self.canvas = tk.Canvas(self, height=self.cell_height, highlightthickness=0)
+        self.horizontal_scrollbar = ttk.Scrollbar(self, orient="horizontal", command=self.on_scroll)
+        self.canvas.configure(xscrollcommand=self.horizontal_scrollbar.set)
+        self.canvas.pack(side="top", fill="x", expand=True)
+        self.horizontal_scrollbar.pack(side="bottom", fill="x")
+
+        self.canvas.bind("<Configure>", lambda event: self.refresh())
+        self.bind("<Destroy>", self.on_destroy)
+        self.after(self.poll_interval, self.poll_renderer)
+
+    def show_source(self, entry_index, source, page_count, selection):
+        if entry_index == self.entry_index and page_count == self.page_count:
+            self.set_selection(selection)
+            return
+        self.entry_index = entry_index
+        self.source = source
+        self.page_count = page_count
+        self.renderer.show(source if isinstance(source, str) else id(source), source)
+        self.photos = {}
+        self.selected_pages = set()
+        self.request_selection(selection)
+        self.canvas.configure(scrollregion=(0, 0, page_count * self.cell_width, self.cell_height))
+        self.canvas.xview_moveto(0)
+        self.refresh()
+
+    def set_selection(self, selection):
+        self.request_selection(selection)
+        self.refresh()
+
+    def request_selection(self, selection):
+        self.selection_key += 1
+        # An empty selection means all pages, so nothing is highlighted
+        if not selection:
+            self.selected_pages = set()
+        elif not selection.queries:
+            self.selected_pages = selection.page_set(self.page_count)
+        else:
+            # The current highlight stays until the matches of the new selection are known
+            source, page_count, page_index = self.source, self.page_count, self.page_index
+            self.renderer.resolve(self.selection_key, lambda: selection.page_set(
+                page_count, selection_matches([source], [selection], page_index)[0]))
+
+    def clear(self):
+        self.selection_key += 1
+        self.entry_index = None
+        self.source = None
+        self.page_count = 0
+        self.photos = {}
+        self.canvas.configure(scrollregion=(0, 0, 0, 0))
+        self.refresh()
+
+    def on_scroll(self, *args):
+        self.canvas.xview(*args)
+        self.refresh()
+
+    def visible_pages(self):
+        left = self.canvas.canvasx(0)
+        right = left + self.canvas.winfo_width()
+        first = max(int(left // self.cell_width) - self.overscan, 0)
+        last = min(int(right // self.cell_width) + self.overscan, self.page_count - 1)
+        return range(first, last + 1)
+
+    def refresh(self):
+        self.canvas.delete("page")
+        pages = self.visible_pages()
+        photos = {}
+        for page_index in pages:
+            x = page_index * self.cell_width
+            outline = "red" if page_index in self.selected_pages else "grey"
+            self.canvas.create_rectangle(x + 2, 2, x + self.cell_width - 2, self.cell_height - 2,
+                                         outline=outline, width=3 if outline == "red" else 1, tags="page")
+            photo = self.photos.get(page_index)
+            if photo is None:
+                thumbnail = self.renderer.get(page_index)
+                if thumbnail is not None:
+                    photo = tk.PhotoImage(data=thumbnail)
+            if photo is not None:
+                photos[page_index] = photo
+                self.canvas.create_image(x + self.cell_width / 2, self.cell_height / 2 - 8, image=photo, tags="page")
+            self.canvas.create_text(x + self.cell_width / 2, self.cell_height - 10, text=str(page_index + 1),
+                                    tags="page")
+        # Keep references only to the drawn thumbnails, the renderer's cache keeps the rest
+        self.photos = photos
+        self.renderer.request(page for page in pages if page not in photos)
+
+    def poll_renderer(self):
+        resolved = self.renderer.take_resolved()
+        if resolved is not None and resolved[0] == self.selection_key:
+            self.selected_pages = resolved[1] or set()
+            self.refresh()
+        elif self.renderer.take_rendered():
+            self.refresh()
+        self.after(self.poll_interval, self.poll_renderer)
+
+    def on_destroy(self, event):
+        if event.widget is self:
+            self.renderer.close()
+
+
 class PDFsFileCreation(tk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
 
         tk.Button(self, text="Generate PDF", command=self.generate_pdf).grid(row=0, column=0, columnspan=5, pady=10)
+        self.progress_bar = ttk.Progressbar(self, length=200, mode="determinate")
 
     def generate_pdf(self):
         # Retrieve values from GUI fields
         output_path = self.parent.output_path_file if self.parent.output_path.get() else None
-        pdf_paths = self.parent.pdf_paths
-        page_selections = [entry for entry in
-                           self.parent.pages_entries.values()] if not self.parent.page_selections else None
-
-        self.generated_pdf = extract_and_merge_pdfs(pdf_paths, page_selections, output_path)
+        pdfs = self.parent.pdfs
+        rasterize = "heavy" if self.parent.rasterize_heavy_pages.get() else None
+
+        self.generated_pdf = extract_and_merge_pdfs(pdfs.paths, pdfs.selections, output_path,
+                                                    save_profile=self.parent.save_profile.get(), use_mmap="auto",
+                                                    color_mode=self.parent.color_mode.get(), rasterize=rasterize,
+                                                    raster_dpi=self.parent.raster_dpi.get(),
+                                                    page_index=self.parent.page_index,
+                                                    deduplicate=self.parent.deduplicate.get(),
+                                                    observer=self.create_progress_observer())
+        self.progress_bar.grid_remove()
+        # Sources held in memory cannot be stored in a job journal, such a job is printed from its output
+        self.job = None
+        if all(isinstance(path, str) for path in pdfs.paths):
+            self.job = ("merge", {"pdf_paths": list(pdfs.paths), "page_selections": list(pdfs.selections),
+                                  "save_profile": self.parent.save_profile.get(), "use_mmap": "auto",
+                                  "color_mode": self.parent.color_mode.get(), "rasterize": rasterize,
+                                  "raster_dpi": self.parent.raster_dpi.get(),
+                                  "deduplicate": self.parent.deduplicate.get()})
 
         # Optional feedback for success
         messagebox.showinfo("Success", "PDF generated successfully!")
@@ -734,23 +1095,35 @@ class PDFsFileCreation(tk.Frame):
         self.print_button = tk.Button(self, text="Print", command=self.open_print_window)
         self.print_button.grid(row=1, column=0, padx=10, pady=10)
 
+    def create_progress_observer(self):
+        self.progress_bar.grid(row=2, column=0, padx=10, pady=5)
+        return progress_observer(self.show_progress)
+
+    def show_progress(self, done, total):
+        self.progress_bar.config(maximum=max(total, 1), value=done)
+        # The job runs in the GUI thread, so the bar has to be redrawn explicitly
+        self.progress_bar.update_idletasks()
+
     def open_print_window(self):
-        PrintWindow(self, self.generated_pdf)
+        PrintWindow(self, self.generated_pdf, self.job)
 
 
 class PrintWindow(tk.Toplevel):
-    def __init__(self, master, pdf_buffer_or_path):
+    def __init__(self, master, pdf_buffer_or_path, job=None):
         """
         Initialize the PrintWindow for configuring print options.
 
         :param master: Parent window
         :param pdf_buffer_or_path: PDF buffer or file path to print
+        :param job: (engine, arguments) of the job which generated the PDF, see job_journal.run_job. If given,
+            the job is printed in journaled chunks instead, so a crash while printing can be resumed
         """
         super().__init__(master)
         self.title("Printer Settings")
         self.iconbitmap(resource_path("printer.ico"))
 
         self.pdf_buffer_or_path = pdf_buffer_or_path
+        self.job = job
         self.printer_name = None
         self.printer_manager = PrinterManager()
         self.temp_pdf_path = None
@@ -759,14 +1132,12 @@ class PrintWindow(tk.Toplevel):
         self.create_widgets()
 
     def create_widgets(self):
-        # Printer selection
+        # Printer selection, filled from the printer registry and updated when its background refresh lands
         tk.Label(self, text="List of available printers:").grid(row=0, column=0, padx=10, pady=5)
-        printers = self.printer_manager.list_printers()
-        self.printer_name = self.printer_manager.get_default_printer_name()
-        self.printer_list = ttk.Combobox(self, values=printers, state="readonly")
-        self.printer_list.current(printers.index(self.printer_name))
+        self.printer_list = ttk.Combobox(self, state="readonly")
         self.printer_list.grid(row=0, column=1, padx=10, pady=5)
         self.printer_list.bind("<<ComboboxSelected>>", self.select_printer)
+        self.registry_version = None
 
         # Copies
         tk.Label(self, text="Number of copies:").grid(row=1, column=0, padx=10, pady=5)
@@ -808,8 +1179,48 @@ class PrintWindow(tk.Toplevel):
         # Print Button
         tk.Button(self, text="Print", command=self.initiate_print).grid(row=5, column=0, columnspan=3, pady=10)
 
+        self.update_printers()
+
+    def update_printers(self):
+        """Shows the cached printers, and polls the registry until its refresh has landed."""
+        # Checked before the version is read, so a refresh which ends in between is shown by one more poll
+        refreshing = printer_registry.refreshing
+        version = printer_registry.version
+        if version != self.registry_version:
+            self.registry_version = version
+            printers, default_printer = printer_registry.snapshot()
+            names = [printer["name"] for printer in printers]
+            self.printer_list["values"] = names
+            if self.printer_name not in names:
+                # Keep the user's choice, otherwise preselect the default printer
+                self.printer_name = default_printer if default_printer in names else (names[0] if names else None)
+            if self.printer_name:
+                self.printer_list.set(self.printer_name)
+                self.apply_capabilities()
+            elif printer_registry.error is not None:
+                self.printer_list.set("No printers found")
+            else:
+                self.printer_list.set("Looking for printers...")
+        # Also polls a refresh which the snapshot above has just started
+        if refreshing or printer_registry.refreshing:
+            self.after(100, self.update_printers)
+
+    def apply_capabilities(self):
+        """Limits the copies and duplex options to what the selected printer supports."""
+        printer = printer_registry.get_printer(self.printer_name)
+        if printer is None:
+            return
+        self.copies_spinbox.config(to=printer["max_copies"] or 100)
+        if printer["duplex"] is False:
+            self.duplex.set(False)
+            self.duplex_checkbox.config(state="disabled")
+            self.toggle_flip_side()
+        else:
+            self.duplex_checkbox.config(state="normal")
+
     def select_printer(self, event):
         self.printer_name = self.printer_list.get()
+        self.apply_capabilities()
 
     def check_sort_copies(self):
         if int(self.copies_spinbox.get()) > 1:
@@ -840,6 +1251,19 @@ class PrintWindow(tk.Toplevel):
         flip_side = self.flip_side.get()
         sort_copies = self.sort_copies.get()
 
+        if self.job is not None:
+            engine, arguments = self.job
+            print_options = {"copies": copies, "orientation": orientation, "duplex": duplex, "flip_side": flip_side,
+                             "sort_copies": sort_copies}
+            try:
+                run_job(engine, arguments, printer=self.printer_name, print_options=print_options)
+                messagebox.showinfo("Success",
+                                    "The file is on printer. Wait the printer will finish its job. Good luck!")
+            except Exception as exception:
+                messagebox.showerror("Error", f"An error occurs during printing: \"{exception}\"! "
+                                              "Please, check printer setting or select another printer")
+            return
+
         self.printer_manager = PrinterManager(self.printer_name)
         # Call the print function with parameters
         if isinstance(self.pdf_buffer_or_path, io.BytesIO):
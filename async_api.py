@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import os
+import time
+
+from create_file import add_images_to_pdf_in_grid, create_pdf_with_best_orientation_images, extract_and_merge_pdfs
+from metrics import PRINT_FAILURES, PRINTER_QUEUE_DURATION, SPOOL_DURATION
+
+# Seconds between checks of the printer queue, as in PrinterManager.wait_for_file_in_queue
+SPOOLER_POLL_INTERVAL = 0.1
+QUEUE_POLL_INTERVAL = 1.0
+
+
+async def _run_in_executor(executor, function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+async def add_images_to_pdf_in_grid_async(*args, executor=None, **kwargs):
+    """
+    Awaitable version of `create_file.add_images_to_pdf_in_grid`, taking the same arguments.
+
+    The work runs in `executor`, or in the default executor of the event loop if it's None. The engines are
+    CPU-bound, so pass a `concurrent.futures.ProcessPoolExecutor` to generate several documents in parallel.
+    An `observer` is called in the executor, so with a process pool it must be picklable.
+    """
+    return await _run_in_executor(executor, add_images_to_pdf_in_grid, *args, **kwargs)
+
+
+async def create_pdf_with_best_orientation_images_async(*args, executor=None, **kwargs):
+    """Awaitable version of `create_file.create_pdf_with_best_orientation_images`, see `add_images_to_pdf_in_grid_async`."""
+    return await _run_in_executor(executor, create_pdf_with_best_orientation_images, *args, **kwargs)
+
+
+async def extract_and_merge_pdfs_async(*args, executor=None, **kwargs):
+    """Awaitable version of `create_file.extract_and_merge_pdfs`, see `add_images_to_pdf_in_grid_async`."""
+    return await _run_in_executor(executor, extract_and_merge_pdfs, *args, **kwargs)
+
+
+async def print_pdf_async(path, printer_name=None, copies=1, orientation=1, duplex=True, flip_side="long",
+                          sort_copies=False):
+    """
+    Prints a PDF file like `PrinterManager.print_pdf`, but waits for the spooler on the event loop instead of
+    blocking a thread, so any number of print jobs can be followed concurrently. The spooling and queue times
+    and failures are recorded in the metrics of the printer, as by `print_pdf`.
+
+    Yields a status dict with "state", "printer" and "document" keys whenever the job moves on. The states are:
+    - "configured": the printer settings are applied.
+    - "submitted": the file was handed to the PDF viewer for printing.
+    - "queued": the document arrived in the printer queue.
+    - "printed": the document left the printer queue.
+    - "failed": an error occurred, its message is in the "error" key. The exception is raised after that.
+
+    Usage:
+        async for status in print_pdf_async("file.pdf", copies=2):
+            print(status["state"])
+    """
+    # Imported here, so the generation functions can be used where the Windows printing modules are missing
+    from printer_utils import PrinterManager
+
+    printer_manager = PrinterManager(printer_name)
+    document = os.path.basename(path)
+
+    def status(state, **fields):
+        return {"state": state, "printer": printer_manager.printer_name, "document": document, **fields}
+
+    # The short win32 calls run in a thread, the waiting happens on the event loop
+    printer_settings = None
+    try:
+        printer_settings = await asyncio.to_thread(printer_manager.configure_printer, copies, orientation, duplex,
+                                                   flip_side, sort_copies)
+        await asyncio.sleep(1)
+        await asyncio.to_thread(printer_manager.apply_printer_settings, printer_settings)
+        yield status("configured")
+
+        await asyncio.to_thread(printer_manager.submit_file, path)
+        submitted = time.monotonic()
+        yield status("submitted")
+
+        while not await asyncio.to_thread(printer_manager.is_file_in_printer_queue, document):
+            await asyncio.sleep(SPOOLER_POLL_INTERVAL)
+        queued = time.monotonic()
+        SPOOL_DURATION.observe(queued - submitted, printer=printer_manager.printer_name)
+        yield status("queued")
+
+        while await asyncio.to_thread(printer_manager.is_file_in_printer_queue, document):
+            await asyncio.sleep(QUEUE_POLL_INTERVAL)
+        PRINTER_QUEUE_DURATION.observe(time.monotonic() - queued, printer=printer_manager.printer_name)
+        yield status("printed")
+    except Exception as error:
+        PRINT_FAILURES.inc(printer=printer_manager.printer_name or "default")
+        yield status("failed", error=str(error))
+        raise
+    finally:
+        # Nothing to restore if the printer could not be configured, and only an opened handle is closed
+        if printer_settings is not None:
+            await asyncio.to_thread(printer_manager.restore_printer, printer_settings)
+            await asyncio.sleep(2)
+        if printer_manager.printer_handler:
+            await asyncio.to_thread(printer_manager.close_printer)
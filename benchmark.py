@@ -0,0 +1,275 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pymupdf
+from PIL import Image
+
+from create_file import (SAVE_PROFILES, add_images_to_pdf_in_grid, add_images_to_template,
+                         create_pdf_with_best_orientation_images, extract_and_merge_pdfs, save_pdf_document)
+from layout_template import LayoutTemplate
+from memory_usage import peak_rss_bytes
+
+# Relative wall time, peak RSS or output size growth which is reported as a regression
+DEFAULT_THRESHOLD = 0.2
+# Selections of pages of every source file in merge cases, from one insert per file to one insert per page
+MERGE_SELECTIONS = {"all": "", "contiguous": "2-", "odd": "odd", "scattered": "1,5,3,9,7,12,11,20,15"}
+
+
+def benchmark_save_profiles(pdf_paths, page_selections=None, repeats=3):
+    """
+    Merges the given PDF files once and measures how long every save profile takes
+    to write the merged document and how big the result is.
+
+    Parameters:
+    - pdf_paths (list of str): Paths to the source PDF files.
+    - page_selections (list or None): Page selections in the same format as for `extract_and_merge_pdfs`.
+    - repeats (int): How many times each profile is saved. The best time is reported.
+
+    Returns:
+    - list of dict: One entry per profile with "profile", "seconds" and "bytes" keys.
+    """
+    merged_bytes = extract_and_merge_pdfs(pdf_paths, page_selections).getvalue()
+
+    results = []
+    for profile in SAVE_PROFILES:
+        best_time = None
+        output_size = 0
+        for _ in range(repeats):
+            # Reopen the merged document every time, so font subsetting and garbage collection
+            # of a previous run do not make the next one look faster
+            with pymupdf.open(stream=merged_bytes) as merged_pdf:
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                try:
+                    save_pdf_document(merged_pdf, buffer, profile)
+                except Exception as error:
+                    # e.g. linearization is not supported by the installed MuPDF build
+                    print(f"Profile '{profile}' failed: {error}")
+                    break
+                elapsed = time.perf_counter() - start
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+            output_size = buffer.getbuffer().nbytes
+        if best_time is not None:
+            results.append({"profile": profile, "seconds": best_time, "bytes": output_size})
+    return results
+
+
+def print_save_profiles_report(results):
+    print(f"{'profile':<10}{'save time, s':>14}{'size, KiB':>14}")
+    for result in results:
+        print(f"{result['profile']:<10}{result['seconds']:>14.3f}{result['bytes'] / 1024:>14.1f}")
+
+
+def generate_image(path, long_side, seed, image_format):
+    """
+    Writes a synthetic photo-like image: smooth random color fields, so JPEG and PNG compress it
+    roughly like a real photo or scan. Every other image is portrait to exercise the orientation logic.
+    """
+    generator = random.Random(seed)
+    short_side = long_side * 3 // 4
+    size = (long_side, short_side) if seed % 2 else (short_side, long_side)
+    coarse_size = (max(size[0] // 32, 2), max(size[1] // 32, 2))
+    coarse = Image.frombytes("RGB", coarse_size, generator.randbytes(coarse_size[0] * coarse_size[1] * 3))
+    image = coarse.resize(size, Image.Resampling.BILINEAR)
+    if image_format == "jpeg":
+        image.save(path, "JPEG", quality=85)
+    else:
+        image.save(path, "PNG")
+
+
+def generate_pdf(path, pages, seed):
+    """Writes a synthetic multi-page PDF with text and vector graphics on every page."""
+    generator = random.Random(seed)
+    with pymupdf.open() as pdf_document:
+        for page_number in range(pages):
+            page = pdf_document.new_page()
+            page.insert_text((72, 72), f"Synthetic document {seed}, page {page_number + 1}", fontsize=14)
+            for line in range(40):
+                words = " ".join(f"{generator.randrange(10 ** 6):06d}" for _ in range(8))
+                page.insert_text((72, 100 + line * 16), words, fontsize=9)
+            for _ in range(20):
+                x, y = generator.uniform(50, 500), generator.uniform(50, 750)
+                page.draw_rect(pymupdf.Rect(x, y, x + 40, y + 20), color=(0, 0, 1), fill=(0.8, 0.8, 1))
+        pdf_document.save(path, garbage=1, deflate=True)
+
+
+def build_fixtures(fixtures_dir, quick=False):
+    """
+    Generates the synthetic fixtures once; files which already exist are reused, so repeated runs
+    compare the engines on identical inputs.
+
+    Returns:
+    - dict: Lists of fixture paths keyed by "<format>_<long side>" for images and "pdf" for PDF files.
+    """
+    os.makedirs(fixtures_dir, exist_ok=True)
+    image_count = 16 if quick else 64
+    resolutions = (800,) if quick else (800, 2400)
+    pdf_count, pdf_pages = (5, 20) if quick else (40, 20)
+
+    fixtures = {}
+    for image_format, extension in (("jpeg", "jpg"), ("png", "png")):
+        for long_side in resolutions:
+            paths = []
+            for seed in range(image_count):
+                path = os.path.join(fixtures_dir, f"{image_format}_{long_side}_{seed:03d}.{extension}")
+                if not os.path.exists(path):
+                    generate_image(path, long_side, seed, image_format)
+                paths.append(path)
+            fixtures[f"{image_format}_{long_side}"] = paths
+
+    fixtures["pdf"] = []
+    for seed in range(pdf_count):
+        path = os.path.join(fixtures_dir, f"document_{pdf_pages}p_{seed:03d}.pdf")
+        if not os.path.exists(path):
+            generate_pdf(path, pdf_pages, seed)
+        fixtures["pdf"].append(path)
+    return fixtures
+
+
+def suite_cases(fixtures):
+    """Returns the benchmark cases which can be run with the given fixtures."""
+    cases = []
+    image_sets = [key for key in fixtures if key != "pdf"]
+    for image_set in image_sets:
+        available = len(fixtures[image_set])
+        for count in sorted({available // 4, available}):
+            for columns, rows in ((1, 1), (2, 2), (4, 4)):
+                cases.append({"name": f"grid_{columns}x{rows}_{image_set}_x{count}", "engine": "grid",
+                              "images": image_set, "count": count, "columns": columns, "rows": rows})
+            cases.append({"name": f"best_orientation_2x2_{image_set}_x{count}", "engine": "best_orientation",
+                          "images": image_set, "count": count, "columns": 2, "rows": 2})
+            # A badge sheet: photos clipped to their slots, with cut guides
+            cases.append({"name": f"template_2x4_cover_{image_set}_x{count}", "engine": "template",
+                          "images": image_set, "count": count, "columns": 2, "rows": 4})
+    for selection_name in MERGE_SELECTIONS:
+        cases.append({"name": f"merge_{selection_name}_x{len(fixtures['pdf'])}", "engine": "merge",
+                      "selection": selection_name})
+    return cases
+
+
+def run_case(case, fixtures, repeats):
+    """Runs one case in the current process and returns its best wall time, peak RSS and output size."""
+    if case["engine"] == "merge":
+        pdf_paths = fixtures["pdf"]
+        selections = [MERGE_SELECTIONS[case["selection"]]] * len(pdf_paths)
+        job = lambda: extract_and_merge_pdfs(pdf_paths, selections)
+    else:
+        image_paths = fixtures[case["images"]][:case["count"]]
+        if case["engine"] == "template":
+            template = LayoutTemplate(case["name"], case["columns"], case["rows"], page_margin=20, image_margin=6,
+                                      fit="cover", outline=True)
+            job = lambda: add_images_to_template(template, image_paths=list(image_paths))
+        else:
+            engine = add_images_to_pdf_in_grid if case["engine"] == "grid" else create_pdf_with_best_orientation_images
+            job = lambda: engine(image_paths=list(image_paths), columns=case["columns"], rows=case["rows"])
+
+    best_time = None
+    output_bytes = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output_buffer = job()
+        elapsed = time.perf_counter() - start
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+        output_bytes = output_buffer.getbuffer().nbytes
+    return {"name": case["name"], "wall_seconds": best_time, "peak_rss_bytes": peak_rss_bytes(),
+            "output_bytes": output_bytes}
+
+
+def run_suite(fixtures_dir, repeats=3, quick=False, name_filter=None):
+    """
+    Runs every benchmark case in a fresh process, so the peak RSS of one case is not hidden by another.
+
+    Returns:
+    - dict: Results with "environment" and "cases" keys, ready to be written as JSON.
+    """
+    fixtures = build_fixtures(fixtures_dir, quick)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in suite_cases(fixtures):
+        if name_filter and name_filter not in case["name"]:
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_case, case, fixtures, repeats).result()
+        print(f"{result['name']:<45}{result['wall_seconds']:>10.3f} s{result['peak_rss_bytes'] / 2 ** 20:>10.1f} MiB"
+              f"{result['output_bytes'] / 1024:>12.1f} KiB")
+        results.append(result)
+    return {
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform(),
+                        "pymupdf": pymupdf.VersionBind, "repeats": repeats, "quick": quick},
+        "cases": results,
+    }
+
+
+def compare_with_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares suite results with baseline results.
+
+    Returns:
+    - list of str: One message for every metric of a case which grew by more than `threshold` (a fraction).
+    """
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        baseline_case = baseline_cases.get(case["name"])
+        if baseline_case is None:
+            continue
+        for metric in ("wall_seconds", "peak_rss_bytes", "output_bytes"):
+            old_value, new_value = baseline_case.get(metric), case.get(metric)
+            if old_value and new_value is not None and new_value > old_value * (1 + threshold):
+                regressions.append(f"{case['name']}: {metric} {old_value:.6g} -> {new_value:.6g} "
+                                   f"(+{(new_value / old_value - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the PDF engines.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    profiles_parser = subparsers.add_parser("profiles", help="compare save profiles of merged PDF files")
+    profiles_parser.add_argument("pdf_paths", nargs="+", help="PDF files to merge")
+    profiles_parser.add_argument("--repeats", type=int, default=3, help="number of saves per profile")
+
+    suite_parser = subparsers.add_parser("suite", help="run the engines on synthetic fixtures")
+    suite_parser.add_argument("--fixtures", default="bench_fixtures", help="directory for generated fixtures")
+    suite_parser.add_argument("--repeats", type=int, default=3, help="number of runs per case, the best is kept")
+    suite_parser.add_argument("--quick", action="store_true", help="use fewer and smaller fixtures")
+    suite_parser.add_argument("--filter", help="run only cases with this text in their names")
+    suite_parser.add_argument("--output", default="bench_results.json", help="file to write the results to")
+    suite_parser.add_argument("--baseline", help="results file to compare with")
+    suite_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                              help="relative growth reported as a regression (default: 0.2)")
+    args = parser.parse_args()
+
+    if args.command == "profiles":
+        missing = [path for path in args.pdf_paths if not os.path.exists(path)]
+        if missing:
+            parser.error(f"File not found: {', '.join(missing)}")
+        print_save_profiles_report(benchmark_save_profiles(args.pdf_paths, repeats=args.repeats))
+        return 0
+
+    results = run_suite(args.fixtures, args.repeats, args.quick, args.filter)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
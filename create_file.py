@@ -1,12 +1,120 @@
+import hashlib
 import io
+import logging
 import math
+import mmap
 import os
+import re
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import count, repeat
 
 from reportlab.pdfgen import canvas
+from reportlab.lib.boxstuff import aspectRatioFix
 from reportlab.lib.pagesizes import A4, landscape, portrait
 from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from PIL import Image, ImageSequence
 import pymupdf
 
+from instrumentation import job_reporter, output_size
+from layout_template import LayoutTemplate
+from memory_usage import MemoryBudget
+from metrics import cache_lookup
+from page_index import PageIndex, selection_matches
+from page_selection import PageSelection
+from split_policy import SplitPolicy, part_path
+
+logger = logging.getLogger(__name__)
+
+# Options passed to pymupdf.Document.save() for each output profile:
+# - "fast": default save, no clean-up, quickest to write.
+# - "compact": drop unused and duplicated objects, compress streams, pack objects into object streams
+#   and subset embedded fonts. Slower to save, smallest output.
+# - "web": like "compact", but linearized for fast first-page display from network shares.
+#   Linearization cannot be combined with object streams. PyMuPDF 1.25 and later no longer linearize
+#   (see LINEARIZATION_SUPPORTED), there "web" saves like "compact".
+SAVE_PROFILES = {
+    "fast": {},
+    "compact": {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True, "use_objstms": 1},
+    "web": {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True, "linear": True},
+}
+# Profiles that also subset embedded fonts before saving
+SUBSET_FONTS_PROFILES = ("compact", "web")
+# requirements.txt pins PyMuPDF 1.24, the last version which can linearize
+LINEARIZATION_SUPPORTED = pymupdf.pymupdf_version_tuple < (1, 25)
+
+# Image files which can hold several pages (frames), every frame is placed in its own grid cell
+MULTI_FRAME_EXTENSIONS = (".tif", ".tiff")
+# Images and frames with more pixels, such as 600-DPI A3 scans, are decoded at a reduced size which is
+# still big enough to print their grid cell at LARGE_IMAGE_DPI
+LARGE_IMAGE_PIXELS = 24 * 1024 * 1024
+LARGE_IMAGE_DPI = 300
+# EXIF orientation of photos (tag 0x0112) -> (a, b, c, d) of the drawing transformation which shows the stored
+# pixels upright. The orientation is folded into the transformation the image is drawn with rather than applied
+# to the pixels, so JPEG photos are still embedded as they are, without being decoded or re-encoded.
+# Orientations 5 to 8 swap the width and height of the image
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_ORIENTATION_MATRICES = {
+    1: (1, 0, 0, 1),
+    2: (-1, 0, 0, 1),  # mirrored left to right
+    3: (-1, 0, 0, -1),  # upside down
+    4: (1, 0, 0, -1),  # mirrored top to bottom
+    5: (0, -1, -1, 0),  # mirrored along the top-left to bottom-right diagonal
+    6: (0, -1, 1, 0),  # turned 90 degrees counterclockwise, shown turned clockwise
+    7: (0, 1, 1, 0),  # mirrored along the top-right to bottom-left diagonal
+    8: (0, 1, -1, 0),  # turned 90 degrees clockwise, shown turned counterclockwise
+}
+
+# Color modes of the output, to keep the spool small on monochrome printers:
+# - "color": images and pages are kept as they are.
+# - "gray": images, and in merged PDFs also text and vector graphics, are converted to grayscale.
+# - "mono": like "gray", but images are dithered to black and white, the smallest output for scans.
+COLOR_MODES = ("color", "gray", "mono")
+# JPEG quality of photos re-encoded in grayscale
+GRAY_JPEG_QUALITY = 90
+# Image filters of lossy-compressed images, which are re-encoded as JPEG after conversion to grayscale
+LOSSY_IMAGE_FILTERS = ("DCTDecode", "JPXDecode")
+
+# Pages whose drawing instructions (content streams and the forms they use) are bigger than this are heavy:
+# vector CAD drawings and maps which take old printers minutes per page to interpret
+HEAVY_PAGE_CONTENT_BYTES = 1024 * 1024
+# Default resolution of rasterized pages, in dots per inch
+RASTER_DPI = 300
+
+# Fields of an overlay drawn on every page of the output:
+# - "stamp": a big diagonal text across the page, such as "COPY".
+# - "text": a line of text in the top left corner, such as the job ID.
+# - "page_numbers": True, or a format string with {page} and {pages} fields, drawn at the bottom center.
+# - "first_page", "page_count": the number of the first page and the total number of pages shown by the page
+#   numbers, when the output is a part of a bigger document. By default 1 and the pages of the output.
+# The stamp and the text are drawn once into a form XObject shared by all pages of the same size, every page
+# only draws its page number and references the form.
+OVERLAY_FIELDS = ("stamp", "text", "page_numbers", "first_page", "page_count")
+PAGE_NUMBER_FORMAT = "Page {page} of {pages}"
+OVERLAY_FONT = "Helvetica"
+OVERLAY_FONT_SIZE = 9
+# Distance of the overlay text from the page edges, in points
+OVERLAY_MARGIN = 18
+# Name of the form holding the static page content of a layout template, see LayoutTemplate.draw_skeleton
+SKELETON_FORM = "skeleton"
+
+# Objects which keep their identity when a merged document is deduplicated (see `deduplicate_resources`), even
+# if they look alike: pages, the page tree, outline items and form fields. Annotations are found through the
+# /Annots of the pages instead, since the ones copied by insert_pdf have neither /Type/Annot nor /P.
+UNSHARED_OBJECT_KEYS = ("/Type/Page", "/Type/Catalog", "/Parent", "/FT")
+# An indirect reference in the source of a PDF object
+PDF_REFERENCE = re.compile(r"\b(\d+) 0 R\b")
+
+# Files at least this big are opened through mmap when `use_mmap` is "auto"
+MMAP_THRESHOLD = 256 * 1024 * 1024
+# Once a job is over its memory budget, the pages generated or copied since the last spill are written to disk
+# whenever their estimated size reaches this fraction of the budget, see memory_usage.MemoryBudget
+SPILL_FRACTION = 0.25
+
 
 def add_images_to_pdf_in_grid(
         output_path=None,
@@ -16,109 +124,186 @@ def add_images_to_pdf_in_grid(
         angles=None,
         orientation="portrait",
         page_margin=0,
-        image_margin=0):
+        image_margin=0,
+        color_mode="color",
+        overlay=None,
+        split=None,
+        memory_budget=None,
+        observer=None):
     """
     Creates a PDF file with images arranged in a grid format on each page, with configurable rotation,
     margins, and orientation.
 
     Parameters:
     - output_path (str or None): The file path where the PDF should be saved. If None, the PDF is saved to a buffer.
-    - image_paths (list of str): A list of file paths to the images to include in the PDF.
+    - image_paths (list of str): A list of file paths to the images to include in the PDF. Every frame of
+      a multi-frame TIFF file takes its own cell.
     - columns (int): Number of columns in the grid layout.
     - rows (int): Number of rows in the grid layout.
-    - angles (list of int or None): A list of rotation angles (in degrees) for each image.
+    - angles (list of int or None): A list (or array) of rotation angles (in degrees) for each image file.
       If None, no rotation is applied. If the list has fewer items than `image_paths`, the remaining images will not be rotated.
     - orientation (str): Page orientation, either "portrait" or "landscape".
     - page_margin (int or float): The margin in points between the content and the page edges.
     - image_margin (int or float): The margin in points between each image within the grid.
+    - color_mode (str): One of COLOR_MODES. In "gray" and "mono" modes every unique image is converted once.
+    - overlay (dict or None): A stamp, text and page numbers drawn on every page, see OVERLAY_FIELDS.
+    - split (SplitPolicy, dict or None): Split the output into several files, by pages, size or source file.
+      See SplitPolicy. With `by_source`, every image file starts a new page.
+    - memory_budget (int or None): Bytes of memory the job may use. Once it's over budget, the finished pages
+      and the converted images are kept in temporary files rather than in memory. See memory_usage.MemoryBudget.
+    - observer (callable or None): Called with a dict for every stage of the job, see instrumentation.EVENTS.
 
     Returns:
     - BytesIO or None: If `output_path` is None, returns an in-memory BytesIO object containing the PDF.
       If `output_path` is specified, saves the PDF to the file and returns None.
+    - With a split policy, returns a list of the files: paths numbered after output_path ("images_001.pdf", ...),
+      or BytesIO buffers.
     """
-    if orientation == "landscape":
-        page_width, page_height = landscape(A4)
-    else:
-        page_width, page_height = portrait(A4)
+    if image_paths is None:
+        raise ValueError("image_paths must be provided and cannot be empty.")
+    # The same layout as a template, computed anew for every call
+    template = LayoutTemplate(None, columns, rows, "landscape" if orientation == "landscape" else "portrait",
+                              page_margin, image_margin)
+    return fill_layout_template(template, "grid", output_path, image_paths, angles, color_mode, overlay, split,
+                                memory_budget, observer)
 
-    # Set up the canvas to write to the provided output (file or buffer)
-    if output_path:
-        # Set up the canvas and page size based on orientation
-        c = canvas.Canvas(output_path, pagesize=(page_width, page_height))
-    else:
-        output_buffer = io.BytesIO()
-        c = canvas.Canvas(output_buffer, pagesize=(page_width, page_height))
 
+def add_images_to_template(
+        template,
+        output_path=None,
+        image_paths=None,
+        angles=None,
+        color_mode="color",
+        overlay=None,
+        split=None,
+        memory_budget=None,
+        observer=None):
+    """
+    Creates a PDF file with the images placed in the slots of a fixed layout, one after the other, starting
+    a new page when all slots are taken. The geometry and the static content of the layout are computed when
+    the template is created, so a layout printed many times costs only the embedding of its images.
+
+    Parameters:
+    - template (LayoutTemplate, str or dict): The layout, the name of a registered template or the arguments
+      of a LayoutTemplate. See layout_template.LayoutTemplate.
+    - output_path (str or None): The file path where the PDF should be saved. If None, the PDF is saved to a buffer.
+    - image_paths (list of str): The images, every frame of a multi-frame TIFF file takes its own slot.
+    - angles (list of int or None): Rotation angles (in degrees) of the image files, see
+      `add_images_to_pdf_in_grid`.
+    - color_mode (str): One of COLOR_MODES. In "gray" and "mono" modes every unique image is converted once.
+    - overlay (dict or None): A stamp, text and page numbers drawn on every page, see OVERLAY_FIELDS.
+    - split (SplitPolicy, dict or None): Split the output into several files, by pages, size or source file.
+      See SplitPolicy. With `by_source`, every image file starts a new page.
+    - memory_budget (int or None): Bytes of memory the job may use, see `add_images_to_pdf_in_grid`.
+    - observer (callable or None): Called with a dict for every stage of the job, see instrumentation.EVENTS.
+
+    Returns:
+    - BytesIO or None: If `output_path` is None, returns an in-memory BytesIO object containing the PDF.
+      If `output_path` is specified, saves the PDF to the file and returns None.
+    - With a split policy, returns a list of the files, see `add_images_to_pdf_in_grid`.
+    """
     if image_paths is None:
         raise ValueError("image_paths must be provided and cannot be empty.")
+    return fill_layout_template(LayoutTemplate.coerce(template), "template", output_path, image_paths, angles,
+                                color_mode, overlay, split, memory_budget, observer)
 
-    # Calculate usable dimensions with page margin
-    usable_width = page_width - 2 * page_margin
-    usable_height = page_height - 2 * page_margin
 
-    # Calculate cell dimensions within the usable area
-    cell_width = usable_width / columns
-    cell_height = usable_height / rows
+def fill_layout_template(template, job, output_path, image_paths, angles, color_mode, overlay, split,
+                         memory_budget, observer):
+    """Places the images in the slots of a LayoutTemplate, see `add_images_to_template`."""
+    reporter = job_reporter(observer, job)
+    check_color_mode(color_mode)
+    check_overlay(overlay)
+    page_width, page_height = template.page_width, template.page_height
+    policy = SplitPolicy.coerce(split)
 
     # Set default angle list if not provided
     if angles is None:
         angles = [0] * len(image_paths)
     elif len(angles) < len(image_paths):
-        angles += [0] * (len(image_paths) - len(angles))  # Fill extra angles with 0 if fewer angles than images
-
-    # Iterate over images, placing each in the grid
-    for i, image_path in enumerate(image_paths):
-        img = ImageReader(image_path)
-        img_width, img_height = img.getSize()
-
-        # Get rotation angle for current image
-        angle = angles[i]
-        angle_rad = math.radians(angle)
+        # Fill extra angles with 0 if fewer angles than images
+        angles = list(angles) + [0] * (len(image_paths) - len(angles))
 
-        # Calculate rotated bounding box
-        rotated_width = abs(img_width * math.cos(angle_rad)) + abs(img_height * math.sin(angle_rad))
-        rotated_height = abs(img_width * math.sin(angle_rad)) + abs(img_height * math.cos(angle_rad))
+    # Large images are decoded just big enough for a cell, whichever way they are rotated
+    max_image_size = cell_size_in_pixels(template.cell_width, template.cell_height)
+    cells_per_page = template.cells_per_page
+    cover = template.fit == "cover"
+    clip_paths = template.clip_paths if cover else (None,) * cells_per_page
+    budget = MemoryBudget(memory_budget)
+    reduced_images = ReducedImages(budget)  # the images converted to the color mode
+    cell_counts = image_cell_counts(image_paths)
+    page_count = count_image_pages(cell_counts, cells_per_page, policy.by_source)
+    # Set up the canvas to write to the provided output (file or buffer), or to the files of a split output
+    output = SplitCanvas(output_path, policy, page_width, page_height, overlay, page_count, reporter, budget,
+                         template)
+    reporter.start(sum(cell_counts))
+    slot = 0  # position of the next image on the current page
+    previous_file_index = None  # file of the previous image, to start a page per file if split by source
+    # Iterate over images, and over the frames of multi-frame files, placing each in a slot
+    for i, (file_index, image_path, frame) in enumerate(iter_image_cells(image_paths)):
+        # Create new page if needed: when the page is full, or for every image file if split by source
+        new_source = i > 0 and policy.by_source and file_index != previous_file_index
+        if slot == cells_per_page or new_source:
+            output.next_page(page_width, page_height, new_source)
+            slot = 0
+        previous_file_index = file_index
+        c = output.canvas
+        if slot == 0:
+            output.draw_skeleton()
 
-        # Calculate effective cell dimensions with image margin
-        effective_cell_width = cell_width - 2 * image_margin
-        effective_cell_height = cell_height - 2 * image_margin
+        reporter.begin()
+        img, image_source = open_image(image_path, frame, max_image_size, color_mode, reduced_images, i, reporter)
+        # Size of the image as it's shown, upright according to its EXIF orientation
+        exif_orientation = image_orientation(image_path, frame)
+        img_width, img_height = oriented_size(img.getSize(), exif_orientation)
+        output.size += cell_image_size(image_path, frame, color_mode, reduced_images)
+        reporter.decoded(i, image_path)
 
-        # Determine scaling factor to fit image within effective cell dimensions
-        scale_factor = min(effective_cell_width / rotated_width, effective_cell_height / rotated_height, 1)
-        final_width = img_width * scale_factor
-        final_height = img_height * scale_factor
+        # All frames of a file share its rotation angle
+        draw_image_in_slot(c, image_source, img_width, img_height, exif_orientation, angles[file_index],
+                           template.slots[slot], cover, clip_paths[slot])
+        slot += 1
+        reporter.drawn(i)
 
-        # Determine grid position
-        col = i % columns
-        row = (i // columns) % rows
+    # Finalize PDF, a buffer is returned at its start for reading
+    return output.finish(page_width, page_height)
 
-        # Create new page if needed
-        if i > 0 and i % (columns * rows) == 0:
-            c.showPage()
 
-        # Position the image within the page, accounting for margins
-        x_pos = page_margin + col * cell_width + image_margin + (effective_cell_width - final_width) / 2
-        y_pos = page_height - (page_margin + (row + 1) * cell_height) + image_margin + (
-                    effective_cell_height - final_height) / 2
+def draw_image_in_slot(c, image_source, img_width, img_height, exif_orientation, angle, slot, cover=False,
+                       clip_path=None):
+    """
+    Draws an image rotated by `angle` degrees and centered in a slot, see layout_template.FIT_MODES.
 
-        # Draw the image with rotation and scaling
-        c.saveState()
-        c.translate(x_pos + final_width / 2, y_pos + final_height / 2)
-        c.rotate(angle)
-        c.drawImage(image_path, -final_width / 2, -final_height / 2, width=final_width, height=final_height,
-                    preserveAspectRatio=True)
-        c.restoreState()
+    Parameters:
+    - img_width, img_height (float): Size of the image as it's shown, upright according to its EXIF orientation.
+    - slot (tuple): (x, y, width, height) of the slot in points.
+    - cover (bool): Fill the slot rather than fitting the whole image into it.
+    - clip_path (PDFPathObject or None): Path the image is clipped to.
+    """
+    x, y, slot_width, slot_height = slot
+    angle_rad = math.radians(angle)
 
-    # Finalize PDF
-    c.showPage()
-    c.save()
+    # Calculate rotated bounding box
+    rotated_width = abs(img_width * math.cos(angle_rad)) + abs(img_height * math.sin(angle_rad))
+    rotated_height = abs(img_width * math.sin(angle_rad)) + abs(img_height * math.cos(angle_rad))
 
-    if output_path:
-        return output_path
+    # Determine scaling factor to fit image within the slot, or to cover it
+    if cover:
+        scale_factor = max(slot_width / rotated_width, slot_height / rotated_height)
     else:
-        # If using an output buffer, return its contents to the start for reading
-        output_buffer.seek(0)
-        return output_buffer
+        scale_factor = min(slot_width / rotated_width, slot_height / rotated_height, 1)
+    final_width = img_width * scale_factor
+    final_height = img_height * scale_factor
+
+    # Draw the image with rotation and scaling around the center of the slot
+    c.saveState()
+    if clip_path is not None:
+        c.clipPath(clip_path, stroke=0, fill=0)
+    c.translate(x + slot_width / 2, y + slot_height / 2)
+    c.rotate(angle)
+    draw_oriented_image(c, image_source, -final_width / 2, -final_height / 2, final_width, final_height,
+                        exif_orientation)
+    c.restoreState()
 
 
 def create_pdf_with_best_orientation_images(
@@ -128,37 +313,49 @@ def create_pdf_with_best_orientation_images(
         rows=1,
         orientation="auto",
         page_margin=0,
-        image_margin=0):
+        image_margin=0,
+        color_mode="color",
+        overlay=None,
+        split=None,
+        memory_budget=None,
+        observer=None):
     """
     Creates a PDF with images arranged in a grid on each page, automatically determining
     the best page orientation (portrait or landscape) based on image aspect ratios.
 
     Parameters:
     - output_path (str or None): The file path where the PDF should be saved. If None, the PDF is saved to an in-memory buffer.
-    - image_paths (list of str): A list of file paths to the images to include in the PDF.
+    - image_paths (list of str): A list of file paths to the images to include in the PDF. Every frame of
+      a multi-frame TIFF file takes its own cell.
     - columns (int): Number of columns in the grid layout.
     - rows (int): Number of rows in the grid layout.
     - orientation (str): Page orientation, either "portrait", "landscape", or "auto". If "auto", the function
       automatically selects portrait or landscape based on the layout and image aspect ratios.
     - page_margin (int or float): Margin in points between the content and the page edges.
     - image_margin (int or float): Margin in points between each image within the grid.
+    - color_mode (str): One of COLOR_MODES. In "gray" and "mono" modes every unique image is converted once.
+    - overlay (dict or None): A stamp, text and page numbers drawn on every page, see OVERLAY_FIELDS.
+    - split (SplitPolicy, dict or None): Split the output into several files, by pages, size or source file.
+      See SplitPolicy. With `by_source`, every image file starts a new page.
+    - memory_budget (int or None): Bytes of memory the job may use. Once it's over budget, the finished pages
+      and the converted images are kept in temporary files rather than in memory. See memory_usage.MemoryBudget.
+    - observer (callable or None): Called with a dict for every stage of the job, see instrumentation.EVENTS.
 
     Returns:
     - BytesIO or None: If `output_path` is None, returns an in-memory BytesIO object containing the PDF.
       If `output_path` is specified, saves the PDF to the file and returns None.
+    - With a split policy, returns a list of the files: paths numbered after output_path ("images_001.pdf", ...),
+      or BytesIO buffers.
     """
+    reporter = job_reporter(observer, "best_orientation")
+    check_color_mode(color_mode)
+    check_overlay(overlay)
     if orientation == "landscape":
         page_width, page_height = landscape(A4)
     else:
         page_width, page_height = portrait(A4)
 
-    # Set up the canvas to write to the provided output (file or buffer)
-    if output_path:
-        # Set up the canvas and page size based on orientation
-        c = canvas.Canvas(output_path, pagesize=(page_width, page_height))
-    else:
-        output_buffer = io.BytesIO()
-        c = canvas.Canvas(output_buffer, pagesize=(page_width, page_height))
+    policy = SplitPolicy.coerce(split)
 
     if image_paths is None:
         raise ValueError("image_paths must be provided and cannot be empty.")
@@ -171,16 +368,37 @@ def create_pdf_with_best_orientation_images(
     cell_width = usable_width / columns
     cell_height = usable_height / rows
 
-    # Loop through images and place them in the grid, handling multiple pages
-    for i, image_path in enumerate(image_paths):
+    # Large images are decoded just big enough for a cell, whichever way they are rotated
+    max_image_size = cell_size_in_pixels(cell_width, cell_height)
+    budget = MemoryBudget(memory_budget)
+    reduced_images = ReducedImages(budget)  # the images converted to the color mode
+    cell_counts = image_cell_counts(image_paths)
+    page_count = count_image_pages(cell_counts, columns * rows, policy.by_source)
+    # Set up the canvas to write to the provided output (file or buffer), or to the files of a split output
+    output = SplitCanvas(output_path, policy, page_width, page_height, overlay, page_count, reporter, budget)
+    reporter.start(sum(cell_counts))
+    slot = 0  # position of the next image on the current page
+    previous_file_index = None  # file of the previous image, to start a page per file if split by source
+    # Loop through images, and the frames of multi-frame files, and place them in the grid, handling multiple pages
+    for i, (file_index, image_path, frame) in enumerate(iter_image_cells(image_paths)):
+        # Check if we need to create a new page (after filling the current page"s grid, or for every image file
+        # if split by source)
+        new_source = i > 0 and policy.by_source and file_index != previous_file_index
+        if slot == columns * rows or new_source:
+            output.next_page(page_width, page_height, new_source)  # Add a new page in the PDF
+            slot = 0
+        previous_file_index = file_index
+        c = output.canvas
+
         # Determine the image"s aspect ratio
-        img = ImageReader(image_path)
-        init_img_width, init_img_height = img.getSize()
+        reporter.begin()
+        img, image_source = open_image(image_path, frame, max_image_size, color_mode, reduced_images, i, reporter)
+        # Size of the image as it's shown, upright according to its EXIF orientation
+        exif_orientation = image_orientation(image_path, frame)
+        init_img_width, init_img_height = oriented_size(img.getSize(), exif_orientation)
         image_aspect_ratio = init_img_width / init_img_height
-
-        # Check if we need to create a new page (after filling the current page"s grid)
-        if i > 0 and i % (columns * rows) == 0:
-            c.showPage()  # Add a new page in the PDF
+        output.size += cell_image_size(image_path, frame, color_mode, reduced_images)
+        reporter.decoded(i, image_path)
 
         if orientation == "auto" and (columns == 1 & rows == 1):
             if image_aspect_ratio > 1:
@@ -193,13 +411,15 @@ def create_pdf_with_best_orientation_images(
                 usable_width = page_width - 2 * page_margin
                 usable_height = page_height - 2 * page_margin
                 c.setPageSize((page_width, page_height))
+            # Nothing is drawn on the page yet, so the form of a new page size can still be defined
+            output.define_overlay(page_width, page_height)
 
-            c.drawImage(image_path, page_margin, page_margin, width=usable_width, height=usable_height,
-                        preserveAspectRatio=True)
+            draw_oriented_image(c, image_source, page_margin, page_margin, usable_width, usable_height,
+                                exif_orientation)
         else:
             # Calculate the grid position on the current page
-            col = i % columns
-            row = (i // columns) % rows
+            col = slot % columns
+            row = slot // columns
 
             # Calculate the x and y position for the image in its cell, accounting for page margin
             x = page_margin + col * cell_width + image_margin
@@ -219,81 +439,1380 @@ def create_pdf_with_best_orientation_images(
                 c.translate(x + img_width / 2, y + img_height / 2)
                 c.rotate(90)
                 # Adjust x, y since the image rotates around its center
-                c.drawImage(image_path, -img_height / 2, -img_width / 2,
-                            width=img_height, height=img_width, preserveAspectRatio=True)
+                draw_oriented_image(c, image_source, -img_height / 2, -img_width / 2, img_height, img_width,
+                                    exif_orientation)
                 c.restoreState()  # Restore canvas state to avoid affecting other elements
             else:
                 # Draw the image in the calculated position, fitting within the cell
-                c.drawImage(image_path, x, y, width=img_width, height=img_height, preserveAspectRatio=True)
+                draw_oriented_image(c, image_source, x, y, img_width, img_height, exif_orientation)
+        slot += 1
+        reporter.drawn(i)
+
+    # Save the PDF, a buffer is returned at its start for reading
+    return output.finish(page_width, page_height)
+
+
+def check_overlay(overlay):
+    unknown = set(overlay or ()) - set(OVERLAY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown overlay fields: {', '.join(sorted(unknown))}. Use {', '.join(OVERLAY_FIELDS)}.")
+
+
+def draw_overlay(c, overlay, page_width, page_height):
+    """Draws the parts of an overlay which are the same on every page on a reportlab canvas."""
+    stamp = overlay.get("stamp")
+    if stamp:
+        c.saveState()
+        # Outlined letters don't hide the content below, and need no transparency, which reportlab forms lack
+        c.setStrokeColorRGB(0.6, 0.6, 0.6)
+        c.setLineWidth(1.5)
+        c.translate(page_width / 2, page_height / 2)
+        c.rotate(math.degrees(math.atan2(page_height, page_width)))
+        # As big as fits along the diagonal
+        font_size = min(0.8 * math.hypot(page_width, page_height) / max(stringWidth(stamp, "Helvetica-Bold", 1), 1),
+                        min(page_width, page_height) / 3)
+        text_object = c.beginText()
+        text_object.setTextRenderMode(1)
+        text_object.setFont("Helvetica-Bold", font_size)
+        text_object.setTextOrigin(-stringWidth(stamp, "Helvetica-Bold", font_size) / 2, -font_size / 3)
+        text_object.textOut(stamp)
+        c.drawText(text_object)
+        c.restoreState()
+    text = overlay.get("text")
+    if text:
+        c.setFont(OVERLAY_FONT, OVERLAY_FONT_SIZE)
+        c.drawString(OVERLAY_MARGIN, page_height - OVERLAY_MARGIN, text)
+
+
+def page_number_text(overlay, page_index, page_count):
+    """Returns the page number text of the 0-indexed page of an output with `page_count` pages, or None."""
+    page_numbers = overlay.get("page_numbers")
+    if not page_numbers:
+        return None
+    number_format = PAGE_NUMBER_FORMAT if page_numbers is True else page_numbers
+    first_page = overlay.get("first_page", 1)
+    return number_format.format(page=first_page + page_index, pages=overlay.get("page_count") or page_count)
+
+
+def define_overlay_form(c, overlay, page_width, page_height, forms):
+    """
+    Defines the shared form of an overlay for the current page size of a reportlab canvas, once per size.
+    It must be called before anything is drawn on the current page: reportlab starts the page anew after a form.
+    """
+    size = (round(page_width, 2), round(page_height, 2))
+    if overlay and size not in forms:
+        forms[size] = f"overlay{len(forms)}"
+        c.beginForm(forms[size])
+        draw_overlay(c, overlay, page_width, page_height)
+        c.endForm()
+
+
+def draw_page_overlay(c, overlay, page_width, page_height, forms, page_index, page_count):
+    """Draws the overlay on the current page of a reportlab canvas: the shared form and the page number."""
+    if not overlay:
+        return
+    c.doForm(forms[(round(page_width, 2), round(page_height, 2))])
+    text = page_number_text(overlay, page_index, page_count)
+    if text:
+        c.setFont(OVERLAY_FONT, OVERLAY_FONT_SIZE)
+        c.drawCentredString(page_width / 2, OVERLAY_MARGIN, text)
+
+
+class SplitCanvas:
+    """
+    The reportlab canvas of an image engine, writing the pages into one file or, with a split policy, into
+    several files one after the other. `canvas` is the canvas of the current file.
+    """
+
+    def __init__(self, output_path, policy, page_width, page_height, overlay, page_count, reporter, budget,
+                 template=None):
+        self.output_path = output_path
+        self.template = template  # the LayoutTemplate whose static content every page shows, if any
+        self.policy = policy
+        self.page_width = page_width
+        self.page_height = page_height
+        self.overlay = overlay
+        self.page_count = page_count
+        self.reporter = reporter
+        self.budget = budget
+        self.next_output = split_outputs(output_path)
+        self.outputs = []  # the finished files
+        self.page_index = 0  # 0-indexed number of the current page in the whole output
+        self.piece_numbers = count()
+        self.open_file()
+
+    def open_file(self):
+        self.output = self.next_output() if self.policy else self.output_path or io.BytesIO()
+        self.pieces = []  # temporary files holding the first pages of the current file, see `spill`
+        self.pages = 0  # finished pages in the current file
+        self.size = 0  # estimated size of the images in the current file
+        self.spilled_size = 0  # estimated size of the images in the pieces
+        self.open_canvas(self.output)
+
+    def open_canvas(self, target):
+        self.target = target
+        self.canvas = canvas.Canvas(target, pagesize=(self.page_width, self.page_height))
+        self.overlay_forms = {}  # page size -> name of the overlay form
+        define_overlay_form(self.canvas, self.overlay, self.page_width, self.page_height, self.overlay_forms)
+        if self.template is not None and self.template.has_skeleton:
+            self.canvas.beginForm(SKELETON_FORM)
+            self.template.draw_skeleton(self.canvas)
+            self.canvas.endForm()
+
+    def draw_skeleton(self):
+        """Draws the static content of the template on the current page, before its images."""
+        if self.template is not None and self.template.has_skeleton:
+            self.canvas.doForm(SKELETON_FORM)
+
+    def define_overlay(self, page_width, page_height):
+        """Defines the overlay form for a new page size, before anything is drawn on the current page."""
+        define_overlay_form(self.canvas, self.overlay, page_width, page_height, self.overlay_forms)
+
+    def end_page(self, page_width, page_height):
+        draw_page_overlay(self.canvas, self.overlay, page_width, page_height, self.overlay_forms, self.page_index,
+                          self.page_count)
+        self.canvas.showPage()
+        self.reporter.page_emitted()
+        self.page_index += 1
+        self.pages += 1
+
+    def next_page(self, page_width, page_height, new_source=False):
+        """
+        Ends the current page and starts the next one, in a new file if the policy says so.
+
+        Parameters:
+        - page_width, page_height (float): Size of the current page.
+        - new_source (bool): The next page shows another source file than the current one.
+        """
+        self.end_page(page_width, page_height)
+        # The next page is estimated as big as the average page of the file
+        page_size = self.size / self.pages
+        if (self.policy.by_source and new_source) or self.policy.page_room(self.pages, self.size, page_size) == 0:
+            self.save_file()
+            self.open_file()
+        elif self.budget.check() and self.size - self.spilled_size >= self.budget.limit * SPILL_FRACTION:
+            self.spill()
+
+    def spill(self):
+        """
+        Writes the pages of the canvas to a temporary file and continues the current file on a new canvas,
+        since reportlab keeps all pages with their images in memory until the canvas is saved.
+        """
+        self.canvas.save()
+        if self.target is self.output:
+            # The first pages were written to the output itself, which is written again when the file is finished
+            piece_path = self.piece_path()
+            if is_path_source(self.output):
+                os.replace(self.output, piece_path)
+            else:
+                write_output(piece_path, self.output.getvalue())
+                self.output.seek(0)
+                self.output.truncate()
+        else:
+            piece_path = self.target
+        self.pieces.append(piece_path)
+        self.spilled_size = self.size
+        self.open_canvas(self.piece_path())
+
+    def piece_path(self):
+        return self.budget.spill_path(f"piece_{next(self.piece_numbers):06d}.pdf")
+
+    def save_file(self):
+        self.reporter.begin()
+        self.canvas.save()
+        if self.pieces:
+            join_pdf_files(self.pieces + [self.target], self.output, self.budget)
+        elif not is_path_source(self.output):
+            self.output.seek(0)
+        for output in split_oversized_output(self.output, self.policy.max_bytes, self.next_output):
+            self.outputs.append(output)
+            self.reporter.saved(output)
+
+    def finish(self, page_width, page_height):
+        """
+        Ends the last page and saves the last file.
+
+        Returns:
+        - The list of files if there is a split policy, or else the output path or BytesIO buffer.
+        """
+        self.end_page(page_width, page_height)
+        self.save_file()
+        self.budget.close()
+        self.reporter.end(self.budget.peak_rss)
+        return self.outputs if self.policy else self.outputs[0]
+
+
+def check_color_mode(color_mode):
+    if color_mode not in COLOR_MODES:
+        raise ValueError(f"Unknown color mode: '{color_mode}'. Use one of {', '.join(COLOR_MODES)}.")
+
+
+def is_multi_frame_file(image_path):
+    return str(image_path).lower().endswith(MULTI_FRAME_EXTENSIONS)
+
+
+def image_cell_counts(image_paths):
+    """Returns the number of grid cells every image file takes: one per image, or per frame of multi-frame files."""
+    counts = []
+    for image_path in image_paths:
+        if is_multi_frame_file(image_path):
+            # Only the headers of the frames are read
+            with Image.open(image_path) as image:
+                counts.append(getattr(image, "n_frames", 1))
+        else:
+            counts.append(1)
+    return counts
+
+
+def count_image_cells(image_paths):
+    """Returns the number of grid cells the images take: one per image, or per frame of multi-frame files."""
+    return sum(image_cell_counts(image_paths))
+
+
+def count_image_pages(cell_counts, cells_per_page, by_source=False):
+    """Returns the number of pages of an image engine, where every file starts a new page if `by_source`."""
+    if by_source:
+        return max(sum(math.ceil(cells / cells_per_page) for cells in cell_counts), 1)
+    return max(math.ceil(sum(cell_counts) / cells_per_page), 1)
+
+
+def cell_image_size(image_path, frame, color_mode, reduced_images):
+    """Estimates the bytes the image of a grid cell adds to the output, for the size limit of a split policy."""
+    if color_mode != "color":
+        return reduced_images.size((image_path, frame.tell() if frame is not None else 0))
+    return os.path.getsize(image_path) / (getattr(frame, "n_frames", 1) if frame is not None else 1)
+
+
+def iter_image_cells(image_paths):
+    """
+    Yields (index of the file in image_paths, image path, frame) for every grid cell. `frame` is None for
+    single-image files and the PIL image positioned at the frame for multi-frame files. The frames are read
+    lazily one at a time, and a multi-frame file stays open only until its last frame is drawn.
+    """
+    for file_index, image_path in enumerate(image_paths):
+        if not is_multi_frame_file(image_path):
+            yield file_index, image_path, None
+            continue
+        with Image.open(image_path) as image:
+            for frame in ImageSequence.Iterator(image):
+                yield file_index, image_path, frame
+
+
+def cell_size_in_pixels(cell_width, cell_height):
+    """Returns the (width, height) in pixels an image needs to fill a cell at LARGE_IMAGE_DPI in any rotation."""
+    side = math.ceil(max(cell_width, cell_height) / 72 * LARGE_IMAGE_DPI)
+    return side, side
+
+
+def decode_image(image, max_size=None):
+    """
+    Decodes an image, or the current frame of a multi-frame image, into a new image independent of its file.
+
+    Images of more than LARGE_IMAGE_PIXELS are reduced by the biggest integer factor which keeps them at least
+    `max_size` (width, height) pixels big. JPEG files are decoded directly at 1/2 to 1/8 of their size, other
+    formats are reduced right after decoding, so there is at most one full-size frame in memory at a time.
+    """
+    def reduction(image):
+        if not max_size or image.width * image.height <= LARGE_IMAGE_PIXELS:
+            return 1
+        return max(1, min(image.width // max_size[0], image.height // max_size[1]))
+
+    factor = reduction(image)
+    if factor > 1 and image.format == "JPEG":
+        image.draft(image.mode, (image.width // factor, image.height // factor))
+        factor = reduction(image)
+    # reportlab embeds other modes as RGB, and Image.reduce does not support them
+    if image.mode == "1":
+        image = image.convert("L")
+    elif image.mode in ("I", "F") or image.mode.startswith("I;16"):
+        image = gray_to_8_bit(image)
+    elif image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    elif factor == 1:
+        return image.copy()
+    return image.reduce(factor) if factor > 1 else image
+
+
+def gray_to_8_bit(image):
+    """
+    Converts a grayscale image of more than 8 bits, such as a 16-bit TIFF scan, to an 8-bit "L" image with the
+    same gray levels. Image.convert would clip the values at 255 and turn most of the image white.
+    """
+    if image.mode.startswith("I;16"):
+        image = image.convert("I")
+    low, high = image.getextrema()
+    if image.mode == "F":
+        # Floating point values are usually from 0 to 1, other ranges are stretched from their minimum to their
+        # maximum
+        if 0 <= low and high <= 1:
+            low, high = 0, 1
+        scale = 255 / (high - low) if high > low else 0
+        return image.point(lambda value: (value - low) * scale).convert("L")
+    # 16-bit values, which PIL also opens as "I" from PNG files, or 8-bit values stored in 32 bits
+    if high > 255:
+        image = image.point(lambda value: value / 256)
+    return image.convert("L")
+
+
+def reduce_image_colors(image_path, color_mode, frame=None, max_size=None):
+    """
+    Converts an image, or a frame of a multi-frame image, to grayscale, or to dithered black and white
+    for the "mono" color mode. Transparent areas are flattened onto white, like the paper they are printed on.
+
+    Returns:
+    - bytes: The converted image, encoded as JPEG for JPEG photos in "gray" mode and as PNG otherwise.
+    """
+    with ExitStack() as stack:
+        image = frame if frame is not None else stack.enter_context(Image.open(image_path))
+        image_format = image.format
+        if (image_format == "JPEG" and image.mode == "L" and color_mode == "gray"
+                and image.width * image.height <= LARGE_IMAGE_PIXELS):
+            # Already grayscale, embedded as it is
+            with open(image_path, "rb") as image_file:
+                return image_file.read()
+        image = decode_image(image, max_size)
+    if image.mode in ("RGBA", "LA", "PA"):
+        image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image.convert("RGBA"))
+    gray_image = image.convert("L")
+
+    buffer = io.BytesIO()
+    if color_mode == "mono":
+        # Floyd-Steinberg dithering, stored as a 1-bit PNG and embedded as a BilevelImage
+        gray_image.convert("1").save(buffer, "PNG")
+    elif image_format == "JPEG":
+        gray_image.save(buffer, "JPEG", quality=GRAY_JPEG_QUALITY)
+    else:
+        gray_image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def open_image(image_path, frame, max_size, color_mode, reduced_images, index, reporter):
+    """
+    Opens the image of a grid cell in the given color mode. Converted images are kept in the ReducedImages
+    of the job, so an image repeated in a job is converted only once.
+
+    Returns:
+    - tuple: The ImageReader of the image and the source to pass to `draw_image`: the image path if the file
+      is embedded as it is (reportlab then copies JPEG files without decoding them), or the ImageReader.
+      In "mono" mode both are a BilevelImage.
+    """
+    if color_mode == "color":
+        if frame is None:
+            img = ImageReader(image_path)
+            width, height = img.getSize()
+            if width * height <= LARGE_IMAGE_PIXELS:
+                return img, image_path
+            with Image.open(image_path) as image:
+                img = ImageReader(decode_image(image, max_size))
+        else:
+            img = ImageReader(decode_image(frame, max_size))
+        return img, img
+
+    key = (image_path, frame.tell() if frame is not None else 0)
+    reduced_image = reduced_images.get(key)
+    if reduced_image is None:
+        reduced_data = reduce_image_colors(image_path, color_mode, frame, max_size)
+        reduced_image = reduced_images.add(key, reduced_data)
+        # The size of a multi-frame file is counted with its first frame
+        bytes_before = os.path.getsize(image_path) if key[1] == 0 else 0
+        reporter.colors_reduced(index, image_path, bytes_before, len(reduced_data))
+    reduced_file = reduced_image if isinstance(reduced_image, str) else io.BytesIO(reduced_image)
+    if color_mode == "mono":
+        with Image.open(reduced_file) as image:
+            img = BilevelImage(image)
+    else:
+        img = ImageReader(reduced_file)
+    return img, img
+
+
+class BilevelImage:
+    """
+    A black and white image of the "mono" color mode, embedded with 1 bit per pixel. reportlab embeds gray
+    images with 8 bits per pixel, so the image is added to the canvas as an image XObject of its own, once per
+    document, and drawn like a form (see `draw_image`).
+    """
+    __slots__ = ("name", "width", "height", "data")
+
+    def __init__(self, image):
+        self.width, self.height = image.size
+        # PIL packs the rows to whole bytes with 1 for white, as the PDF DeviceGray color space expects
+        self.data = zlib.compress(image.convert("1").tobytes())
+        self.name = "bilevel_" + hashlib.sha1(self.data).hexdigest()
+
+    def getSize(self):
+        """Returns the (width, height) in pixels, like ImageReader.getSize."""
+        return self.width, self.height
+
+    def define(self, c):
+        """Adds the image to the document of a reportlab canvas, if it is not there yet."""
+        if not c.hasForm(self.name):
+            xobject = pdfdoc.PDFImageXObject(self.name)
+            xobject.width = self.width
+            xobject.height = self.height
+            xobject.bitsPerComponent = 1
+            xobject.colorSpace = "DeviceGray"
+            xobject.streamContent = self.data
+            xobject._filters = ("FlateDecode",)
+            c._doc.addForm(self.name, xobject)
+
+
+class ReducedImages:
+    """
+    The images of a job converted to its color mode, by (image path, frame number), so an image repeated in
+    the job is converted only once. They are kept in memory, or in temporary files once the job is over its
+    memory budget.
+    """
+    __slots__ = ("budget", "images", "spilled", "file_numbers")
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.images = {}  # key -> encoded image (bytes), or the path of the file holding it
+        self.spilled = False
+        self.file_numbers = count()
+
+    def get(self, key):
+        image = self.images.get(key)
+        cache_lookup("reduced_images", image is not None)
+        return image
+
+    def add(self, key, data):
+        """Keeps a converted image. Returns its bytes, or the path of its file if the job is over budget."""
+        if self.budget.over:
+            self.spill()
+            data = self.write(data)
+        self.images[key] = data
+        return data
+
+    def size(self, key):
+        image = self.images[key]
+        return os.path.getsize(image) if isinstance(image, str) else len(image)
+
+    def write(self, data):
+        path = self.budget.spill_path(f"image_{next(self.file_numbers):06d}")
+        write_output(path, data)
+        return path
+
+    def spill(self):
+        """Moves the images kept in memory to files, once."""
+        if not self.spilled:
+            self.spilled = True
+            for key, image in self.images.items():
+                if not isinstance(image, str):
+                    self.images[key] = self.write(image)
+
+
+def image_orientation(image_path, frame=None):
+    """
+    Returns the EXIF orientation of an image file, or of a frame of a multi-frame file, from 1 to 8.
+    Images without a valid orientation are upright (1).
+    """
+    with ExitStack() as stack:
+        image = frame if frame is not None else stack.enter_context(Image.open(image_path))
+        # Only the header is read, the pixels are not decoded
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    return orientation if orientation in EXIF_ORIENTATION_MATRICES else 1
+
+
+def oriented_size(size, orientation):
+    """Returns the (width, height) of an image of the stored `size` as it is shown in its EXIF orientation."""
+    width, height = size
+    return (height, width) if orientation >= 5 else (width, height)
+
+
+def draw_oriented_image(c, image_source, x, y, width, height, orientation=1):
+    """
+    Draws an image upright according to its EXIF orientation, as big as fits into the box of the given position
+    and size, keeping its aspect ratio, like `drawImage` with `preserveAspectRatio`.
+    """
+    if orientation == 1:
+        draw_image(c, image_source, x, y, width, height)
+        return
+    # The stored image is fitted into the box as it's stored, turned or mirrored around the center of the box
+    box_width, box_height = oriented_size((width, height), orientation)
+    c.saveState()
+    c.transform(*EXIF_ORIENTATION_MATRICES[orientation], x + width / 2, y + height / 2)
+    draw_image(c, image_source, -box_width / 2, -box_height / 2, box_width, box_height)
+    c.restoreState()
+
+
+def draw_image(c, image_source, x, y, width, height):
+    """Draws an image centered in a box, as big as fits, like `drawImage` with `preserveAspectRatio`."""
+    if not isinstance(image_source, BilevelImage):
+        c.drawImage(image_source, x, y, width=width, height=height, preserveAspectRatio=True)
+        return
+    image_source.define(c)
+    x, y, width, height, _ = aspectRatioFix(True, "c", x, y, width, height, *image_source.getSize())
+    c.saveState()
+    c.translate(x, y)
+    c.scale(width, height)
+    c.doForm(image_source.name)
+    c.restoreState()
+
+
+def is_path_source(source):
+    """Returns True if the PDF source is a file path rather than an in-memory buffer."""
+    return isinstance(source, (str, os.PathLike))
+
+
+def source_name(source):
+    """Returns a short human-readable name of a PDF source for labels and messages."""
+    if is_path_source(source):
+        return os.path.basename(source)
+    if isinstance(source, io.BytesIO):
+        size = source.getbuffer().nbytes
+    else:
+        size = memoryview(source).nbytes
+    return f"In-memory PDF ({size} bytes)"
+
+
+@contextmanager
+def open_pdf_source(source, use_mmap=False):
+    """
+    Opens a PDF source with pymupdf without making extra copies of its bytes.
 
-    # Save the PDF
+    Parameters:
+    - source: A file path (str or os.PathLike), bytes, bytearray, memoryview, mmap.mmap or BytesIO object.
+    - use_mmap (bool or str): For file paths only. If True, the file is memory-mapped instead of being opened
+      by path. If "auto", only files of at least MMAP_THRESHOLD bytes are memory-mapped.
+
+    Yields:
+    - pymupdf.Document: The opened document. It is closed, and the mapping released, on exit.
+    """
+    file = mapping = view = None
+    try:
+        if is_path_source(source):
+            if use_mmap == "auto":
+                use_mmap = os.path.getsize(source) >= MMAP_THRESHOLD
+            if not use_mmap:
+                with pymupdf.open(source) as pdf_document:
+                    yield pdf_document
+                return
+            file = open(source, "rb")
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapping)
+        elif isinstance(source, io.BytesIO):
+            view = source.getbuffer()
+        elif isinstance(source, bytes):
+            view = source
+        else:
+            # bytearray, memoryview and mmap objects are passed as a view of the same memory, without a copy
+            view = memoryview(source)
+
+        with pymupdf.open(stream=view, filetype="pdf") as pdf_document:
+            yield pdf_document
+    finally:
+        # The view must be released before the mapping can be closed
+        if isinstance(view, memoryview):
+            view.release()
+        if mapping is not None:
+            mapping.close()
+        if file is not None:
+            file.close()
+
+
+def save_pdf_document(pdf_document, output, save_profile="fast", collect_garbage=False):
+    """
+    Saves a pymupdf document to a file path or a buffer using one of the SAVE_PROFILES.
+
+    Parameters:
+    - pdf_document (pymupdf.Document): The document to save.
+    - output (str or BytesIO): The file path or the in-memory buffer to write to.
+    - save_profile (str): One of "fast", "compact" or "web". "web" saves like "compact" where PyMuPDF cannot
+      linearize.
+    - collect_garbage (bool): Drop unused objects even if the profile does not, e.g. after images were replaced.
+    """
+    if save_profile not in SAVE_PROFILES:
+        raise ValueError(f"Unknown save profile: '{save_profile}'. Use one of {', '.join(SAVE_PROFILES)}.")
+
+    save_options = SAVE_PROFILES[save_profile]
+    if save_options.get("linear") and not LINEARIZATION_SUPPORTED:
+        save_options = SAVE_PROFILES["compact"]
+    if collect_garbage and not save_options.get("garbage"):
+        save_options = {**save_options, "garbage": 1}
+    if save_profile in SUBSET_FONTS_PROFILES:
+        pdf_document.subset_fonts()
+    pdf_document.save(output, **save_options)
+
+
+def add_overlay_form(pdf_document, overlay, page_width, page_height):
+    """Adds the shared part of an overlay to a pymupdf document as a form XObject and returns its xref."""
+    template_buffer = io.BytesIO()
+    c = canvas.Canvas(template_buffer, pagesize=(page_width, page_height))
+    draw_overlay(c, overlay, page_width, page_height)
     c.showPage()
     c.save()
-    # If using an output buffer, return its contents to the start for reading
-    if output_path:
-        return output_path
+    # Copying the template page brings its fonts and graphics states over, then its content becomes the form
+    with pymupdf.open(stream=template_buffer.getvalue(), filetype="pdf") as template:
+        pdf_document.insert_pdf(template)
+    template_page = pdf_document[-1]
+    resources = pdf_document.xref_get_key(template_page.xref, "Resources")[1]
+    content = template_page.read_contents()
+    pdf_document.delete_page(-1)
+    xref = pdf_document.get_new_xref()
+    pdf_document.update_object(xref, f"<< /Type /XObject /Subtype /Form /BBox [0 0 {page_width:g} {page_height:g}] "
+                                     f"/Resources {resources} >>")
+    pdf_document.update_stream(xref, content)
+    return xref
+
+
+def visible_page_matrix(page):
+    """
+    Returns the matrix (as a PDF "cm" operand string) mapping the coordinates of the visible page, with the
+    origin at its bottom left corner and the /Rotate of the page applied, to the page content coordinates.
+    """
+    # pymupdf flips the y axis of the boxes, from the top of the media box down
+    cropbox = page.cropbox
+    x0, y0 = cropbox.x0, page.mediabox.y1 - cropbox.y1
+    width, height = cropbox.width, cropbox.height
+    matrix = {
+        0: (1, 0, 0, 1, x0, y0),
+        90: (0, 1, -1, 0, x0 + width, y0),
+        180: (-1, 0, 0, -1, x0 + width, y0 + height),
+        270: (0, -1, 1, 0, x0, y0 + height),
+    }[page.rotation]
+    return " ".join(f"{value:g}" for value in matrix)
+
+
+def page_resources(pdf_document, page_xref):
+    """Returns the xref and key path of the resource dictionary of a page, which can be an indirect object."""
+    value_type, value = pdf_document.xref_get_key(page_xref, "Resources")
+    if value_type == "xref":
+        return int(value.split()[0]), ""
+    return page_xref, "Resources/"
+
+
+def add_resource(pdf_document, resources, category, name, xref):
+    """Adds an object to a category (such as "XObject") of a resource dictionary, see `page_resources`."""
+    resources_xref, path = resources
+    value_type, value = pdf_document.xref_get_key(resources_xref, path + category)
+    if value_type == "xref":
+        resources_xref, path = int(value.split()[0]), ""
+    else:
+        path += category + "/"
+    pdf_document.xref_set_key(resources_xref, path + name, f"{xref} 0 R")
+
+
+def pdf_string(text):
+    """Encodes a text as a literal PDF string in the WinAnsi encoding of the overlay font."""
+    data = text.encode("cp1252", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def apply_overlay(pdf_document, overlay):
+    """
+    Draws an overlay (see OVERLAY_FIELDS) on every page of a pymupdf document. The stamp and the text go into
+    one form XObject per page size which every page references, so every page only gets a content stream of
+    a few dozen bytes with its page number.
+    """
+    # The page geometry is read before the document is changed: looking up pages of a changed document is slow
+    pages = []
+    for page in pdf_document:
+        pages.append((page.xref, page.rect.width, page.rect.height, visible_page_matrix(page)))
+    page_count = len(pages)
+
+    forms = {}  # (width, height) of the visible page -> xref of the form
+    for _, page_width, page_height, _ in pages:
+        size = (round(page_width, 2), round(page_height, 2))
+        if size not in forms:
+            forms[size] = add_overlay_form(pdf_document, overlay, page_width, page_height)
+    font_xref = None
+    if overlay.get("page_numbers"):
+        font_xref = pdf_document.get_new_xref()
+        pdf_document.update_object(font_xref, f"<< /Type /Font /Subtype /Type1 /BaseFont /{OVERLAY_FONT} "
+                                              f"/Encoding /WinAnsiEncoding >>")
+    # Shared by all pages: the page content is wrapped into "q ... Q", so it cannot leave a changed
+    # graphics state behind for the overlay
+    save_state_xref = pdf_document.get_new_xref()
+    pdf_document.update_object(save_state_xref, "<< >>")
+    pdf_document.update_stream(save_state_xref, b"q")
+
+    for page_index, (page_xref, page_width, page_height, matrix) in enumerate(pages):
+        form_xref = forms[(round(page_width, 2), round(page_height, 2))]
+        # Names with the xref, because pages of different sizes can share one resource dictionary
+        form_name = f"MinglingOverlay{form_xref}"
+        resources = page_resources(pdf_document, page_xref)
+        add_resource(pdf_document, resources, "XObject", form_name, form_xref)
+        content = [b"Q q", matrix.encode(), b"cm /" + form_name.encode() + b" Do"]
+        text = page_number_text(overlay, page_index, page_count)
+        if text:
+            font_name = f"MinglingOverlayFont{font_xref}"
+            add_resource(pdf_document, resources, "Font", font_name, font_xref)
+            text_x = (page_width - stringWidth(text, OVERLAY_FONT, OVERLAY_FONT_SIZE)) / 2
+            content.append(b"BT /%s %d Tf %.2f %d Td %s Tj ET" % (font_name.encode(), OVERLAY_FONT_SIZE, text_x,
+                                                                  OVERLAY_MARGIN, pdf_string(text)))
+        content.append(b"Q")
+        content_xref = pdf_document.get_new_xref()
+        pdf_document.update_object(content_xref, "<< >>")
+        pdf_document.update_stream(content_xref, b" ".join(content))
+        contents_type, contents = pdf_document.xref_get_key(page_xref, "Contents")
+        contents = contents.strip("[]") if contents_type == "array" else contents
+        pdf_document.xref_set_key(page_xref, "Contents", f"[{save_state_xref} 0 R {contents} {content_xref} 0 R]")
+
+
+def source_size(source):
+    """Returns the size in bytes of a PDF source: a file path or an in-memory buffer."""
+    if is_path_source(source):
+        return os.path.getsize(source)
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer().nbytes
+    return len(source)
+
+
+def split_outputs(output_path):
+    """
+    Returns a function which gives where to write the next file of a split output: numbered files next to
+    `output_path` (see `split_policy.part_path`), or in-memory buffers if it is None.
+    """
+    if not output_path:
+        return io.BytesIO
+    part_numbers = count(1)
+    return lambda: part_path(output_path, next(part_numbers))
+
+
+def read_output(output):
+    if is_path_source(output):
+        with open(output, "rb") as output_file:
+            return output_file.read()
+    return output.getvalue()
+
+
+def write_output(output, data):
+    if is_path_source(output):
+        with open(output, "wb") as output_file:
+            output_file.write(data)
     else:
-        # If using an output buffer, return its contents to the start for reading
-        output_buffer.seek(0)
-        return output_buffer
+        output.seek(0)
+        output.truncate()
+        output.write(data)
+        output.seek(0)
+
+
+def split_oversized_output(output, max_bytes, next_output, save_profile="fast"):
+    """
+    Splits a written file of a split output in halves, again and again, until every part is at most `max_bytes`
+    big or has a single page. The size of split files is estimated while they are written, so this is rarely
+    needed, and only this file is written again.
+
+    Parameters:
+    - output (str or BytesIO): The written file.
+    - max_bytes (int or None): The size limit. If None, the file is kept as it is.
+    - next_output (callable): Returns where to write the next file, see `split_outputs`.
+    - save_profile (str): The profile to save the parts with, see SAVE_PROFILES.
+
+    Returns:
+    - list: The files in page order, starting with `output` which is overwritten with the first part.
+    """
+    if max_bytes is None or output_size(output) <= max_bytes:
+        return [output]
+    outputs = []
+    for data in split_pdf_data(read_output(output), max_bytes, save_profile):
+        part_output = output if not outputs else next_output()
+        write_output(part_output, data)
+        outputs.append(part_output)
+    return outputs
+
+
+def split_pdf_data(data, max_bytes, save_profile):
+    """Splits a PDF file in memory into parts of at most `max_bytes`, see `split_oversized_output`."""
+    if len(data) <= max_bytes:
+        return [data]
+    with pymupdf.open(stream=data, filetype="pdf") as pdf_document:
+        if pdf_document.page_count == 1:
+            logger.warning("A page of %d bytes is bigger than the limit of %d bytes, it is kept whole.",
+                           len(data), max_bytes)
+            return [data]
+        half = pdf_document.page_count // 2
+        parts = []
+        for from_page, to_page in ((0, half - 1), (half, pdf_document.page_count - 1)):
+            with pymupdf.open() as part_pdf:
+                part_pdf.insert_pdf(pdf_document, from_page=from_page, to_page=to_page)
+                part_buffer = io.BytesIO()
+                save_pdf_document(part_pdf, part_buffer, save_profile)
+            parts.extend(split_pdf_data(part_buffer.getvalue(), max_bytes, save_profile))
+    return parts
+
+
+def spill_document(pdf_document, spill_path):
+    """
+    Writes a document to `spill_path` and opens it again from there, so the pages added to it so far are read
+    from the file when they are needed rather than kept in memory. The first call writes the whole document,
+    further calls append the pages added since the previous one (an incremental save).
+
+    Returns:
+    - pymupdf.Document: The reopened document, `pdf_document` is closed.
+    """
+    if pdf_document.name == spill_path:
+        pdf_document.saveIncr()
+    else:
+        pdf_document.save(spill_path)
+    pdf_document.close()
+    return pymupdf.open(spill_path)
+
+
+def join_pdf_files(pdf_paths, output, budget, save_profile="fast", deduplicate=True, overlay=None):
+    """
+    Concatenates PDF files into `output` (a path or a BytesIO buffer) and deletes them. The joined document is
+    spilled to disk after every file, see `spill_document`, so only one of the files is in memory at a time.
+
+    Parameters:
+    - save_profile (str): Output optimization profile, see SAVE_PROFILES.
+    - deduplicate (bool): Share the objects the files embed each again, see `deduplicate_resources`. The files
+      of one job usually embed the same images and fonts.
+    - overlay (dict or None): A stamp, text and page numbers drawn on every page, see OVERLAY_FIELDS.
+    """
+    joined_path = budget.spill_path("joined.pdf")
+    joined_pdf = pymupdf.open(pdf_paths[0])
+    try:
+        for pdf_path in pdf_paths[1:]:
+            with pymupdf.open(pdf_path) as pdf_document:
+                joined_pdf.insert_pdf(pdf_document)
+            joined_pdf = spill_document(joined_pdf, joined_path)
+        if deduplicate:
+            duplicates, bytes_saved = deduplicate_resources(joined_pdf)
+            logger.info("Shared %d duplicate objects across the joined files, %d bytes saved.", duplicates,
+                        bytes_saved)
+        if overlay:
+            apply_overlay(joined_pdf, overlay)
+        save_pdf_document(joined_pdf, output, save_profile, collect_garbage=deduplicate)
+    finally:
+        joined_pdf.close()
+    if not is_path_source(output):
+        output.seek(0)
+    for pdf_path in pdf_paths + [joined_path]:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+
+def page_image_xrefs(pdf_document):
+    """Returns the xrefs of the images shown on the pages of a document, without soft masks."""
+    return {image[0] for page in pdf_document for image in page.get_images()}
+
+
+def image_streams_size(pdf_document, xrefs):
+    return sum(len(pdf_document.xref_stream_raw(xref)) for xref in xrefs)
+
+
+def reduce_document_colors(pdf_document, color_mode):
+    """
+    Converts the text, vector graphics and images of all pages of a document to grayscale, and in "mono"
+    mode also dithers the images to 1-bit black and white. The replaced color images stay in the document
+    as unused objects until it is saved with garbage collection.
+
+    Returns:
+    - tuple of int: Total size in bytes of the image streams before and after the conversion.
+    """
+    original_xrefs = page_image_xrefs(pdf_document)
+    bytes_before = image_streams_size(pdf_document, original_xrefs)
+    # MuPDF stores recolored images uncompressed, so they are re-encoded below, photos as JPEG again.
+    # Recoloring replaces the images by new objects, but keeps the order they are drawn in, so the
+    # replacement of every photo is found through its placements on the pages
+    lossy_xrefs = {xref for xref in original_xrefs
+                   if any(name in pdf_document.xref_get_key(xref, "Filter")[1] for name in LOSSY_IMAGE_FILTERS)}
+    placements = [[image["xref"] for image in page.get_image_info(xrefs=True)] for page in pdf_document]
+
+    for page in pdf_document:
+        page.recolor(1)
+
+    lossy_replacements = set()
+    for page, original_placements in zip(pdf_document, placements):
+        for original_xref, image in zip(original_placements, page.get_image_info(xrefs=True)):
+            if original_xref in lossy_xrefs:
+                lossy_replacements.add(image["xref"])
+    reduced_xrefs = page_image_xrefs(pdf_document)
+    for xref in reduced_xrefs - original_xrefs:
+        if pdf_document.xref_get_key(xref, "ImageMask")[1] == "true":
+            continue
+        pixmap = pymupdf.Pixmap(pdf_document, xref)
+        if pixmap.n != 1 or pixmap.alpha:
+            continue
+        if color_mode == "mono":
+            image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples).convert("1")
+            # 1-bit rows padded to whole bytes with 1 for white, as PIL packs them
+            pdf_document.update_stream(xref, image.tobytes())
+            pdf_document.xref_set_key(xref, "BitsPerComponent", "1")
+        elif xref in lossy_replacements:
+            pdf_document.update_stream(xref, pixmap.tobytes("jpeg", jpg_quality=GRAY_JPEG_QUALITY), compress=False)
+            pdf_document.xref_set_key(xref, "Filter", "/DCTDecode")
+        else:
+            pdf_document.update_stream(xref, pixmap.samples)
+        pdf_document.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+        pdf_document.xref_set_key(xref, "DecodeParms", "null")
+    return bytes_before, image_streams_size(pdf_document, reduced_xrefs)
+
+
+def page_content_size(page):
+    """Returns the size in bytes of the decompressed drawing instructions of a page and of the forms it uses."""
+    pdf_document = page.parent
+    return len(page.read_contents()) + sum(len(pdf_document.xref_stream(form[0]) or b"")
+                                           for form in page.get_xobjects())
+
 
+def heavy_pages(pdf_document, threshold=HEAVY_PAGE_CONTENT_BYTES):
+    """Returns the 0-indexed numbers of the pages with more than `threshold` bytes of drawing instructions."""
+    return [page.number for page in pdf_document if page_content_size(page) > threshold]
 
-def extract_and_merge_pdfs(pdf_paths, page_selections=None, output_pdf_path=None):
+
+def rasterize_page(pdf_document, page_number, dpi, grayscale):
+    """
+    Renders a page at `dpi`.
+
+    Returns:
+    - tuple: Width and height of the image in pixels and its deflate-compressed samples.
+    """
+    colorspace = pymupdf.csGRAY if grayscale else pymupdf.csRGB
+    pixmap = pdf_document[page_number].get_pixmap(dpi=dpi, colorspace=colorspace)
+    return pixmap.width, pixmap.height, zlib.compress(pixmap.samples_mv)
+
+
+_raster_source = None  # document opened once per worker process of rasterize_pages
+
+
+def _open_raster_source(pdf_path):
+    global _raster_source
+    _raster_source = pymupdf.open(pdf_path)
+
+
+def _rasterize_source_page(page_number, dpi, grayscale):
+    return rasterize_page(_raster_source, page_number, dpi, grayscale)
+
+
+def rasterize_pages(pdf_document, page_numbers, dpi=RASTER_DPI, grayscale=False, workers=None):
+    """
+    Replaces pages of a document with images of them, rendered at the resolution of the target printer and
+    embedded as deflate-compressed images. The printer then only has to print a bitmap instead of interpreting
+    complex vector graphics. Text and links of these pages are no longer selectable.
+
+    Parameters:
+    - pdf_document (pymupdf.Document): The document to change.
+    - page_numbers (list of int): 0-indexed numbers of the pages to rasterize.
+    - dpi (int): Resolution of the page images.
+    - grayscale (bool): Render gray images instead of RGB ones.
+    - workers (int or None): Number of worker processes rendering the pages. If None, the number of CPUs is used.
+      The document is written to a temporary file which every worker opens once.
+
+    Returns:
+    - int: Total size in bytes of the compressed page images.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(page_numbers))
+    colorspace = "DeviceGray" if grayscale else "DeviceRGB"
+    with tempfile.TemporaryDirectory() as temp_dir, ExitStack() as stack:
+        if workers <= 1:
+            page_images = (rasterize_page(pdf_document, page_number, dpi, grayscale) for page_number in page_numbers)
+        else:
+            source_path = os.path.join(temp_dir, "source.pdf")
+            pdf_document.save(source_path)
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers, initializer=_open_raster_source,
+                                                               initargs=(source_path,)))
+            # One page per task, so a single very heavy page does not hold back a whole batch of pages
+            page_images = executor.map(_rasterize_source_page, page_numbers, repeat(dpi), repeat(grayscale))
+
+        images_size = 0
+        # Results arrive in page order, every image is embedded as soon as it's ready
+        for page_number, (width, height, samples) in zip(page_numbers, page_images):
+            page_rect = pdf_document[page_number].rect
+            pdf_document.delete_page(page_number)
+            page = pdf_document.new_page(pno=page_number, width=page_rect.width, height=page_rect.height)
+            # The image object is written directly, pymupdf would store the samples uncompressed
+            xref = pdf_document.get_new_xref()
+            pdf_document.update_object(xref, f"<</Type/XObject/Subtype/Image/Width {width}/Height {height}"
+                                             f"/ColorSpace/{colorspace}/BitsPerComponent 8>>")
+            pdf_document.update_stream(xref, samples, compress=False)
+            pdf_document.xref_set_key(xref, "Filter", "/FlateDecode")
+            page.insert_image(page.rect, xref=xref)
+            images_size += len(samples)
+    return images_size
+
+
+def extract_and_merge_pdfs(pdf_paths, page_selections=None, output_pdf_path=None, save_profile="fast", use_mmap=False,
+                           color_mode="color", rasterize=None, raster_dpi=RASTER_DPI, page_index=None, overlay=None,
+                           split=None, deduplicate=False, memory_budget=None, observer=None):
     """
     Extracts specific pages from multiple PDF files and combines them into a new PDF file.
     If page_selections is None or empty for a file, all pages from that file are included.
 
     Parameters:
-    - pdf_paths: A list of paths to the source PDF files.
-    - page_selections: A list of lists of tuples, where each inner list contains tuples representing
-      individual pages or page ranges (as tuples) to be extracted from the corresponding PDF file in pdf_paths.
-      If None or if any list inside is empty, all pages from that file will be included.
+    - pdf_paths: A list of PDF sources: paths to PDF files or in-memory buffers (bytes, bytearray, memoryview,
+      mmap.mmap or BytesIO objects).
+    - page_selections: A list with one selection per file in pdf_paths. Every selection is a PageSelection,
+      a page selection expression such as "1-3,7,10-" or "text:Summary", or a list of tuples representing
+      individual pages (1-tuples) or page ranges (2-tuples) to be extracted from the corresponding PDF file.
+      If None or if any selection inside is empty, all pages from that file will be included.
     - output_pdf_path (optional): The path for saving the output PDF to disk. If None, saves to an in-memory buffer.
+    - save_profile (str): Output optimization profile, one of "fast" (default), "compact" or "web".
+      See SAVE_PROFILES.
+    - use_mmap (bool or str): Open source files through mmap, see `open_pdf_source`. Use "auto" to memory-map
+      only large files.
+    - color_mode (str): One of COLOR_MODES. The pages are converted after merging, see `reduce_document_colors`.
+    - rasterize (str, PageSelection or None): Pages of the merged document to replace with images for the printer,
+      see `rasterize_pages`: "heavy" for pages with more than HEAVY_PAGE_CONTENT_BYTES of drawing instructions,
+      or a page selection of the merged document (an empty one means all pages). If None, nothing is rasterized.
+    - raster_dpi (int): Resolution of rasterized pages, ideally the resolution of the target printer.
+    - page_index (PageIndex or None): The page index resolving the text queries of the selections, one at its
+      default location if None. Sources missing from the index are indexed in parallel before merging.
+    - overlay (dict or None): A stamp, text and page numbers drawn on every page of the merged document,
+      see OVERLAY_FIELDS and `apply_overlay`.
+    - split (SplitPolicy, dict or None): Split the output into several files, by pages, size or source file.
+      See SplitPolicy. Page numbers of the overlay and a page selection to rasterize refer to the whole output.
+    - deduplicate (bool): Keep one instance of the identical fonts, images, ICC profiles and other objects
+      which the sources embed each, see `deduplicate_resources`. For batches made by the same generator.
+    - memory_budget (int or None): Bytes of memory the job may use. Once it's over budget, the pages copied so far
+      are written to a temporary file and read from there when the output is saved, see `spill_document`.
+    - observer (callable or None): Called with a dict for every stage of the job, see instrumentation.EVENTS.
+      Opening a source file is reported as "image_decode" and copying its pages as "image_draw".
 
     Returns:
     - If output_pdf_path is None, returns a BytesIO buffer containing the merged PDF.
     - If output_pdf_path is provided, saves the PDF to the specified path and returns None.
+    - With a split policy, returns a list of the files: paths numbered after output_pdf_path
+      ("merged_001.pdf", ...), or BytesIO buffers.
     """
-    with pymupdf.open() as output_pdf:  # create a new PDF for the merged output
+    reporter = job_reporter(observer, "merge")
+    check_color_mode(color_mode)
+    check_overlay(overlay)
+    policy = SplitPolicy.coerce(split)
+    # Get the selection for every PDF, an empty one (all pages) if page_selections is None or too short
+    selections = [PageSelection.coerce(page_selections[pdf_index] if page_selections and
+                                       len(page_selections) > pdf_index else None)
+                  for pdf_index in range(len(pdf_paths))]
+    text_matches = selection_matches(pdf_paths, selections, page_index)
+    raster_selection = None if rasterize is None or rasterize == "heavy" else PageSelection.coerce(rasterize)
+    # Page numbers and rasterized pages refer to the whole document, which split files only know if it's counted
+    total_pages = None
+    if policy and ((overlay and overlay.get("page_numbers")) or raster_selection is not None):
+        total_pages = count_selected_pages(pdf_paths, selections, text_matches, use_mmap)
+    budget = MemoryBudget(memory_budget)
+    reporter.start(len(pdf_paths))
+
+    outputs = []  # the finished files of a split output
+    next_output = split_outputs(output_pdf_path)
+    pages_done = 0  # pages in the finished files
+
+    def finish_part(part_pdf):
+        first_page = pages_done
+        part_overlay = overlay
+        if overlay and total_pages is not None:
+            part_overlay = dict(overlay, first_page=overlay.get("first_page", 1) + first_page,
+                                page_count=overlay.get("page_count") or total_pages)
+        part_rasterize = rasterize
+        if raster_selection is not None:
+            pages = raster_selection.page_set(total_pages if total_pages is not None else part_pdf.page_count)
+            part_rasterize = sorted(page - first_page for page in pages
+                                    if first_page <= page < first_page + part_pdf.page_count)
+        output = next_output() if policy else output_pdf_path or io.BytesIO()
+        finish_merged_document(part_pdf, output, save_profile, color_mode, part_rasterize, raster_dpi, part_overlay,
+                               deduplicate, reporter)
+        for part_output in split_oversized_output(output, policy.max_bytes, next_output, save_profile):
+            outputs.append(part_output)
+            reporter.saved(part_output)
+            if is_path_source(part_output):
+                logger.info("Merged PDF created at: %s", part_output)
+        return part_pdf.page_count
+
+    output_pdf = pymupdf.open()  # create a new PDF for the merged output
+    try:
+        part_size = 0  # estimated size of the pages in output_pdf
+        spilled_size = 0  # estimated size of the pages of output_pdf spilled to disk
         for pdf_index, pdf_path in enumerate(pdf_paths):
-            if not os.path.exists(pdf_path):
-                print(f"File not found: {pdf_path}")
+            if is_path_source(pdf_path) and not os.path.exists(pdf_path):
+                logger.warning("File not found: %s", pdf_path)
                 continue
 
-            # Open each PDF file with context manager
-            with pymupdf.open(pdf_path) as pdf_document:
+            # Open each PDF source with context manager
+            reporter.begin()
+            with open_pdf_source(pdf_path, use_mmap) as pdf_document:
+                reporter.decoded(pdf_index, pdf_path if is_path_source(pdf_path) else source_name(pdf_path))
                 last_page = pdf_document.page_count
+                if policy.by_source and output_pdf.page_count:
+                    pages_done += finish_part(output_pdf)
+                    output_pdf.close()
+                    output_pdf, part_size, spilled_size = pymupdf.open(), 0, 0
+                page_size = source_size(pdf_path) / max(last_page, 1)
+
+                # If selection is empty, add all pages
+                selection = selections[pdf_index]
+                runs = selection.runs(last_page, text_matches[pdf_index]) if selection else [(0, last_page - 1)]
+                copied = 0
+                # Every run of consecutive (or reversed consecutive) pages is copied with one insert,
+                # unless the run does not fit into the current file of a split output
+                for run in runs:
+                    while run is not None:
+                        room = policy.page_room(output_pdf.page_count, part_size, page_size)
+                        if room == 0:
+                            pages_done += finish_part(output_pdf)
+                            output_pdf.close()
+                            output_pdf, part_size, spilled_size = pymupdf.open(), 0, 0
+                            continue
+                        (from_page, to_page), run = split_run(run, room)
+                        output_pdf.insert_pdf(pdf_document, from_page=from_page, to_page=to_page)
+                        part_size += (abs(to_page - from_page) + 1) * page_size
+                        copied += abs(to_page - from_page) + 1
+                reporter.drawn(pdf_index)
+                reporter.pages_copied(copied)
+
+            if budget.check() and part_size - spilled_size >= budget.limit * SPILL_FRACTION:
+                output_pdf = spill_document(output_pdf, budget.spill_path(f"merged_{pages_done:06d}.pdf"))
+                spilled_size = part_size
+
+        if output_pdf.page_count or not outputs:
+            finish_part(output_pdf)
+    finally:
+        output_pdf.close()
+        budget.close()
+    reporter.end(budget.peak_rss)
+    if policy:
+        return outputs
+    return outputs[0]
+
+
+def count_selected_pages(pdf_paths, selections, text_matches, use_mmap=False):
+    """Returns the number of pages the selections take from the PDF sources, skipping missing files."""
+    pages = 0
+    for pdf_path, selection, matches in zip(pdf_paths, selections, text_matches):
+        if is_path_source(pdf_path) and not os.path.exists(pdf_path):
+            continue
+        with open_pdf_source(pdf_path, use_mmap) as pdf_document:
+            if selection:
+                pages += sum(abs(to_page - from_page) + 1
+                             for from_page, to_page in selection.runs(pdf_document.page_count, matches))
+            else:
+                pages += pdf_document.page_count
+    return pages
+
+
+def split_run(run, count):
+    """Splits the first `count` pages off a run of pages. Returns the head and the rest of the run, or None."""
+    from_page, to_page = run
+    step = 1 if to_page >= from_page else -1
+    if count >= abs(to_page - from_page) + 1:
+        return run, None
+    return (from_page, from_page + step * (count - 1)), (from_page + step * count, to_page)
+
+
+def finish_merged_document(output_pdf, output, save_profile, color_mode, rasterize, raster_dpi, overlay, deduplicate,
+                           reporter):
+    """
+    Converts a merged document for the printer and saves it, see `extract_and_merge_pdfs`.
+    `rasterize` is None, "heavy" or a list of 0-indexed pages of this document.
+    """
+    if rasterize is not None:
+        reporter.begin()
+        raster_pages = heavy_pages(output_pdf) if rasterize == "heavy" else rasterize
+        images_size = rasterize_pages(output_pdf, raster_pages, raster_dpi, grayscale=color_mode != "color")
+        reporter.rasterized(len(raster_pages), images_size)
+
+    colors_reduced = color_mode != "color"
+    if colors_reduced:
+        reporter.begin()
+        bytes_before, bytes_after = reduce_document_colors(output_pdf, color_mode)
+        reporter.colors_reduced(None, None, bytes_before, bytes_after)
+
+    # After the conversions, which give every page its own copy of the converted images
+    if deduplicate:
+        reporter.begin()
+        duplicates, bytes_saved = deduplicate_resources(output_pdf)
+        reporter.deduplicated(duplicates, bytes_saved)
+        logger.info("Shared %d duplicate objects, %d bytes saved.", duplicates, bytes_saved)
 
-                # Get the selection list for this PDF, or use an empty list if page_selections is None
-                selections = page_selections[pdf_index] if page_selections and len(page_selections) > pdf_index else []
-                if not selections:  # If selections is empty, add all pages
-                    output_pdf.insert_pdf(pdf_document)
-                else:
-                    for selection in selections:
-                        if len(selection) == 1:  # Single page tuple
-                            page_num = selection[0] - 1  # Convert to 0-indexed
-                            if 0 <= page_num < last_page:
-                                output_pdf.insert_pdf(pdf_document, from_page=page_num, to_page=page_num)
-                        elif len(selection) == 2:  # Page range tuple
-                            start_page, end_page = selection
-                            start_page -= 1  # Convert to 0-indexed
-                            end_page = min(end_page, last_page) - 1  # Adjust to last page if necessary
-                            output_pdf.insert_pdf(pdf_document, from_page=start_page, to_page=end_page)
-
-        # Save to a file if output_pdf_path is provided
+    # The overlay is drawn after the conversions, so the stamp is neither rasterized nor recolored
+    if overlay:
+        apply_overlay(output_pdf, overlay)
+
+    reporter.begin()
+    save_pdf_document(output_pdf, output, save_profile,
+                      collect_garbage=colors_reduced or rasterize is not None or deduplicate)
+    if not is_path_source(output):
+        output.seek(0)  # Reset the buffer position to the start
+
+
+def deduplicate_resources(pdf_document):
+    """
+    Keeps one instance of the identical objects of a merged document, such as the fonts, images and ICC profiles
+    embedded by every source made by the same generator. Streams are compared by the SHA-256 hash of their
+    encoded data. Objects which become identical once their references point to the kept instances, such as the
+    font dictionaries of merged font files, are merged in further rounds. The duplicates are left unreferenced,
+    so they are dropped when the document is saved with garbage collection.
+
+    Unlike saving with garbage=4, which compares the objects pairwise, this takes linear time in the size of
+    the document.
+
+    Returns:
+    - tuple of int: The number of duplicate objects and the bytes of their stream data.
+    """
+    texts = {}  # xref -> object source, with its references updated to the kept instances
+    stream_digests = {}  # xref -> (hash, size) of the encoded stream data
+    for xref in range(1, pdf_document.xref_length()):
+        text = pdf_document.xref_object(xref, compressed=True)
+        if text == "null":
+            continue
+        texts[xref] = text
+        if pdf_document.xref_is_stream(xref):
+            data = pdf_document.xref_stream_raw(xref)
+            stream_digests[xref] = (hashlib.sha256(data).digest(), len(data))
+    annotations = annotation_objects(pdf_document, texts)
+    candidates = [xref for xref, text in texts.items()
+                  if xref not in annotations and not any(key in text for key in UNSHARED_OBJECT_KEYS)]
+
+    kept = {}  # xref of a duplicate -> xref of the instance kept instead
+    changed = set()
+
+    def kept_reference(match):
+        xref = kept.get(int(match.group(1)))
+        return match.group(0) if xref is None else f"{xref} 0 R"
+
+    while True:
+        instances = {}  # (source, stream hash) -> xref of the first object
+        duplicates = 0
+        for xref in candidates:
+            if xref in kept:
+                continue
+            instance = instances.setdefault((texts[xref], stream_digests.get(xref)), xref)
+            if instance != xref:
+                kept[xref] = instance
+                duplicates += 1
+        if not duplicates:
+            break
+        for xref, text in texts.items():
+            if xref not in kept and " 0 R" in text:
+                updated_text = PDF_REFERENCE.sub(kept_reference, text)
+                if updated_text != text:
+                    texts[xref] = updated_text
+                    changed.add(xref)
+
+    for xref in changed:
+        pdf_document.update_object(xref, texts[xref])
+    return len(kept), sum(stream_digests[xref][1] for xref in kept if xref in stream_digests)
+
+
+def annotation_objects(pdf_document, texts):
+    """
+    Returns the xrefs of the annotations of all pages and of every object they reference, such as their
+    actions, popups and appearance streams, without following the references back to the pages.
+
+    Parameters:
+    - pdf_document (pymupdf.Document): The document.
+    - texts (dict): xref -> object source of the objects of the document.
+    """
+    page_xrefs = {pdf_document.page_xref(page_number) for page_number in range(pdf_document.page_count)}
+    pending = []
+    for page_xref in page_xrefs:
+        kind, value = pdf_document.xref_get_key(page_xref, "Annots")
+        if kind == "xref":  # an indirect array
+            value = texts.get(int(value.split()[0]), "")
+        if kind in ("array", "xref"):
+            pending.extend(int(match.group(1)) for match in PDF_REFERENCE.finditer(value))
+
+    objects = set()
+    while pending:
+        xref = pending.pop()
+        if xref in objects or xref in page_xrefs or xref not in texts:
+            continue
+        objects.add(xref)
+        pending.extend(int(match.group(1)) for match in PDF_REFERENCE.finditer(texts[xref]))
+    return objects
+
+
+def _merge_shard(pdf_paths, page_selections, output_pdf_path, use_mmap, color_mode, page_index, deduplicate,
+                 memory_budget):
+    """
+    Merges one contiguous slice of the sources into a partial output file in a worker process. Returns the path
+    of the file, or None if the shard has no pages, e.g. when all its sources are missing.
+    """
+    text_matches = selection_matches(pdf_paths, page_selections, page_index)
+    if not count_selected_pages(pdf_paths, page_selections, text_matches, use_mmap):
+        return None
+    return extract_and_merge_pdfs(pdf_paths, page_selections, output_pdf_path, use_mmap=use_mmap,
+                                  color_mode=color_mode, page_index=page_index, deduplicate=deduplicate,
+                                  memory_budget=memory_budget)
+
+
+def extract_and_merge_pdfs_sharded(
+        pdf_paths,
+        page_selections=None,
+        output_pdf_path=None,
+        save_profile="fast",
+        workers=None,
+        shard_size=None,
+        use_mmap=False,
+        color_mode="color",
+        page_index=None,
+        overlay=None,
+        deduplicate=False,
+        memory_budget=None):
+    """
+    Merges a large number of PDF files in parallel. Every worker process merges a contiguous slice (shard)
+    of the sources into a partial PDF file on disk, then the partial files are concatenated in source order.
+    Each worker opens one source at a time, and the final pass opens one partial file at a time and spills
+    the output to disk after each (see `join_pdf_files`), so the number of open files stays bounded by the
+    number of workers and the memory of the final pass by the size of a shard.
+
+    Parameters:
+    - pdf_paths: A list of paths to the source PDF files. Bytes sources are accepted too, but they are copied
+      to the worker processes, and mmap objects cannot be sent to them at all.
+    - page_selections: Page selections for every file in pdf_paths, as for `extract_and_merge_pdfs`.
+    - output_pdf_path (optional): The path for saving the output PDF to disk. If None, saves to an in-memory buffer.
+    - save_profile (str): Output optimization profile of the final file, see SAVE_PROFILES.
+    - workers (int or None): Number of worker processes. If None, the number of CPUs is used.
+    - shard_size (int or None): Number of source files per shard. If None, the sources are split into
+      about four shards per worker to balance uneven file sizes.
+    - use_mmap (bool or str): Open source files through mmap in the workers, see `open_pdf_source`.
+    - color_mode (str): One of COLOR_MODES. Every worker converts the pages of its shard.
+    - page_index (PageIndex or None): The page index resolving text queries, see `extract_and_merge_pdfs`.
+      Missing sources are indexed in parallel before the shards are started.
+    - overlay (dict or None): A stamp, text and page numbers drawn on every page, see OVERLAY_FIELDS. It is
+      drawn in the final pass, so the page numbers run across the shards.
+    - deduplicate (bool): Keep one instance of identical objects, see `deduplicate_resources`. Every shard is
+      deduplicated by its worker, and the final pass merges the instances left in different shards.
+    - memory_budget (int or None): Bytes of memory every worker process may use, see `extract_and_merge_pdfs`.
+
+    Returns:
+    - If output_pdf_path is None, returns a BytesIO buffer containing the merged PDF.
+    - If output_pdf_path is provided, saves the PDF to the specified path and returns the path.
+    """
+    workers = workers or os.cpu_count() or 1
+    if shard_size is None:
+        shard_size = max(1, math.ceil(len(pdf_paths) / (workers * 4)))
+
+    if workers == 1 or len(pdf_paths) <= shard_size:
+        # Not worth starting processes for a single shard
+        return extract_and_merge_pdfs(pdf_paths, page_selections, output_pdf_path, save_profile, use_mmap,
+                                      color_mode, page_index=page_index, overlay=overlay,
+                                      deduplicate=deduplicate, memory_budget=memory_budget)
+
+    check_overlay(overlay)
+
+    page_selections = [PageSelection.coerce(selection) for selection in page_selections or []]
+    page_selections += [PageSelection()] * (len(pdf_paths) - len(page_selections))
+    # The shards find every source in the index, and the digests of the files already computed here
+    page_index = page_index or PageIndex(workers=workers)
+    selection_matches(pdf_paths, page_selections, page_index)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for shard_index, start in enumerate(range(0, len(pdf_paths), shard_size)):
+                shard_path = os.path.join(temp_dir, f"shard_{shard_index:06d}.pdf")
+                futures.append(executor.submit(_merge_shard, pdf_paths[start:start + shard_size],
+                                               page_selections[start:start + shard_size], shard_path, use_mmap,
+                                               color_mode, page_index, deduplicate, memory_budget))
+            # Futures are kept in submission order, so the source order is preserved. Shards without pages
+            # are skipped, like the missing sources of a sequential merge
+            shard_paths = [shard_path for shard_path in (future.result() for future in futures) if shard_path]
+        if not shard_paths:
+            raise ValueError("The selected pages of the sources are empty, there is nothing to merge.")
+
+        output = output_pdf_path or io.BytesIO()
+        budget = MemoryBudget(memory_budget)
+        try:
+            join_pdf_files(shard_paths, output, budget, save_profile, deduplicate, overlay)
+        finally:
+            budget.close()
         if output_pdf_path:
-            output_pdf.save(output_pdf_path)
-            print(f"Merged PDF created at: {output_pdf_path}")
-            return output_pdf_path
-        else:
-            # Save to an in-memory buffer
-            pdf_buffer = io.BytesIO()
-            output_pdf.save(pdf_buffer)
-            pdf_buffer.seek(0)  # Reset the buffer position to the start
-            return pdf_buffer
+            logger.info("Merged PDF created at: %s", output_pdf_path)
+        return output
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     pdf_paths = ["file1.pdf", "file2.pdf", "file3.pdf"]
     page_selections = [[(1,)], [(1,)], [(1,)]]
     extract_and_merge_pdfs(pdf_paths, page_selections, "merged.pdf")
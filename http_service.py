@@ -0,0 +1,327 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from create_file import (RASTER_DPI, add_images_to_pdf_in_grid, add_images_to_template,
+                         create_pdf_with_best_orientation_images, extract_and_merge_pdfs)
+from instrumentation import Histogram
+from layout_template import LayoutTemplate
+from metrics import (CONTENT_TYPE, JOB_FAILURES, JOBS_IN_FLIGHT, JOBS_REJECTED, REGISTRY, REQUEST_DURATION,
+                     metrics_observer, reset_worker_metrics)
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks the resulting PDF is streamed back in
+CHUNK_SIZE = 64 * 1024
+
+# Job types: engine, name of its output argument and the JSON fields of the job mapped to the engine arguments
+ENGINES = {
+    "grid": (add_images_to_pdf_in_grid, "output_path", {
+        "images": "image_paths", "columns": "columns", "rows": "rows", "angles": "angles",
+        "orientation": "orientation", "page_margin": "page_margin", "image_margin": "image_margin",
+        "color_mode": "color_mode", "overlay": "overlay", "memory_budget": "memory_budget",
+    }),
+    "best-orientation": (create_pdf_with_best_orientation_images, "output_path", {
+        "images": "image_paths", "columns": "columns", "rows": "rows", "orientation": "orientation",
+        "page_margin": "page_margin", "image_margin": "image_margin", "color_mode": "color_mode",
+        "overlay": "overlay", "memory_budget": "memory_budget",
+    }),
+    "template": (add_images_to_template, "output_path", {
+        "template": "template", "images": "image_paths", "angles": "angles", "color_mode": "color_mode",
+        "overlay": "overlay", "memory_budget": "memory_budget",
+    }),
+    "merge": (extract_and_merge_pdfs, "output_pdf_path", {
+        "sources": "pdf_paths", "selections": "page_selections", "save_profile": "save_profile",
+        "color_mode": "color_mode", "rasterize": "rasterize", "raster_dpi": "raster_dpi", "overlay": "overlay",
+        "deduplicate": "deduplicate", "memory_budget": "memory_budget",
+    }),
+}
+# JSON fields of print jobs besides "path" (a PDF file on the station) or "job" (a job generating the PDF)
+PRINT_OPTIONS = ("printer", "copies", "orientation", "duplex", "flip_side", "sort_copies")
+
+
+class JobRejected(Exception):
+    """Raised when the job queue is full."""
+
+
+def engine_arguments(job_type, job):
+    """Validates the JSON fields of a job and returns them as keyword arguments of the engine."""
+    if job_type not in ENGINES:
+        raise ValueError(f"Unknown job type: '{job_type}'. Use one of {', '.join(ENGINES)} or print.")
+    _, _, fields = ENGINES[job_type]
+    unknown = set(job) - set(fields)
+    if unknown:
+        raise ValueError(f"Unknown fields of a {job_type} job: {', '.join(sorted(unknown))}.")
+    required = "sources" if job_type == "merge" else "images"
+    if not job.get(required):
+        raise ValueError(f"The '{required}' field must be a non-empty list.")
+    arguments = {fields[name]: value for name, value in job.items()}
+    if job_type == "template":
+        # Looked up in this process, where the templates are registered, and sent to the worker with the job
+        arguments["template"] = LayoutTemplate.coerce(job.get("template"))
+    return arguments
+
+
+def run_engine(job_type, arguments, output_path):
+    """
+    Runs an engine in a worker process, writing the PDF to `output_path`.
+
+    Returns:
+    - dict: The metrics of the worker, drained after the job, see MetricsRegistry.drain.
+    """
+    engine, output_argument, _ = ENGINES[job_type]
+    engine(**arguments, **{output_argument: output_path}, observer=metrics_observer)
+    return REGISTRY.drain()
+
+
+def printer_resolution(printer_name):
+    from printer_utils import PrinterManager
+
+    printer_manager = PrinterManager(printer_name)
+    try:
+        return printer_manager.get_printer_resolution()
+    finally:
+        # Only a handle which was opened, so a failure to open the printer is the error the client sees
+        if printer_manager.printer_handler:
+            printer_manager.close_printer()
+
+
+def print_file(path, options):
+    # Imported here, so the service also runs (without print jobs) where the Windows printing modules are missing
+    from printer_utils import PrinterManager
+
+    printer_manager = PrinterManager(options.get("printer"))
+    printer_manager.print_pdf(path, **{name: options[name] for name in PRINT_OPTIONS[1:] if name in options})
+
+
+class JobService:
+    """
+    Runs engine jobs on a bounded process pool. At most `workers + queue_size` jobs are accepted at a time;
+    further jobs are rejected at once, so a burst of requests cannot pile up unbounded work.
+    Print jobs are run one at a time on a separate thread, since they wait for the printer spooler.
+    """
+
+    def __init__(self, workers=None, queue_size=8):
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + queue_size
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=reset_worker_metrics)
+        self.print_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="print")
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latency = {}  # job type -> Histogram of seconds from request to finished output
+        self.started = time.time()
+
+    def acquire(self):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            JOBS_REJECTED.inc()
+            raise JobRejected()
+        with self.lock:
+            self.in_flight += 1
+
+    def release(self, job_type, started, succeeded):
+        latency = time.monotonic() - started
+        with self.lock:
+            self.in_flight -= 1
+            if succeeded:
+                self.completed += 1
+                histogram = self.latency.get(job_type)
+                if histogram is None:
+                    histogram = self.latency[job_type] = Histogram()
+                histogram.add(latency)
+            else:
+                self.failed += 1
+        if succeeded:
+            REQUEST_DURATION.observe(latency, job=job_type)
+        else:
+            JOB_FAILURES.inc(job=job_type)
+        self.slots.release()
+
+    def generate(self, job_type, job):
+        """
+        Runs a generation job and returns the path of a temporary file with the resulting PDF.
+        The caller deletes the file.
+        """
+        arguments = engine_arguments(job_type, job)
+        self.acquire()
+        started = time.monotonic()
+        output_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+        output_file.close()
+        succeeded = False
+        try:
+            REGISTRY.merge(self.pool.submit(run_engine, job_type, arguments, output_file.name).result())
+            succeeded = True
+            return output_file.name
+        finally:
+            if not succeeded:
+                os.remove(output_file.name)
+            self.release(job_type, started, succeeded)
+
+    def print_job(self, job):
+        unknown = set(job) - set(PRINT_OPTIONS) - {"path", "job"}
+        if unknown:
+            raise ValueError(f"Unknown fields of a print job: {', '.join(sorted(unknown))}.")
+        if ("path" in job) == ("job" in job):
+            raise ValueError("A print job needs either a 'path' of a PDF file or a 'job' generating it.")
+
+        if "job" in job:
+            inner_job = dict(job["job"])
+            if inner_job.get("rasterize") is not None and "raster_dpi" not in inner_job:
+                # Rasterize at the resolution of the printer the job goes to
+                inner_job["raster_dpi"] = printer_resolution(job.get("printer")) or RASTER_DPI
+            path = self.generate(inner_job.pop("type", None), inner_job)
+        else:
+            path = job["path"]
+        try:
+            self.acquire()
+            started = time.monotonic()
+            succeeded = False
+            try:
+                self.print_pool.submit(print_file, path, job).result()
+                succeeded = True
+            finally:
+                self.release("print", started, succeeded)
+        finally:
+            # Also when the print job is rejected, so the generated file is not left behind
+            if "job" in job:
+                os.remove(path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "queue_depth": max(self.in_flight - self.workers, 0),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "uptime_seconds": time.time() - self.started,
+                "latency_seconds": {job_type: histogram.summary() for job_type, histogram in self.latency.items()},
+            }
+
+    def metrics(self):
+        """Returns the metrics of the service and of its jobs in the Prometheus text exposition format."""
+        with self.lock:
+            JOBS_IN_FLIGHT.set(self.in_flight)
+        return REGISTRY.render()
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.print_pool.shutdown(cancel_futures=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs/<type> with a JSON body runs a job; generation jobs stream the PDF back, print jobs answer
+    with JSON. GET /stats returns the queue and latency statistics, GET /metrics the metrics of the service,
+    its jobs and the printers in the Prometheus text format.
+    """
+    protocol_version = "HTTP/1.1"  # needed for chunked responses
+    service = None  # set by create_server()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.service.stats())
+        elif self.path == "/metrics":
+            self.send_body(200, CONTENT_TYPE, self.service.metrics().encode())
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        if not self.path.startswith("/jobs/"):
+            self.send_json(404, {"error": "Not found."})
+            return
+        job_type = self.path[len("/jobs/"):]
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(job, dict):
+                raise ValueError("The job must be a JSON object.")
+            if job_type == "print":
+                self.service.print_job(job)
+                self.send_json(200, {"status": "printed"})
+            else:
+                self.stream_file(self.service.generate(job_type, job))
+        except JobRejected:
+            self.send_json(503, {"error": "Too many jobs, try again later."}, {"Retry-After": "1"})
+        except (ValueError, TypeError) as error:
+            self.send_json(400, {"error": str(error)})
+        except Exception as error:
+            logger.exception("%s job failed", job_type)
+            self.send_json(500, {"error": f"{type(error).__name__}: {error}"})
+
+    def stream_file(self, path):
+        try:
+            with open(path, "rb") as pdf_file:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    while chunk := pdf_file.read(CHUNK_SIZE):
+                        self.wfile.write(b"%X\r\n%b\r\n" % (len(chunk), chunk))
+                    self.wfile.write(b"0\r\n\r\n")
+                except Exception:
+                    # The status line is sent already, so the response is aborted instead: the client sees
+                    # the connection close without the last chunk and knows the PDF is incomplete
+                    logger.exception("Streaming %s failed", path)
+                    self.close_connection = True
+        finally:
+            os.remove(path)
+
+    def send_json(self, status, body, headers=None):
+        self.send_body(status, "application/json", json.dumps(body).encode(), headers)
+
+    def send_body(self, status, content_type, data, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, message_format, *args):
+        logger.info("%s - %s", self.address_string(), message_format % args)
+
+
+def create_server(service, host="127.0.0.1", port=8631):
+    handler = type("BoundJobRequestHandler", (JobRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP service running PDF generation and print jobs.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8631)
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--queue-size", type=int, default=8, help="jobs accepted beyond the busy workers")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    service = JobService(args.workers, args.queue_size)
+    server = create_server(service, args.host, args.port)
+    logger.info("Listening on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
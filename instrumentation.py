@@ -0,0 +1,323 @@
+import bisect
+import math
+import os
+import time
+
+# Upper bounds (in seconds) of the duration histogram buckets, the last bucket is unbounded
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Events reported by the engines of create_file to their `observer`. Every event is a dict with an "event" key
+# holding one of these names, a "job" key holding the engine name and the fields listed here:
+# - "job_start": "items" (number of images or source files).
+# - "image_decode": "index", "source", "duration" (s). Opening an image or a source PDF file.
+# - "image_draw": "index", "duration" (s). Drawing an image on a page, or copying pages of a source PDF file.
+# - "color_reduce": "index", "source", "duration" (s), "bytes_before", "bytes_after". Converting an image to
+#   the gray or mono color mode, once per unique image; the sizes are those of the image file and of the
+#   converted image. The merge engine reports the whole document once, with "index" and "source" None and
+#   the total size of its image streams.
+# - "rasterize": "pages" (number of pages replaced with images), "duration" (s), "bytes" (size of the images).
+# - "deduplicate": "objects" (number of duplicate objects dropped), "duration" (s), "bytes" (size of their
+#   stream data, saved in the output).
+# - "page_emit": "page" (1-based number of the finished page), "duration" (s, only for generated pages).
+# - "save": "duration" (s), "bytes" (size of the output). Reported for every file of a split output.
+# - "job_end": "duration" (s), "pages", "bytes" (total size of the output files), "peak_rss" (peak resident memory
+#   of the process during the job in bytes, see memory_usage.MemoryBudget).
+EVENTS = ("job_start", "image_decode", "image_draw", "color_reduce", "rasterize", "deduplicate", "page_emit", "save",
+          "job_end")
+
+
+def output_size(output):
+    """Returns the size in bytes of an output written to a file path or a BytesIO buffer."""
+    if isinstance(output, (str, os.PathLike)):
+        return os.path.getsize(output)
+    return output.getbuffer().nbytes
+
+
+class JobReporter:
+    """
+    Times the stages of one engine job and reports them to an observer as events (see EVENTS).
+    Engines call `job_reporter(observer, job)` which returns NULL_REPORTER when nothing is subscribed,
+    so an unobserved job pays only for a few empty method calls.
+    """
+    __slots__ = ("observer", "job", "job_start", "stage_start", "page_start", "pages", "bytes")
+
+    def __init__(self, observer, job):
+        self.observer = observer
+        self.job = job
+        self.job_start = self.stage_start = self.page_start = time.perf_counter()
+        self.pages = 0
+        self.bytes = 0
+
+    def start(self, items):
+        self.job_start = self.stage_start = self.page_start = time.perf_counter()
+        self.observer({"event": "job_start", "job": self.job, "items": items})
+
+    def begin(self):
+        """Marks the start of the stage reported by the next `decoded`, `drawn` or `saved` call."""
+        self.stage_start = time.perf_counter()
+
+    def decoded(self, index, source):
+        now = time.perf_counter()
+        self.observer({"event": "image_decode", "job": self.job, "index": index, "source": source,
+                       "duration": now - self.stage_start})
+        self.stage_start = now
+
+    def drawn(self, index):
+        now = time.perf_counter()
+        self.observer({"event": "image_draw", "job": self.job, "index": index, "duration": now - self.stage_start})
+        self.stage_start = now
+
+    def colors_reduced(self, index, source, bytes_before, bytes_after):
+        now = time.perf_counter()
+        self.observer({"event": "color_reduce", "job": self.job, "index": index, "source": source,
+                       "duration": now - self.stage_start, "bytes_before": bytes_before, "bytes_after": bytes_after})
+        self.stage_start = now
+
+    def rasterized(self, pages, images_size):
+        now = time.perf_counter()
+        self.observer({"event": "rasterize", "job": self.job, "pages": pages, "duration": now - self.stage_start,
+                       "bytes": images_size})
+        self.stage_start = now
+
+    def deduplicated(self, objects, bytes_saved):
+        now = time.perf_counter()
+        self.observer({"event": "deduplicate", "job": self.job, "objects": objects, "duration": now - self.stage_start,
+                       "bytes": bytes_saved})
+        self.stage_start = now
+
+    def page_emitted(self):
+        now = time.perf_counter()
+        self.pages += 1
+        self.observer({"event": "page_emit", "job": self.job, "page": self.pages, "duration": now - self.page_start})
+        self.page_start = now
+
+    def pages_copied(self, count):
+        """Reports pages copied from a source document, which have no duration of their own."""
+        for _ in range(count):
+            self.pages += 1
+            self.observer({"event": "page_emit", "job": self.job, "page": self.pages})
+        self.page_start = time.perf_counter()
+
+    def saved(self, output):
+        """Reports a written output file. Jobs split into several files report every file."""
+        size = output_size(output)
+        self.bytes += size
+        self.observer({"event": "save", "job": self.job, "duration": time.perf_counter() - self.stage_start,
+                       "bytes": size})
+
+    def end(self, peak_rss=None):
+        self.observer({"event": "job_end", "job": self.job, "duration": time.perf_counter() - self.job_start,
+                       "pages": self.pages, "bytes": self.bytes, "peak_rss": peak_rss})
+
+
+class _NullReporter:
+    """Reporter used when a job has no observer: every method does nothing."""
+    __slots__ = ()
+
+    def start(self, items):
+        pass
+
+    def begin(self):
+        pass
+
+    def decoded(self, index, source):
+        pass
+
+    def drawn(self, index):
+        pass
+
+    def colors_reduced(self, index, source, bytes_before, bytes_after):
+        pass
+
+    def rasterized(self, pages, images_size):
+        pass
+
+    def deduplicated(self, objects, bytes_saved):
+        pass
+
+    def page_emitted(self):
+        pass
+
+    def pages_copied(self, count):
+        pass
+
+    def saved(self, output):
+        pass
+
+    def end(self, peak_rss=None):
+        pass
+
+
+NULL_REPORTER = _NullReporter()
+
+
+def job_reporter(observer, job):
+    """Returns a JobReporter for `observer`, or NULL_REPORTER if `observer` is None."""
+    return JobReporter(observer, job) if observer is not None else NULL_REPORTER
+
+
+def combine_observers(*observers):
+    """Returns a single observer forwarding every event to all the given observers (None ones are skipped)."""
+    observers = [observer for observer in observers if observer is not None]
+    if not observers:
+        return None
+    if len(observers) == 1:
+        return observers[0]
+
+    def observer(event):
+        for each_observer in observers:
+            each_observer(event)
+    return observer
+
+
+def progress_observer(callback):
+    """
+    Returns an observer calling `callback(done, total)` after every image or source file is processed,
+    e.g. to move a progress bar.
+    """
+    state = {"total": 0}
+
+    def observer(event):
+        if event["event"] == "job_start":
+            state["total"] = event["items"]
+            callback(0, state["total"])
+        elif event["event"] == "image_draw":
+            callback(event["index"] + 1, state["total"])
+    return observer
+
+
+class Histogram:
+    """Counts values in buckets with fixed upper bounds, like Prometheus histograms."""
+    __slots__ = ("bounds", "counts", "count", "total", "minimum", "maximum")
+
+    def __init__(self, bounds=DURATION_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other):
+        """Adds the values counted by another histogram with the same bounds, e.g. in another process."""
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def quantile(self, fraction):
+        """Returns the upper bound of the bucket holding the given quantile (an estimate, as in Prometheus)."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (self.maximum,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "sum": self.total, "min": self.minimum, "max": self.maximum,
+                "mean": self.total / self.count, "p50": self.quantile(0.5), "p95": self.quantile(0.95)}
+
+
+class TimingCollector:
+    """
+    An observer which aggregates the events of any number of jobs into duration histograms per stage,
+    plus totals of jobs, pages, bytes written and bytes saved by color reduction and deduplication, and the
+    highest peak memory of the jobs.
+
+    Usage:
+        collector = TimingCollector()
+        add_images_to_pdf_in_grid(image_paths=paths, observer=collector)
+        print(collector.report())
+    """
+
+    def __init__(self):
+        self.durations = {}  # (job, event) -> Histogram
+        self.jobs = 0
+        self.pages = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+        self.peak_rss = None
+
+    def __call__(self, event):
+        name = event["event"]
+        if name == "job_end":
+            self.jobs += 1
+            self.pages += event["pages"]
+            self.bytes_written += event["bytes"]
+            if event.get("peak_rss") is not None:
+                self.peak_rss = max(self.peak_rss or 0, event["peak_rss"])
+        elif name == "color_reduce":
+            self.bytes_saved += event["bytes_before"] - event["bytes_after"]
+        elif name == "deduplicate":
+            self.bytes_saved += event["bytes"]
+        duration = event.get("duration")
+        if duration is not None:
+            key = (event["job"], name)
+            histogram = self.durations.get(key)
+            if histogram is None:
+                histogram = self.durations[key] = Histogram()
+            histogram.add(duration)
+
+    def summary(self):
+        return {
+            "jobs": self.jobs,
+            "pages": self.pages,
+            "bytes_written": self.bytes_written,
+            "bytes_saved": self.bytes_saved,
+            "peak_rss": self.peak_rss,
+            "durations": {f"{job}.{name}": histogram.summary()
+                          for (job, name), histogram in sorted(self.durations.items())},
+        }
+
+    def report(self):
+        lines = [f"jobs: {self.jobs}, pages: {self.pages}, bytes written: {self.bytes_written}, "
+                 f"bytes saved by color reduction and deduplication: {self.bytes_saved}, "
+                 f"peak memory: {self.peak_rss} bytes",
+                 f"{'stage':<32}{'count':>8}{'total, s':>12}{'mean, ms':>12}{'p95, ms':>12}{'max, ms':>12}"]
+        for (job, name), histogram in sorted(self.durations.items()):
+            lines.append(f"{job + '.' + name:<32}{histogram.count:>8}{histogram.total:>12.3f}"
+                         f"{histogram.total / histogram.count * 1000:>12.2f}{histogram.quantile(0.95) * 1000:>12.2f}"
+                         f"{histogram.maximum * 1000:>12.2f}")
+        return "\n".join(lines)
+
+
+class LogSampler:
+    """
+    Lets a hot loop log a message without flooding the log: `due` is True at the first call and then at most
+    once every `interval` seconds. It costs a clock read per call, much less than formatting a log record.
+
+    Usage:
+        sampler = LogSampler(5)
+        while not done():
+            if sampler.due():
+                logger.info("Still waiting after %d checks", sampler.calls)
+    """
+    __slots__ = ("interval", "next_time", "calls")
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.next_time = -math.inf
+        self.calls = 0
+
+    def due(self):
+        self.calls += 1
+        now = time.monotonic()
+        if now < self.next_time:
+            return False
+        self.next_time = now + self.interval
+        return True
@@ -0,0 +1,338 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from array import array
+
+import pymupdf
+
+from create_file import (add_images_to_pdf_in_grid, add_images_to_template, count_image_cells,
+                         create_pdf_with_best_orientation_images, extract_and_merge_pdfs, open_pdf_source)
+from layout_template import LayoutTemplate
+from metrics import JOB_FAILURES, REGISTRY, metrics_observer
+from page_index import selection_matches
+from page_selection import PageSelection
+
+logger = logging.getLogger(__name__)
+
+# Where the journals and rendered chunks of unfinished jobs are kept, it must survive a restart of the station
+DEFAULT_JOURNAL_ROOT = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/.local/share"),
+                                    "mingling", "jobs")
+JOURNAL_FILE_NAME = "journal.jsonl"
+# Default number of pages per chunk. Even, so duplex chunks don't leave a blank back side between them
+PAGES_PER_CHUNK = 50
+
+# Engines: function, name of its output argument, list arguments which are split into chunks (all of them
+# aligned with the first one)
+ENGINES = {
+    "grid": (add_images_to_pdf_in_grid, "output_path", ("image_paths", "angles")),
+    "best_orientation": (create_pdf_with_best_orientation_images, "output_path", ("image_paths",)),
+    # The template argument must be the name of a registered template or a dict, to be stored in the journal
+    "template": (add_images_to_template, "output_path", ("image_paths", "angles")),
+    "merge": (extract_and_merge_pdfs, "output_pdf_path", ("pdf_paths", "page_selections")),
+}
+# Arguments of PrinterManager.print_pdf which can be given for printing a job, besides "printer"
+PRINT_OPTIONS = ("copies", "orientation", "duplex", "flip_side", "sort_copies")
+
+
+def json_default(value):
+    if isinstance(value, PageSelection):
+        return value.expression
+    if isinstance(value, array):  # the angles of a job model, see job_model.ImageJobItems
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} values cannot be stored in a job journal.")
+
+
+def job_id(spec):
+    """Returns the id of a job: a hash of its spec, so running the same job again resumes it."""
+    canonical = json.dumps(spec, sort_keys=True, default=json_default)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def fsync_file(path):
+    with open(path, "rb+") as file:
+        os.fsync(file.fileno())
+
+
+class JobJournal:
+    """
+    An append-only log of one job in its own directory, next to the chunk files rendered so far.
+    Every record is one JSON line, flushed to disk before the work it confirms is considered done:
+    - "spec": the job spec, the chunk plan and the planned number of pages, written once when the job starts.
+    - "rendered": "chunk" (index) and "pages". The chunk file was fully written and synced.
+    - "submitted": "chunk". The chunk file reached the printer spooler.
+    - "done": the output was assembled and the job is finished.
+    A record cut short by a crash is dropped when the journal is opened again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL_FILE_NAME)
+        self.spec = None
+        self.chunks = []  # (start, stop) item ranges of every chunk
+        self.pages = None  # planned number of pages of the whole job
+        self.rendered = {}  # chunk index -> number of pages
+        self.submitted = set()
+        self.done = False
+
+        os.makedirs(directory, exist_ok=True)
+        valid_length = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn write of the last record
+                    self.apply(record)
+                    valid_length += len(line)
+        self.file = open(self.path, "ab")
+        self.file.truncate(valid_length)
+
+    def apply(self, record):
+        record_type = record["type"]
+        if record_type == "spec":
+            self.spec = record["spec"]
+            self.chunks = [tuple(chunk) for chunk in record["chunks"]]
+            self.pages = record.get("pages")
+        elif record_type == "rendered":
+            self.rendered[record["chunk"]] = record["pages"]
+        elif record_type == "submitted":
+            self.submitted.add(record["chunk"])
+        elif record_type == "done":
+            self.done = True
+
+    def record(self, record_type, **fields):
+        record = {"type": record_type, **fields}
+        self.file.write(json.dumps(record, default=json_default).encode() + b"\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.apply(record)
+
+    def chunk_path(self, index):
+        # The job id in the name keeps the document names in the printer queue unique
+        return os.path.join(self.directory, f"{os.path.basename(self.directory)}_{index:05d}.pdf")
+
+    def close(self):
+        self.file.close()
+
+
+def item_cells(engine, arguments):
+    """Returns the number of pages (merge) or grid cells (image engines) every item of the job takes."""
+    if engine == "merge":
+        selections = list(arguments.get("page_selections") or [])
+        selections = [PageSelection.coerce(selections[index] if index < len(selections) else None)
+                      for index in range(len(arguments["pdf_paths"]))]
+        # Indexes the sources of text selections, so the chunks find them in the index
+        text_matches = selection_matches(arguments["pdf_paths"], selections, arguments.get("page_index"))
+        counts = []
+        for index, source in enumerate(arguments["pdf_paths"]):
+            with open_pdf_source(source) as pdf_document:
+                counts.append(sum(1 for _ in selections[index].pages(pdf_document.page_count, text_matches[index])))
+        return counts
+    return [count_image_cells([image_path]) for image_path in arguments["image_paths"]]
+
+
+def plan_chunks(engine, arguments, pages_per_chunk=PAGES_PER_CHUNK):
+    """
+    Splits the items (images or source PDF files) of a job into chunks of about `pages_per_chunk` pages.
+    Chunks of image jobs end on page boundaries, so the chunks together lay out exactly like the whole job.
+
+    Returns:
+    - tuple: A list of (start, stop) ranges of item indexes, and the number of pages of the whole job.
+    """
+    if engine == "merge":
+        cells_per_page = 1
+    elif engine == "template":
+        cells_per_page = LayoutTemplate.coerce(arguments["template"]).cells_per_page
+    else:
+        cells_per_page = arguments.get("columns", 1) * arguments.get("rows", 1)
+    cells_per_chunk = pages_per_chunk * cells_per_page
+    chunks = []
+    start = cells = total_cells = 0
+    for index, item_cell_count in enumerate(item_cells(engine, arguments)):
+        cells += item_cell_count
+        total_cells += item_cell_count
+        # A multi-frame image which ends in the middle of a page extends the chunk up to a page boundary
+        if cells >= cells_per_chunk and cells % cells_per_page == 0:
+            chunks.append((start, index + 1))
+            start, cells = index + 1, 0
+    item_count = len(arguments[ENGINES[engine][2][0]])
+    if start < item_count:
+        chunks.append((start, item_count))
+    return chunks, -(-total_cells // cells_per_page)
+
+
+def chunk_arguments(engine, arguments, start, stop):
+    chunk = dict(arguments)
+    for name in ENGINES[engine][2]:
+        if chunk.get(name) is not None:
+            chunk[name] = list(chunk[name])[start:stop]
+    return chunk
+
+
+def print_chunk(journal, index, printer_manager, print_options):
+    chunk_path = journal.chunk_path(index)
+    printer_manager.get_or_open_printer_handler()
+    # After a crash right after the submission the chunk is still in the queue, it must not be printed twice
+    if printer_manager.is_file_in_printer_queue(os.path.basename(chunk_path)):
+        journal.record("submitted", chunk=index)
+        return
+    printer_manager.print_pdf(chunk_path, **print_options)
+    journal.record("submitted", chunk=index)
+
+
+def run_job(engine, arguments, output_path=None, printer=None, print_options=None, pages_per_chunk=PAGES_PER_CHUNK,
+            journal_root=DEFAULT_JOURNAL_ROOT, observer=None):
+    """
+    Runs a generate-and-print job in chunks, recording every finished chunk in a journal on disk. If the
+    process dies, calling `run_job` with the same job (or `resume_job`) continues after the last chunk that was
+    durably rendered or submitted to the printer, without redoing finished work.
+
+    Parameters:
+    - engine (str): "grid", "best_orientation", "template" or "merge".
+    - arguments (dict): Keyword arguments of the engine function, without its output argument and observer.
+      They must be JSON-serializable (page selections are stored as expressions).
+    - output_path (str or None): Where to write the whole document when all chunks are rendered.
+    - printer (str or None): Name of the printer. The default printer is used if `print_options` is given.
+    - print_options (dict or None): Keyword arguments of PrinterManager.print_pdf (see PRINT_OPTIONS). If None,
+      nothing is printed. Every chunk is printed as a separate print job, so copies are collated per chunk.
+    - pages_per_chunk (int): Size of the chunks, which is also the most work lost if the job dies.
+    - journal_root (str): Directory of the job journals.
+    - observer (callable or None): Passed to the engine for every chunk rendered in this run.
+
+    Returns:
+    - str or None: `output_path`, after the job is finished and its journal removed.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: '{engine}'. Use one of {', '.join(ENGINES)}.")
+    if output_path is None and print_options is None:
+        raise ValueError("A job needs an output_path, print_options or both.")
+    unknown = set(print_options or ()) - set(PRINT_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown print options: {', '.join(sorted(unknown))}.")
+    spec = {"engine": engine, "arguments": arguments, "output_path": output_path, "printer": printer,
+            "print_options": print_options}
+    journal = JobJournal(os.path.join(journal_root, job_id(spec)))
+    try:
+        if journal.spec is None:
+            chunks, page_count = plan_chunks(engine, arguments, pages_per_chunk)
+            journal.record("spec", spec=spec, chunks=chunks, pages=page_count)
+        else:
+            logger.info("Resuming job %s: %d of %d chunks rendered, %d printed", os.path.basename(journal.directory),
+                        len(journal.rendered), len(journal.chunks), len(journal.submitted))
+        return _run_journaled(journal, observer)
+    finally:
+        journal.close()
+
+
+def resume_job(job_directory, observer=None):
+    """Continues an unfinished job from its journal directory."""
+    journal = JobJournal(job_directory)
+    try:
+        if journal.spec is None:
+            raise ValueError(f"{job_directory} has no job spec, the job never started.")
+        return _run_journaled(journal, observer)
+    finally:
+        journal.close()
+
+
+def _run_journaled(journal, observer):
+    spec = journal.spec
+    function, output_argument, _ = ENGINES[spec["engine"]]
+    printer_manager = None
+    if spec["print_options"] is not None:
+        # Imported here, so jobs which only generate files also run without the Windows printing modules
+        from printer_utils import PrinterManager
+        printer_manager = PrinterManager(spec["printer"])
+
+    for index, (start, stop) in enumerate(journal.chunks):
+        chunk_path = journal.chunk_path(index)
+        if index not in journal.rendered or not os.path.exists(chunk_path):
+            temp_path = chunk_path + ".part"
+            arguments = chunk_arguments(spec["engine"], spec["arguments"], start, stop)
+            if arguments.get("overlay"):
+                # Page numbers continue from the previous chunks, which are all rendered by now
+                arguments["overlay"] = dict(arguments["overlay"], page_count=journal.pages,
+                                            first_page=1 + sum(journal.rendered[chunk] for chunk in range(index)))
+            function(**arguments, **{output_argument: temp_path}, observer=observer)
+            fsync_file(temp_path)
+            # Atomic, so a chunk file on disk is always complete
+            os.replace(temp_path, chunk_path)
+            with pymupdf.open(chunk_path) as chunk_document:
+                journal.record("rendered", chunk=index, pages=chunk_document.page_count)
+        if printer_manager is not None and index not in journal.submitted:
+            print_chunk(journal, index, printer_manager, spec["print_options"])
+
+    output_path = spec["output_path"]
+    if output_path and not journal.done:
+        with pymupdf.open() as output_pdf:
+            for index in range(len(journal.chunks)):
+                with pymupdf.open(journal.chunk_path(index)) as chunk_document:
+                    output_pdf.insert_pdf(chunk_document)
+            output_pdf.save(output_path)
+    journal.record("done")
+    shutil.rmtree(journal.directory, ignore_errors=True)
+    return output_path
+
+
+def unfinished_jobs(journal_root=DEFAULT_JOURNAL_ROOT):
+    """Returns a list of (job directory, summary dict) for the jobs which did not finish."""
+    jobs = []
+    if not os.path.isdir(journal_root):
+        return jobs
+    for name in sorted(os.listdir(journal_root)):
+        directory = os.path.join(journal_root, name)
+        if not os.path.exists(os.path.join(directory, JOURNAL_FILE_NAME)):
+            continue
+        journal = JobJournal(directory)
+        journal.close()
+        if journal.spec is None or journal.done:
+            continue
+        jobs.append((directory, {"engine": journal.spec["engine"], "chunks": len(journal.chunks),
+                                 "rendered": len(journal.rendered), "submitted": len(journal.submitted),
+                                 "output_path": journal.spec["output_path"], "printer": journal.spec["printer"]}))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List and resume generate-and-print jobs interrupted by a crash.")
+    parser.add_argument("--journals", default=DEFAULT_JOURNAL_ROOT, help="directory of the job journals")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list unfinished jobs")
+    resume_parser = subparsers.add_parser("resume", help="resume unfinished jobs")
+    resume_parser.add_argument("job_ids", nargs="*", help="jobs to resume (default: all)")
+    resume_parser.add_argument("--metrics-file", default=None,
+                               help="file the metrics of the resumed jobs are written to in the Prometheus text "
+                                    "format, e.g. for the textfile collector of the node exporter")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    jobs = unfinished_jobs(args.journals)
+    if args.command == "list":
+        for directory, summary in jobs:
+            print(f"{os.path.basename(directory)}  {summary['engine']:<17}rendered {summary['rendered']}/"
+                  f"{summary['chunks']}, printed {summary['submitted']}  -> {summary['output_path'] or '-'}")
+        return 0
+
+    failed = 0
+    for directory, summary in jobs:
+        if args.job_ids and os.path.basename(directory) not in args.job_ids:
+            continue
+        try:
+            resume_job(directory, observer=metrics_observer)
+            logger.info("Job %s finished", os.path.basename(directory))
+        except Exception:
+            logger.exception("Job %s failed", os.path.basename(directory))
+            JOB_FAILURES.inc(job=summary["engine"])
+            failed += 1
+    if args.metrics_file:
+        REGISTRY.write_textfile(args.metrics_file)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+from array import array
+
+from page_selection import PageSelection
+
+# Page count of a PDF source which was not counted yet
+UNCOUNTED = -1
+# Selection of the PDF sources added without one: all pages. PageSelection objects are never modified,
+# so all items share it
+ALL_PAGES = PageSelection()
+
+
+class JobItems:
+    """
+    The ordered files of a job and their settings, kept column-wise: every column is a list or an array with
+    one value per file, at the same index. The GUI edits the items through the methods, which keep the columns
+    aligned, and the engines take the columns as they are, e.g. `add_images_to_pdf_in_grid(image_paths=job.paths,
+    angles=job.angles)`, so generating a job copies nothing.
+
+    The same file can be added several times, every item keeps its own settings.
+    """
+    __slots__ = ("paths",)
+    columns = ("paths",)
+
+    def __init__(self):
+        self.paths = []  # file paths, or in-memory buffers of PDF sources
+
+    def __len__(self):
+        return len(self.paths)
+
+    def swap(self, index, other_index):
+        """Swaps two items, e.g. to move an item one row up or down."""
+        for name in self.columns:
+            column = getattr(self, name)
+            column[index], column[other_index] = column[other_index], column[index]
+
+    def delete(self, index):
+        for name in self.columns:
+            del getattr(self, name)[index]
+
+
+class ImageJobItems(JobItems):
+    """The images of a grid job, with the rotation angle of every image in degrees."""
+    __slots__ = ("angles",)
+    columns = ("paths", "angles")
+
+    def __init__(self):
+        super().__init__()
+        self.angles = array("h")  # in [0, 360)
+
+    def append(self, path, angle=0):
+        self.paths.append(path)
+        self.angles.append(angle % 360)
+
+    def set_angle(self, index, angle):
+        # Angles are stored in a full turn, so any entered number fits into the array
+        self.angles[index] = angle % 360
+
+
+class PDFJobItems(JobItems):
+    """
+    The PDF sources of a merge job, with the PageSelection of every source and its number of pages, which is
+    counted once, when it's first needed.
+    """
+    __slots__ = ("selections", "page_counts")
+    columns = ("paths", "selections", "page_counts")
+
+    def __init__(self):
+        super().__init__()
+        self.selections = []
+        self.page_counts = array("l")  # UNCOUNTED until counted
+
+    def append(self, path, selection=ALL_PAGES):
+        self.paths.append(path)
+        self.selections.append(selection)
+        self.page_counts.append(UNCOUNTED)
+
+    def select_all(self, selection):
+        """Gives every source the same selection."""
+        self.selections[:] = [selection] * len(self.paths)
+
+    def page_count(self, index, count_pages):
+        """
+        Returns the number of pages of a source, counting them with `count_pages(path)` the first time.
+        """
+        if self.page_counts[index] == UNCOUNTED:
+            self.page_counts[index] = count_pages(self.paths[index])
+        return self.page_counts[index]
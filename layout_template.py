@@ -0,0 +1,132 @@
+from reportlab.lib.pagesizes import A4, landscape, portrait
+from reportlab.pdfgen.pathobject import PDFPathObject
+
+# How an image fills its slot:
+# - "contain": the whole image is shown, centered, as big as fits but never enlarged, like in the grid engine.
+# - "cover": the image fills the whole slot, centered, and the parts outside the slot are clipped, e.g. for
+#   badge photos.
+FIT_MODES = ("contain", "cover")
+# Gray level and width in points of the cut guides drawn around the cells
+OUTLINE_GRAY = 0.7
+OUTLINE_WIDTH = 0.25
+
+# Templates registered by name, see `register_template`
+TEMPLATES = {}
+
+
+class LayoutTemplate:
+    """
+    A fixed page layout printed many times with different images, such as a sheet of labels or badges.
+    Everything which does not depend on the images is computed once, when the template is created:
+    - the rectangle of every slot (a grid cell without the image margins), row by row from the top left;
+    - the clipping path of every slot, for the "cover" fit;
+    - the static page content, a background image and cut guides around the cells, which every output file
+      draws once into a form shared by all its pages (see `draw_skeleton`).
+    A run of `create_file.add_images_to_template` then only binds the images to the slots.
+
+    - name: the name the template is registered under, see `register_template`.
+    - columns, rows, orientation ("portrait" or "landscape"), page_margin, image_margin: the grid, as in
+      `create_file.add_images_to_pdf_in_grid`.
+    - page_size: (width, height) of the page in points, in portrait orientation.
+    - fit: one of FIT_MODES.
+    - outline: draw cut guides around the cells.
+    - background: path of an image drawn over the whole page under the images, e.g. the printed design of
+      a badge.
+    """
+    __slots__ = ("name", "columns", "rows", "orientation", "page_margin", "image_margin", "fit", "outline",
+                 "background", "page_width", "page_height", "cell_width", "cell_height", "slots", "clip_paths",
+                 "outline_path")
+
+    def __init__(self, name, columns=1, rows=1, orientation="portrait", page_margin=0, image_margin=0,
+                 page_size=A4, fit="contain", outline=False, background=None):
+        if columns < 1 or rows < 1:
+            raise ValueError("A template needs at least one column and one row.")
+        if orientation not in ("portrait", "landscape"):
+            raise ValueError(f"Unknown orientation: '{orientation}'. Use portrait or landscape.")
+        if fit not in FIT_MODES:
+            raise ValueError(f"Unknown fit: '{fit}'. Use one of {', '.join(FIT_MODES)}.")
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+        self.orientation = orientation
+        self.page_margin = page_margin
+        self.image_margin = image_margin
+        self.fit = fit
+        self.outline = outline
+        self.background = background
+        self.page_width, self.page_height = (landscape if orientation == "landscape" else portrait)(page_size)
+
+        self.cell_width = (self.page_width - 2 * page_margin) / columns
+        self.cell_height = (self.page_height - 2 * page_margin) / rows
+        slot_width = self.cell_width - 2 * image_margin
+        slot_height = self.cell_height - 2 * image_margin
+        if slot_width <= 0 or slot_height <= 0:
+            raise ValueError("The margins leave no room for the images.")
+
+        slots = []
+        clip_paths = []
+        outline_path = PDFPathObject()
+        for slot in range(columns * rows):
+            column, row = slot % columns, slot // columns
+            cell_x = page_margin + column * self.cell_width
+            cell_y = self.page_height - page_margin - (row + 1) * self.cell_height
+            slots.append((cell_x + image_margin, cell_y + image_margin, slot_width, slot_height))
+            clip_path = PDFPathObject()
+            clip_path.rect(*slots[-1])
+            clip_paths.append(clip_path)
+            outline_path.rect(cell_x, cell_y, self.cell_width, self.cell_height)
+        self.slots = tuple(slots)  # (x, y, width, height) in points, y from the bottom of the page
+        self.clip_paths = tuple(clip_paths)
+        self.outline_path = outline_path
+
+    def __repr__(self):
+        return (f"LayoutTemplate({self.name!r}, columns={self.columns!r}, rows={self.rows!r}, "
+                f"orientation={self.orientation!r}, fit={self.fit!r})")
+
+    @property
+    def cells_per_page(self):
+        return len(self.slots)
+
+    @property
+    def has_skeleton(self):
+        """True if the template has static page content, see `draw_skeleton`."""
+        return bool(self.outline or self.background)
+
+    def draw_skeleton(self, c):
+        """Draws the static page content on a reportlab canvas, usually into a form."""
+        if self.background:
+            c.drawImage(self.background, 0, 0, self.page_width, self.page_height)
+        if self.outline:
+            c.saveState()
+            c.setStrokeGray(OUTLINE_GRAY)
+            c.setLineWidth(OUTLINE_WIDTH)
+            c.drawPath(self.outline_path, stroke=1, fill=0)
+            c.restoreState()
+
+    @classmethod
+    def coerce(cls, template):
+        """
+        Returns `template` as a LayoutTemplate. Accepts the name of a registered template and dicts of the
+        constructor arguments (with "name" optional).
+        """
+        if isinstance(template, cls):
+            return template
+        if isinstance(template, str):
+            if template not in TEMPLATES:
+                raise ValueError(f"Unknown layout template: '{template}'.")
+            return TEMPLATES[template]
+        if isinstance(template, dict):
+            return cls(**{"name": None, **template})
+        raise TypeError(f"A layout template must be a LayoutTemplate, a name or a dict, not {type(template).__name__}.")
+
+
+def register_template(template):
+    """
+    Registers a template under its name, replacing a template of the same name, and returns it. Services look
+    templates up in the process which accepts the job, so register them when the application starts.
+    """
+    template = LayoutTemplate.coerce(template)
+    if not template.name:
+        raise ValueError("A registered template needs a name.")
+    TEMPLATES[template.name] = template
+    return template
@@ -0,0 +1,117 @@
+import ctypes
+import os
+import sys
+import tempfile
+
+if sys.platform == "win32":
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    def _memory_counters():
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters
+else:
+    import resource
+
+
+def peak_rss_bytes():
+    """Returns the peak resident set size of the current process in bytes, or None if it's unknown."""
+    if sys.platform == "win32":
+        counters = _memory_counters()
+        return counters.PeakWorkingSetSize if counters else None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes():
+    """Returns the current resident set size of the current process in bytes, or None if it's unknown."""
+    if sys.platform == "win32":
+        counters = _memory_counters()
+        return counters.WorkingSetSize if counters else None
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (e.g. macOS), fall back to the peak value
+        return peak_rss_bytes()
+
+
+class MemoryBudget:
+    """
+    The memory a generation job may use on top of the resident memory of the process when the job started.
+
+    The engines call `check` at every page or source file. Once the job is over budget it stays so: the engines
+    then keep their intermediate pages and converted images in files in a temporary directory of the job
+    (see `spill_path`) rather than in memory. Without a limit, `check` only records the peak memory of the job.
+
+    Usage:
+        budget = MemoryBudget(512 * 1024 * 1024)
+        ...
+        if budget.check():
+            ...  # write what the job holds in memory to budget.spill_path("pages.pdf")
+        ...
+        budget.close()
+        budget.peak_rss  # bytes
+    """
+    __slots__ = ("limit", "over", "baseline", "sampled_peak", "process_peak", "spill_dir")
+
+    def __init__(self, limit=None):
+        if limit is not None and limit <= 0:
+            raise ValueError("The memory budget must be a positive number of bytes.")
+        self.limit = limit
+        self.over = False
+        self.baseline = current_rss_bytes() or 0
+        self.sampled_peak = self.baseline
+        # The peak of the process so far, so a new peak reached during the job is recognized exactly
+        self.process_peak = peak_rss_bytes()
+        self.spill_dir = None
+
+    def check(self):
+        """Samples the resident memory. Returns True if the job is over budget, now or earlier."""
+        rss = current_rss_bytes()
+        if rss is None:
+            return self.over
+        self.sampled_peak = max(self.sampled_peak, rss)
+        if self.limit is not None and rss - self.baseline > self.limit:
+            self.over = True
+        return self.over
+
+    @property
+    def peak_rss(self):
+        """The peak resident memory of the process during the job in bytes, sampled at the checks."""
+        process_peak = peak_rss_bytes()
+        if process_peak is not None and self.process_peak is not None and process_peak > self.process_peak:
+            # The job raised the peak of the process, which is measured rather than sampled
+            return max(process_peak, self.sampled_peak)
+        return self.sampled_peak
+
+    def spill_path(self, name):
+        """Returns the path of a file named `name` in the temporary directory of the job."""
+        if self.spill_dir is None:
+            # Also deleted when the budget is garbage-collected, e.g. after the job failed
+            self.spill_dir = tempfile.TemporaryDirectory(prefix="mingling_spill_", ignore_cleanup_errors=True)
+        return os.path.join(self.spill_dir.name, name)
+
+    def close(self):
+        """Deletes the files the job spilled to disk."""
+        if self.spill_dir is not None:
+            self.spill_dir.cleanup()
+            self.spill_dir = None
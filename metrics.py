@@ -0,0 +1,249 @@
+import math
+import os
+import tempfile
+import threading
+
+from instrumentation import DURATION_BUCKETS, Histogram
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metric:
+    """
+    A named metric with a value per combination of label values, e.g. `mingling_pages_total{job="grid"}`.
+    All metrics of a registry share its lock, so they can be updated from any thread.
+    """
+    kind = None
+    __slots__ = ("name", "help_text", "labels", "lock", "values")
+
+    def __init__(self, name, help_text, labels, lock):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = lock
+        self.values = {}  # tuple of label values -> value
+
+    def key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labels) or 'none'}.")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        """Returns the lines of the metric in the text exposition format, without its HELP and TYPE lines."""
+        # A metric without labels has one value, zero until it's first updated
+        values = self.values or ({} if self.labels else {(): 0})
+        return [f"{self.name}{self.label_text(key)} {format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Counter(Metric):
+    """A total which only goes up, e.g. the number of finished jobs."""
+    kind = "counter"
+    __slots__ = ()
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value which goes up and down, e.g. the number of jobs in the queue."""
+    kind = "gauge"
+    __slots__ = ()
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class HistogramMetric(Metric):
+    """Counts observed values, e.g. durations, in buckets with fixed upper bounds (see instrumentation.Histogram)."""
+    kind = "histogram"
+    __slots__ = ("bounds",)
+
+    def __init__(self, name, help_text, labels, lock, bounds=DURATION_BUCKETS):
+        super().__init__(name, help_text, labels, lock)
+        self.bounds = bounds
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram(self.bounds)
+            histogram.add(value)
+
+    def samples(self):
+        lines = []
+        for key, histogram in sorted(self.values.items()):
+            # Prometheus buckets are cumulative
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), histogram.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self.label_text(key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(key)} {format_value(histogram.total)}")
+            lines.append(f"{self.name}_count{self.label_text(key)} {histogram.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process, exported in the Prometheus text exposition format: served by the HTTP service
+    at GET /metrics, or written to a file for the textfile collector of the node exporter.
+
+    Worker processes have a registry of their own. A worker returns `drain()` with the result of its job and
+    the parent process adds it to its registry with `merge`, so the counts of all processes end up in one place.
+
+    Usage:
+        jobs = registry.counter("mingling_jobs_total", "Finished jobs.", ("job",))
+        jobs.inc(job="grid")
+        registry.write_textfile("/var/lib/node_exporter/mingling.prom")
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> Metric, in registration order
+
+    def register(self, metric_class, name, help_text, labels=(), **options):
+        """Returns the metric of that name, which is created if it does not exist yet."""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, help_text, labels, self.lock, **options)
+            elif type(metric) is not metric_class:
+                raise ValueError(f"{name} is already registered as a {metric.kind}.")
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), bounds=DURATION_BUCKETS):
+        return self.register(HistogramMetric, name, help_text, labels, bounds=bounds)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Writes the metrics to a file atomically, so the collector never reads a truncated file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as metrics_file:
+                metrics_file.write(self.render())
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def drain(self):
+        """
+        Returns the values of the counters and histograms and resets them, e.g. in a worker process after a job.
+        Gauges are left alone, they belong to the process which sets them.
+
+        Returns:
+        - dict: Metric name -> {label values: value}, a picklable snapshot to pass to `merge`.
+        """
+        samples = {}
+        with self.lock:
+            for name, metric in self.metrics.items():
+                if metric.values and not isinstance(metric, Gauge):
+                    samples[name] = metric.values
+                    metric.values = {}
+        return samples
+
+    def merge(self, samples):
+        """Adds the values returned by `drain` of another registry with the same metrics."""
+        with self.lock:
+            for name, values in samples.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in values.items():
+                    if isinstance(metric, HistogramMetric):
+                        histogram = metric.values.get(key)
+                        if histogram is None:
+                            histogram = metric.values[key] = Histogram(metric.bounds)
+                        histogram.merge(value)
+                    else:
+                        metric.values[key] = metric.values.get(key, 0) + value
+
+
+# The registry of the process, with the metrics of the engines, the printers and the caches
+REGISTRY = MetricsRegistry()
+
+JOBS = REGISTRY.counter("mingling_jobs_total", "Generation jobs finished by the engines.", ("job",))
+JOB_FAILURES = REGISTRY.counter("mingling_job_failures_total", "Generation and print jobs which failed.", ("job",))
+PAGES = REGISTRY.counter("mingling_pages_total", "Pages emitted by the engines.", ("job",))
+OUTPUT_BYTES = REGISTRY.counter("mingling_output_bytes_total", "Size of the output files written by the engines.",
+                                ("job",))
+JOB_DURATION = REGISTRY.histogram("mingling_job_duration_seconds", "Time the engines took to generate a job.",
+                                  ("job",))
+REQUEST_DURATION = REGISTRY.histogram("mingling_request_duration_seconds",
+                                      "Time from accepting a service job until its output is ready or printed, "
+                                      "including the wait for a worker.", ("job",))
+JOBS_REJECTED = REGISTRY.counter("mingling_jobs_rejected_total", "Service jobs rejected because the queue was full.")
+JOBS_IN_FLIGHT = REGISTRY.gauge("mingling_jobs_in_flight", "Service jobs accepted and not finished yet.")
+SPOOL_DURATION = REGISTRY.histogram("mingling_spool_duration_seconds",
+                                    "Time from handing a file to the printer until it appears in the printer queue.",
+                                    ("printer",))
+PRINTER_QUEUE_DURATION = REGISTRY.histogram("mingling_printer_queue_seconds",
+                                            "Time a file spent in the printer queue.", ("printer",))
+PRINT_FAILURES = REGISTRY.counter("mingling_print_failures_total", "Files which failed to print.", ("printer",))
+CACHE_LOOKUPS = REGISTRY.counter("mingling_cache_lookups_total",
+                                 "Lookups in the caches: the page index, the converted images of a job and the "
+                                 "printer list; the result is hit or miss.", ("cache", "result"))
+
+
+def reset_worker_metrics():
+    """
+    Initializer of worker processes which return `REGISTRY.drain()` with their jobs. Forked workers inherit the
+    values the parent counted so far, which the parent would add to its registry a second time.
+    """
+    REGISTRY.drain()
+
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def metrics_observer(event):
+    """
+    An engine observer (see instrumentation.EVENTS) counting the finished jobs, their pages and output bytes and
+    their duration in REGISTRY. It only acts on the "job_end" event, so the metrics are not updated per page.
+    """
+    if event["event"] == "job_end":
+        job = event["job"]
+        JOBS.inc(job=job)
+        PAGES.inc(event["pages"], job=job)
+        OUTPUT_BYTES.inc(event["bytes"], job=job)
+        JOB_DURATION.observe(event["duration"], job=job)
@@ -0,0 +1,210 @@
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import cache_lookup
+from page_selection import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Where the extracted page texts are kept. Entries are named after the hash of the PDF content, so a renamed
+# or copied file is found again and a modified file is indexed anew
+DEFAULT_INDEX_ROOT = os.path.join(os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/.cache"),
+                                  "mingling", "page_index")
+# Size of the blocks PDF files are hashed in
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def source_digest(source):
+    """Returns the SHA-256 hex digest of the content of a PDF source: a file path or an in-memory buffer."""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as pdf_file:
+            while block := pdf_file.read(HASH_BLOCK_SIZE):
+                digest.update(block)
+    elif isinstance(source, io.BytesIO):
+        digest.update(source.getbuffer())
+    else:
+        digest.update(source)
+    return digest.hexdigest()
+
+
+def extract_page_texts(source):
+    """Returns the normalized text of every page of a PDF source."""
+    # Imported here, since create_file imports this module
+    from create_file import open_pdf_source
+
+    with open_pdf_source(source) as pdf_document:
+        return [normalize_text(page.get_text()) for page in pdf_document]
+
+
+def write_entry(entry_path, page_texts):
+    """Writes an index entry atomically, so a crash never leaves a truncated entry behind."""
+    directory = os.path.dirname(entry_path)
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(file_descriptor, "wb") as entry_file:
+            with gzip.GzipFile(fileobj=entry_file, mode="wb", compresslevel=6) as gzip_file:
+                gzip_file.write(json.dumps(page_texts).encode())
+        os.replace(temporary_path, entry_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def _index_file(pdf_path, entry_path):
+    """Extracts the page texts of a PDF file into an index entry in a worker process."""
+    page_texts = extract_page_texts(pdf_path)
+    write_entry(entry_path, page_texts)
+    return len(page_texts)
+
+
+class PageIndex:
+    """
+    A full-text index of PDF pages, stored on disk with one gzipped JSON entry per document, keyed by the
+    hash of the document content. Documents missing from the index are extracted in parallel worker
+    processes; repeated searches over the same files only hash them and read their entries.
+
+    Usage:
+        index = PageIndex()
+        matches = index.search(pdf_paths, "Summary")  # the 0-indexed matching pages of every file
+    """
+
+    def __init__(self, root=DEFAULT_INDEX_ROOT, workers=None):
+        self.root = root
+        self.workers = workers or os.cpu_count() or 1
+        # (path, size, modification time) -> digest, so unchanged files are hashed once per index object
+        self.digests = {}
+
+    def digest(self, source):
+        if not isinstance(source, (str, os.PathLike)):
+            return source_digest(source)
+        stat = os.stat(source)
+        key = (os.fspath(source), stat.st_size, stat.st_mtime_ns)
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = source_digest(source)
+        return digest
+
+    def entry_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + ".json.gz")
+
+    def build(self, sources):
+        """
+        Indexes the sources which are not in the index yet. Files are extracted in worker processes,
+        in-memory buffers in this process.
+
+        Returns:
+        - list of str: The digest of every source, in the same order.
+        """
+        digests = [self.digest(source) for source in sources]
+        missing = {}
+        for source, digest in zip(sources, digests):
+            if digest not in missing:
+                indexed = os.path.exists(self.entry_path(digest))
+                cache_lookup("page_index", indexed)
+                if not indexed:
+                    missing[digest] = source
+        files = [(source, digest) for digest, source in missing.items() if isinstance(source, (str, os.PathLike))]
+        for digest, source in missing.items():
+            if not isinstance(source, (str, os.PathLike)):
+                write_entry(self.entry_path(digest), extract_page_texts(source))
+
+        if len(files) > 1 and self.workers > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(files))) as executor:
+                for (source, _), page_count in zip(files, executor.map(
+                        _index_file, [source for source, _ in files],
+                        [self.entry_path(digest) for _, digest in files])):
+                    logger.debug("Indexed %d pages of %s", page_count, source)
+        else:
+            for source, digest in files:
+                _index_file(source, self.entry_path(digest))
+        return digests
+
+    def page_texts(self, digest):
+        """Returns the normalized page texts of an indexed document."""
+        with gzip.open(self.entry_path(digest), "rb") as entry_file:
+            return json.loads(entry_file.read())
+
+    def search(self, sources, query):
+        """
+        Searches the pages of every source for a text, ignoring case and line breaks.
+
+        Returns:
+        - list of list: The sorted 0-indexed numbers of the matching pages of every source, in the same order.
+        """
+        return [matches[normalize_text(query)] for matches in self.search_all(sources, [[query]] * len(sources))]
+
+    def search_all(self, sources, queries):
+        """
+        Searches the pages of every source for its own queries. Every entry is read once for all its queries.
+
+        Parameters:
+        - sources (list): PDF sources, paths or in-memory buffers.
+        - queries (list): A list of query strings for every source.
+
+        Returns:
+        - list of dict: Normalized query -> sorted 0-indexed numbers of the matching pages, for every source.
+        """
+        digests = self.build(sources)
+        results = []
+        for digest, source_queries in zip(digests, queries):
+            source_queries = {normalize_text(query) for query in source_queries}
+            if not source_queries:
+                results.append({})
+                continue
+            page_texts = self.page_texts(digest)
+            results.append({query: [page for page, text in enumerate(page_texts) if query in text]
+                            for query in source_queries})
+        return results
+
+
+def selection_matches(sources, selections, page_index=None):
+    """
+    Resolves the text queries of page selections (see PageSelection) with a page index.
+
+    Parameters:
+    - sources (list): PDF sources. Paths of missing files are skipped.
+    - selections (list): A PageSelection for every source.
+    - page_index (PageIndex or None): The index to search, a PageIndex at the default location if None.
+
+    Returns:
+    - list: For every source, a dict of query -> matching 0-indexed pages, or None if its selection has no
+      queries. Pass it to the `runs`, `pages` or `page_set` method of the selection.
+    """
+    queried = [index for index, (source, selection) in enumerate(zip(sources, selections))
+               if selection.queries and not (isinstance(source, (str, os.PathLike)) and not os.path.exists(source))]
+    matches = [None] * len(sources)
+    if queried:
+        page_index = page_index or PageIndex()
+        results = page_index.search_all([sources[index] for index in queried],
+                                        [selections[index].queries for index in queried])
+        for index, result in zip(queried, results):
+            matches[index] = result
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches the pages of PDF files for a text, using the page index.")
+    parser.add_argument("query", help="text to search for, case-insensitive")
+    parser.add_argument("pdf_paths", nargs="+", metavar="pdf")
+    parser.add_argument("--root", default=DEFAULT_INDEX_ROOT, help="directory of the index")
+    parser.add_argument("--workers", type=int, default=None, help="number of extraction processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    page_index = PageIndex(args.root, args.workers)
+    for pdf_path, pages in zip(args.pdf_paths, page_index.search(args.pdf_paths, args.query)):
+        if pages:
+            print(f"{pdf_path}: {','.join(str(page + 1) for page in pages)}")
+
+
+if __name__ == "__main__":
+    main()
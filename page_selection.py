@@ -0,0 +1,244 @@
+from functools import lru_cache
+
+
+class PageSelection:
+    """
+    A compact selection of pages of one PDF file, shared by the GUI and the merge engine.
+
+    The selection is parsed from an expression of comma-separated parts:
+    - "7": a single page.
+    - "1-3": a range of pages. "10-" means from page 10 to the last page, "5-1" is a reversed range.
+    - "last-3": the last 3 pages of the file.
+    - "even", "odd": every even or odd page of the file.
+    - "reverse": reverses the order of the whole selection. On its own it selects all pages in reverse order.
+    - "text:Summary": every page containing the text, ignoring case and line breaks. The query cannot
+      contain commas. Text parts are resolved with a page index, see `page_index.selection_matches`.
+
+    An empty expression selects all pages. Pages are numbered from 1 in expressions.
+    Internally the selection is kept as a short list of parsed parts and is resolved against the
+    page count of a document into runs of consecutive pages, so the merge engine can copy every run
+    with a single insert operation.
+    """
+    __slots__ = ("expression", "parts", "reverse")
+
+    def __init__(self, expression="", parts=(), reverse=False):
+        self.expression = expression
+        self.parts = tuple(parts)
+        self.reverse = reverse
+
+    def __repr__(self):
+        return f"PageSelection({self.expression!r})"
+
+    def __bool__(self):
+        # An empty selection means "all pages", just like an empty list of tuples did before
+        return bool(self.parts) or self.reverse
+
+    def __eq__(self, other):
+        if not isinstance(other, PageSelection):
+            return NotImplemented
+        return self.parts == other.parts and self.reverse == other.reverse
+
+    def __hash__(self):
+        return hash((self.parts, self.reverse))
+
+    @classmethod
+    def parse(cls, expression, page_count=None):
+        """
+        Parses a page selection expression.
+
+        Parameters:
+        - expression (str): The expression, e.g. "1-3,7,10-" or "last-2,reverse".
+        - page_count (int or None): The number of pages in the file. If given, pages beyond it are rejected.
+
+        Returns:
+        - PageSelection: The parsed selection.
+
+        Raises:
+        - ValueError: If the expression is malformed or refers to pages beyond `page_count`.
+        """
+        expression = expression.strip()
+        if expression == "":
+            return cls()
+        if expression.startswith("-") or "--" in expression or "-," in expression or ",-" in expression:
+            raise ValueError("Invalid format: Cannot start with '-', and '-' or ',' cannot be adjacent.")
+
+        parts = []
+        reverse = False
+        for token in expression.split(","):
+            # Every part is parsed once and cached, so re-parsing the expression on each key press
+            # only does real work for the part being typed
+            part = _parse_part(token.strip())
+            if part[0] == "reverse":
+                reverse = not reverse
+                continue
+            if page_count is not None:
+                _validate_part(part, page_count)
+            parts.append(part)
+        return cls(expression, parts, reverse)
+
+    @classmethod
+    def from_tuples(cls, page_ranges):
+        """
+        Builds a selection from the legacy format: a list of 1-tuples (single pages) and 2-tuples (page ranges).
+        """
+        parts = []
+        for page_range in page_ranges or ():
+            if len(page_range) == 1:
+                parts.append(("page", page_range[0]))
+            elif len(page_range) == 2:
+                parts.append(("range", page_range[0], page_range[1]))
+        expression = ",".join("-".join(str(page) for page in page_range) for page_range in page_ranges or ())
+        return cls(expression, parts)
+
+    @classmethod
+    def coerce(cls, selection):
+        """Returns `selection` as a PageSelection. Accepts None, expressions and legacy lists of tuples."""
+        if isinstance(selection, cls):
+            return selection
+        if not selection:
+            return cls()
+        if isinstance(selection, str):
+            return cls.parse(selection)
+        return cls.from_tuples(selection)
+
+    @property
+    def queries(self):
+        """The normalized text queries of the selection, in the order of the expression."""
+        return tuple(part[1] for part in self.parts if part[0] == "text")
+
+    def pages(self, page_count, matches=None):
+        """
+        Yields the selected 0-indexed page numbers of a document with `page_count` pages in output order.
+        Pages beyond the end of the document are skipped.
+        """
+        for start, stop in self.runs(page_count, matches):
+            step = 1 if stop >= start else -1
+            yield from range(start, stop + step, step)
+
+    def page_set(self, page_count, matches=None):
+        """Returns the set of selected 0-indexed page numbers, e.g. for highlighting previews."""
+        return set(self.pages(page_count, matches))
+
+    def runs(self, page_count, matches=None):
+        """
+        Resolves the selection against a document with `page_count` pages.
+
+        Parameters:
+        - page_count (int): The number of pages of the document.
+        - matches (dict or None): Query -> matching 0-indexed pages of the document, for the text parts of the
+          selection. Text parts without matches select no pages.
+
+        Returns:
+        - list of tuple: (from_page, to_page) pairs of 0-indexed, inclusive page numbers. `from_page` is
+          greater than `to_page` for reversed runs. Neighbouring runs that continue each other are merged,
+          so every run maps to exactly one `insert_pdf` call.
+        """
+        if not self.parts:
+            runs = [(0, page_count - 1)] if page_count > 0 else []
+        else:
+            runs = []
+            for part in self.parts:
+                for run in _part_runs(part, page_count, matches):
+                    _append_run(runs, run)
+        if self.reverse:
+            reversed_runs = []
+            for start, stop in reversed(runs):
+                _append_run(reversed_runs, (stop, start))
+            runs = reversed_runs
+        return runs
+
+
+def normalize_text(text):
+    """Folds case and collapses whitespace, so a query matches however the text is broken into lines."""
+    return " ".join(text.split()).casefold()
+
+
+@lru_cache(maxsize=1024)
+def _parse_part(token):
+    if token.startswith("text:"):
+        query = normalize_text(token[len("text:"):])
+        if not query:
+            raise ValueError(f"Invalid selector: '{token}' must be 'text:' followed by the text to search for.")
+        return ("text", query)
+    if token in ("even", "odd", "reverse"):
+        return (token,)
+    if token.startswith("last-"):
+        count = token[len("last-"):]
+        if not count.isdigit() or int(count) == 0:
+            raise ValueError(f"Invalid selector: '{token}' must be 'last-N' with N > 0.")
+        return ("last", int(count))
+    if "-" in token:
+        start, end = token.split("-", 1)
+        if not start.isdigit():
+            raise ValueError(f"Invalid range start: '{start}' is not a number.")
+        # Handle open-ended range like "10-" as the range up to the last page
+        if end == "":
+            return ("range", int(start), None)
+        if not end.isdigit():
+            raise ValueError(f"Invalid range end: '{end}' is not a number.")
+        return ("range", int(start), int(end))
+    if not token.isdigit():
+        raise ValueError(f"Invalid page: '{token}' is not a number.")
+    return ("page", int(token))
+
+
+def _validate_part(part, page_count):
+    kind = part[0]
+    if kind == "page":
+        if part[1] == 0:
+            raise ValueError("Invalid page: Pages are numbered from 1.")
+        if part[1] > page_count:
+            raise ValueError(f"Invalid page: Page {part[1]} exceeds the last page ({page_count}).")
+    elif kind == "range":
+        start, end = part[1], part[2]
+        if start == 0 or end == 0:
+            raise ValueError("Invalid range: Pages are numbered from 1.")
+        if start > page_count or (end is not None and end > page_count):
+            raise ValueError(f"Invalid range: Pages cannot exceed the last page ({page_count}).")
+    elif kind == "last":
+        if part[1] > page_count:
+            raise ValueError(f"Invalid selector: The file has only {page_count} pages.")
+
+
+def _part_runs(part, page_count, matches=None):
+    """Yields the 0-indexed (from_page, to_page) runs of a parsed part, clamped to the document."""
+    last = page_count - 1
+    kind = part[0]
+    if kind == "page":
+        page = part[1] - 1
+        if 0 <= page <= last:
+            yield page, page
+    elif kind == "range":
+        start = part[1] - 1
+        end = last if part[2] is None else part[2] - 1
+        if start <= end:
+            start, end = max(start, 0), min(end, last)
+        else:
+            start, end = min(start, last), max(end, 0)
+        if 0 <= start <= last and 0 <= end <= last:
+            yield start, end
+    elif kind == "last":
+        if page_count > 0:
+            yield max(page_count - part[1], 0), last
+    elif kind in ("even", "odd"):
+        first = 1 if kind == "even" else 0
+        for page in range(first, page_count, 2):
+            yield page, page
+    elif kind == "text":
+        for page in (matches or {}).get(part[1], ()):
+            if page < page_count:
+                yield page, page
+
+
+def _append_run(runs, run):
+    """Appends a run, merging it into the previous one if it continues it in the same direction."""
+    if runs:
+        start, stop = runs[-1]
+        new_start, new_stop = run
+        if stop >= start and new_stop >= new_start and new_start == stop + 1:
+            runs[-1] = (start, new_stop)
+            return
+        if stop <= start and new_stop <= new_start and new_start == stop - 1:
+            runs[-1] = (start, new_stop)
+            return
+    runs.append(run)
@@ -0,0 +1,131 @@
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from create_file import open_pdf_source
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailRenderer:
+    """
+    Renders low-resolution page thumbnails of a PDF source on a background thread.
+
+    The GUI asks only for the pages it can show at the moment with `request()`; every new request replaces
+    the pending one, so scrolling quickly through a long document never queues up work for pages which are
+    not visible anymore. Rendered thumbnails are kept as PPM bytes (which Tk's PhotoImage reads directly)
+    in an LRU cache of `cache_size` pages.
+
+    Slow work the GUI needs for the current source, like resolving the text queries of a page selection,
+    is handed to the same thread with `resolve()`, ahead of the pending thumbnails.
+    """
+
+    def __init__(self, dpi=16, cache_size=256):
+        self.dpi = dpi
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (source_key, page_index) -> PPM bytes
+        self._condition = threading.Condition()
+        self._source_key = None
+        self._source = None
+        self._pending = []
+        self._task = None  # (key, function) waiting to run
+        self._resolved = None  # (key, result) of the last task which ran
+        self._rendered = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="ThumbnailRenderer", daemon=True)
+        self._thread.start()
+
+    def show(self, source_key, source):
+        """Switches to another PDF source. `source_key` identifies it in the cache."""
+        with self._condition:
+            self._source_key = source_key
+            self._source = source
+            self._pending = []
+
+    def request(self, page_indexes):
+        """Asks to render the given 0-indexed pages of the current source, dropping any older request."""
+        with self._condition:
+            self._pending = [page for page in page_indexes if (self._source_key, page) not in self._cache]
+            self._condition.notify()
+
+    def get(self, page_index):
+        """Returns the cached thumbnail of a page of the current source as PPM bytes, or None."""
+        with self._condition:
+            key = (self._source_key, page_index)
+            thumbnail = self._cache.get(key)
+            if thumbnail is not None:
+                self._cache.move_to_end(key)
+            return thumbnail
+
+    def take_rendered(self):
+        """Returns True once after new thumbnails have been rendered since the previous call."""
+        with self._condition:
+            rendered, self._rendered = self._rendered, False
+            return rendered
+
+    def resolve(self, key, function):
+        """
+        Runs `function` on the rendering thread, replacing a task which has not started yet. Its result is
+        returned with `key` by `take_resolved()`, or None as result if it failed.
+        """
+        with self._condition:
+            self._task = (key, function)
+            self._condition.notify()
+
+    def take_resolved(self):
+        """Returns the (key, result) pair of a task which ran since the previous call once, or None."""
+        with self._condition:
+            resolved, self._resolved = self._resolved, None
+            return resolved
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _run(self):
+        with ExitStack() as stack:
+            opened_key = None
+            pdf_document = None
+            while True:
+                with self._condition:
+                    while not self._pending and not self._task and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    task, self._task = self._task, None
+                    if not task:
+                        source_key, source = self._source_key, self._source
+                        page_index = self._pending.pop(0)
+                if task:
+                    self._run_task(*task)
+                    continue
+
+                try:
+                    # Keep the current document open between requests and reopen it only when the source changes
+                    if source_key != opened_key:
+                        stack.close()
+                        opened_key, pdf_document = source_key, None
+                        pdf_document = stack.enter_context(open_pdf_source(source, use_mmap="auto"))
+                    if pdf_document is None or not 0 <= page_index < pdf_document.page_count:
+                        continue
+                    thumbnail = pdf_document[page_index].get_pixmap(dpi=self.dpi).tobytes("ppm")
+                except Exception:
+                    continue  # A broken file or page just stays without a thumbnail
+
+                with self._condition:
+                    self._cache[(source_key, page_index)] = thumbnail
+                    self._cache.move_to_end((source_key, page_index))
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+                    self._rendered = True
+
+    def _run_task(self, key, function):
+        try:
+            result = function()
+        except Exception:
+            logger.exception("Background task of the preview failed")
+            result = None
+        with self._condition:
+            self._resolved = (key, result)
@@ -1,9 +1,21 @@
+import logging
+import threading
 import time
 import os
 
+import pywintypes
 import win32api
+import win32con
 import win32print
 
+from instrumentation import LogSampler
+from metrics import PRINT_FAILURES, PRINTER_QUEUE_DURATION, SPOOL_DURATION, cache_lookup
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the log messages of a print job waiting for the printer queue
+WAIT_LOG_INTERVAL = 10
+
 
 class PrinterManager:
     def __init__(self, printer_name=None):
@@ -29,6 +41,38 @@ class PrinterManager:
             printers.append(printer[2])  # 2 is index of printer name in the tuple
         return printers
 
+    @staticmethod
+    def list_printer_ports():
+        """
+        Retrieves the local printers and the network printer connections of the current user.
+
+        Returns:
+        - list of tuple: (printer name, port name) pairs.
+        """
+        flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
+        return [(printer["pPrinterName"], printer["pPortName"]) for printer in win32print.EnumPrinters(flags, None, 2)]
+
+    @staticmethod
+    def get_printer_capabilities(printer_name, port_name):
+        """
+        Asks the printer driver what the printer can do. Drivers of network printers may have to contact
+        the print server, which takes a while.
+
+        Returns:
+        - dict: "duplex" and "color" (bool) and "max_copies" (int), None for capabilities the driver does not report.
+        """
+        def capability(index):
+            try:
+                return win32print.DeviceCapabilities(printer_name, port_name, index)
+            except pywintypes.error:
+                return None
+
+        duplex, color, max_copies = (capability(win32con.DC_DUPLEX), capability(win32con.DC_COLORDEVICE),
+                                     capability(win32con.DC_COPIES))
+        return {"duplex": None if duplex is None else duplex == 1,
+                "color": None if color is None else color == 1,
+                "max_copies": max_copies if max_copies and max_copies > 0 else None}
+
     @staticmethod
     def get_default_printer_name():
         default_printer = win32print.GetDefaultPrinter()
@@ -39,34 +83,56 @@ class PrinterManager:
         if not self.printer_handler:
             if not self.printer_name:
                 self.printer_name = PrinterManager.get_default_printer_name()
-                print(self.printer_name)
+                logger.info("Using the default printer %s", self.printer_name)
             print_defaults = {"DesiredAccess": win32print.PRINTER_ALL_ACCESS}
             self.printer_handler = win32print.OpenPrinter(self.printer_name, print_defaults)
         return self.printer_handler
 
+    def get_printer_resolution(self):
+        """
+        Returns the print resolution of the printer in dots per inch, or None if the driver does not tell it.
+        """
+        self.get_or_open_printer_handler()
+        devmode = win32print.GetPrinter(self.printer_handler, 2)["pDevMode"]
+        # PrintQuality holds either the resolution in dpi or a negative DMRES_* quality constant
+        if devmode.PrintQuality > 0:
+            return devmode.PrintQuality
+        return devmode.YResolution if devmode.YResolution > 0 else None
+
     def is_file_in_printer_queue(self, file_name):
         jobs = win32print.EnumJobs(self.printer_handler, 0, -1, 1)
         return any(file_name in job["pDocument"] for job in jobs)
 
     def wait_for_file_in_queue(self, file_path, is_in_printer_spooler=False):
+        """
+        Waits until the file arrives in the printer queue, or if `is_in_printer_spooler`, until it left the queue.
+
+        Returns:
+        - float: The seconds waited.
+        """
         file_name = os.path.basename(file_path)
+        started = time.monotonic()
+        sampler = LogSampler(WAIT_LOG_INTERVAL)
         if is_in_printer_spooler:
             while self.is_file_in_printer_queue(file_name):
-                print("Printer queue is not empty. Waiting...")
+                if sampler.due():
+                    logger.info("%s is in the queue of %s, waiting...", file_name, self.printer_name)
                 time.sleep(1)
-            else:
-                print("Printer queue is now empty.")
-            return None
         else:
             while not self.is_file_in_printer_queue(file_name):
-                print("File hasn't gone to printer yet. Waiting...")
+                if sampler.due():
+                    logger.info("%s has not reached the queue of %s yet, waiting...", file_name, self.printer_name)
                 time.sleep(0.1)
-            else:
-                print("File just arrived to printer.")
-            return None
+        return time.monotonic() - started
 
-    def print_pdf(self, buffer_or_path, copies=1, orientation=1, duplex=True, flip_side="long", sort_copies=False):
-        # Open printer and configure duplex
+    def configure_printer(self, copies=1, orientation=1, duplex=True, flip_side="long", sort_copies=False):
+        """
+        Opens the printer and sets the job settings in its device mode. They take effect
+        after `apply_printer_settings`.
+
+        Returns:
+        - dict: The printer settings, to be passed to `restore_printer` after the job.
+        """
         self.get_or_open_printer_handler()
         printer_settings = win32print.GetPrinter(self.printer_handler, 2)
         devmode = printer_settings["pDevMode"]
@@ -75,33 +141,147 @@ class PrinterManager:
         devmode.Duplex = 2 if duplex and flip_side == "long" else 3 if duplex and flip_side == "short" else 1
         # Set collate if sorting is required and copies are more than 1
         devmode.Collate = 1 if sort_copies and copies > 1 else 0
-        time.sleep(1)
+        return printer_settings
 
+    def apply_printer_settings(self, printer_settings):
         win32print.SetPrinter(self.printer_handler, 2, printer_settings, 0)
 
+    @staticmethod
+    def submit_file(buffer_or_path):
+        """Hands the file to the PDF viewer, which sends it to the default printer spooler."""
+        win32api.ShellExecute(0, "print", buffer_or_path, None, ".", 0)
+
+    def restore_printer(self, printer_settings):
+        """Resets the device mode changed by `configure_printer` to the defaults."""
+        devmode = printer_settings["pDevMode"]
+        devmode.Duplex = 1  # 1 for simplex (no duplex), 2 for Long-edge, 3 for Short-edge,
+        devmode.Orientation = 1  # 1 for Portrait, 2 for Landscape
+        devmode.Copies = 1
+        devmode.Collate = 0
+        win32print.SetPrinter(self.printer_handler, 2, printer_settings, 0)
+
+    def close_printer(self):
+        win32print.ClosePrinter(self.printer_handler)
+        self.printer_handler = None
+
+    def print_pdf(self, buffer_or_path, copies=1, orientation=1, duplex=True, flip_side="long", sort_copies=False):
+        """
+        Prints a file and waits until it left the printer queue. The time until the file appeared in the queue
+        (spooling) and the time it spent there are recorded in the metrics of the printer, as are failures.
+        """
         try:
-            win32api.ShellExecute(0, "print", buffer_or_path, None, ".", 0)
-            self.wait_for_file_in_queue(buffer_or_path, is_in_printer_spooler=False)
-            print("checking is over")
-            self.wait_for_file_in_queue(buffer_or_path, is_in_printer_spooler=True)
-            print("ready to delete the file")
+            # Open printer and configure duplex
+            printer_settings = self.configure_printer(copies, orientation, duplex, flip_side, sort_copies)
+        except Exception:
+            PRINT_FAILURES.inc(printer=self.printer_name or "default")
+            raise
+        time.sleep(1)
 
+        try:
+            self.apply_printer_settings(printer_settings)
+            self.submit_file(buffer_or_path)
+            spool_seconds = self.wait_for_file_in_queue(buffer_or_path, is_in_printer_spooler=False)
+            SPOOL_DURATION.observe(spool_seconds, printer=self.printer_name)
+            queue_seconds = self.wait_for_file_in_queue(buffer_or_path, is_in_printer_spooler=True)
+            PRINTER_QUEUE_DURATION.observe(queue_seconds, printer=self.printer_name)
+            logger.info("%s printed on %s: spooled in %.1f s, %.1f s in the printer queue",
+                        os.path.basename(buffer_or_path), self.printer_name, spool_seconds, queue_seconds)
+        except Exception:
+            PRINT_FAILURES.inc(printer=self.printer_name)
+            raise
         finally:
-            print("Document sent to printer successfully.")
-            devmode.Duplex = 1  # 1 for simplex (no duplex), 2 for Long-edge, 3 for Short-edge,
-            devmode.Orientation = 1  # 1 for Portrait, 2 for Landscape
-            devmode.Copies = 1
-            devmode.Collate = 0
-            win32print.SetPrinter(self.printer_handler, 2, printer_settings, 0)
+            self.restore_printer(printer_settings)
             time.sleep(2)
-            win32print.ClosePrinter(self.printer_handler)
-            self.printer_handler = None
+            self.close_printer()
+
+
+class PrinterRegistry:
+    """
+    Caches the list of printers, the default printer and the capabilities of every printer. Enumerating printers
+    and asking their drivers takes seconds on machines with many network printers, so the cache is refreshed on
+    a background thread once it is older than `ttl` seconds, and readers always get the cached data at once.
+
+    Readers which want to know when a refresh lands compare `version` with the value they saw before.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.printers = []  # dicts with "name", "duplex", "color" and "max_copies" keys
+        self.default_printer = None
+        self.refreshed_at = None
+        self.version = 0
+        self.error = None  # the exception of the last refresh, if it failed
+        self.refresh_thread = None
+
+    def snapshot(self):
+        """
+        Returns the cached printers (a list of dicts) and the name of the default printer, and starts
+        a background refresh if the cache is empty or stale.
+        """
+        with self.lock:
+            stale = self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.ttl
+            printers, default_printer = list(self.printers), self.default_printer
+        cache_lookup("printers", not stale)
+        if stale:
+            self.refresh()
+        return printers, default_printer
+
+    def get_printer(self, printer_name):
+        with self.lock:
+            return next((printer for printer in self.printers if printer["name"] == printer_name), None)
+
+    def refresh(self):
+        """Starts a background refresh, unless one is already running."""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refresh_thread = threading.Thread(target=self.load, name="printer-registry", daemon=True)
+            self.refresh_thread.start()
+
+    @property
+    def refreshing(self):
+        """True while a background refresh is running."""
+        refresh_thread = self.refresh_thread
+        return refresh_thread is not None and refresh_thread.is_alive()
+
+    def load(self):
+        """Reads the printers and their capabilities. Runs on the refresh thread, or directly to wait for it."""
+        try:
+            default_printer = PrinterManager.get_default_printer_name()
+            printers = []
+            for printer_name, port_name in PrinterManager.list_printer_ports():
+                printers.append({"name": printer_name,
+                                 **PrinterManager.get_printer_capabilities(printer_name, port_name)})
+        except Exception as error:
+            # Any error, so the readers waiting for the refresh always see it end
+            logger.warning("Reading the printers failed: %s", error)
+            with self.lock:
+                self.error = error
+                self.refreshed_at = time.monotonic()  # retried after the TTL, not on every read
+                self.version += 1
+            return
+
+        # The default printer can be missing from the enumeration, e.g. a network printer of another session
+        if default_printer and all(printer["name"] != default_printer for printer in printers):
+            printers.insert(0, {"name": default_printer, "duplex": None, "color": None, "max_copies": None})
+        with self.lock:
+            self.printers = printers
+            self.default_printer = default_printer
+            self.error = None
+            self.refreshed_at = time.monotonic()
+            self.version += 1
+
+
+# Shared by all print windows of the application
+printer_registry = PrinterRegistry()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     printer_manager = PrinterManager()
     file_path = "file1.pdf"
     try:
         printer_manager.print_pdf(file_path, copies=2, orientation=2, duplex=True, flip_side="long", sort_copies=True)
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Printing %s failed", file_path)
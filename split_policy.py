@@ -0,0 +1,70 @@
+import math
+import os
+
+
+class SplitPolicy:
+    """
+    Where to split the output of an engine into several files, e.g. for printers and mail gateways which
+    reject big files, or to keep a huge job from blocking the printer queue for everyone else.
+
+    - max_pages: at most this many pages per file.
+    - max_bytes: at most about this many bytes per file. While pages are added, their size is estimated from
+      the size of their source file (PDF pages) or of the embedded image data (images); a file which still
+      ends up bigger is split in halves right after it is written. A single page is never split.
+    - by_source: every source file (a PDF file, or an image file with all its frames) starts a new file.
+
+    The engines write the files one after the other while they generate the pages, so the whole document
+    is never written first. An empty policy keeps the output in one file.
+    """
+    __slots__ = ("max_pages", "max_bytes", "by_source")
+
+    def __init__(self, max_pages=None, max_bytes=None, by_source=False):
+        if max_pages is not None and max_pages < 1:
+            raise ValueError("max_pages must be at least 1.")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1.")
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.by_source = by_source
+
+    def __repr__(self):
+        return f"SplitPolicy(max_pages={self.max_pages!r}, max_bytes={self.max_bytes!r}, by_source={self.by_source!r})"
+
+    def __bool__(self):
+        return self.max_pages is not None or self.max_bytes is not None or self.by_source
+
+    @classmethod
+    def coerce(cls, policy):
+        """Returns `policy` as a SplitPolicy. Accepts None and dicts of the constructor arguments."""
+        if isinstance(policy, cls):
+            return policy
+        if not policy:
+            return cls()
+        if isinstance(policy, dict):
+            return cls(**policy)
+        raise TypeError(f"A split policy must be a SplitPolicy or a dict, not {type(policy).__name__}.")
+
+    def page_room(self, pages, size, page_size):
+        """
+        Returns how many more pages fit into the current file.
+
+        Parameters:
+        - pages (int): Pages already in the file.
+        - size (int or float): Estimated size of the file in bytes.
+        - page_size (int or float): Estimated size of every page to add.
+
+        Returns:
+        - int or float: The number of pages, math.inf if unlimited. An empty file always takes one page.
+        """
+        room = math.inf
+        if self.max_pages is not None:
+            room = self.max_pages - pages
+        if self.max_bytes is not None and page_size > 0:
+            room = min(room, math.floor((self.max_bytes - size) / page_size))
+        return max(room, 1) if pages == 0 else max(room, 0)
+
+
+def part_path(output_path, index):
+    """Returns the path of the `index`-th (1-based) file of a split output, e.g. "merged_003.pdf"."""
+    root, extension = os.path.splitext(output_path)
+    return f"{root}_{index:03d}{extension or '.pdf'}"
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from http_service import JobService
+from metrics import JOB_FAILURES, PAGES
+
+
+class JobServiceMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.temp_dir.name, "image.png")
+        Image.new("RGB", (80, 60), "navy").save(self.image_path)
+        self.service = JobService(workers=1, queue_size=0)
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.temp_dir.cleanup()
+
+    def test_parent_counts_survive_a_render_job(self):
+        # Counted before the worker is started, so a forked worker would inherit it
+        JOB_FAILURES.inc(job="print")
+        failures = dict(JOB_FAILURES.values)
+        pages = PAGES.values.get(("grid",), 0)
+
+        path = self.service.generate("grid", {"images": [self.image_path]})
+        os.remove(path)
+
+        self.assertEqual(JOB_FAILURES.values, failures)
+        self.assertEqual(PAGES.values.get(("grid",), 0), pages + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import pymupdf
+from PIL import Image
+
+import create_file
+from create_file import extract_and_merge_pdfs
+from memory_usage import current_rss_bytes
+
+# Sources of the merge, each with its own incompressible image, so the merged pages take real memory
+SOURCE_COUNT = 24
+IMAGE_SIZE = (640, 480)  # about 0.9 MB of RGB noise
+MEMORY_BUDGET = 4 * 1024 * 1024
+# Distinct images of the grid job, each repeated once
+GRID_IMAGE_COUNT = 6
+
+
+def write_source(path, seed):
+    generator = random.Random(seed)
+    image = Image.frombytes("RGB", IMAGE_SIZE, generator.randbytes(IMAGE_SIZE[0] * IMAGE_SIZE[1] * 3))
+    image_path = path + ".png"
+    image.save(image_path, "PNG")
+    with pymupdf.open() as pdf_document:
+        for page_number in range(2):
+            page = pdf_document.new_page()
+            page.insert_text((72, 72), f"Source {seed}, page {page_number + 1}")
+            page.insert_image(pymupdf.Rect(72, 100, 520, 436), filename=image_path)
+        pdf_document.save(path)
+    os.remove(image_path)
+
+
+def rendered_pages(pdf_path):
+    with pymupdf.open(pdf_path) as pdf_document:
+        return [page.get_pixmap(dpi=36).samples for page in pdf_document]
+
+
+class MemoryBudgetMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pdf_paths = []
+        for seed in range(SOURCE_COUNT):
+            path = os.path.join(self.temp_dir.name, f"source_{seed:03d}.pdf")
+            write_source(path, seed)
+            self.pdf_paths.append(path)
+        self.sources_size = sum(os.path.getsize(path) for path in self.pdf_paths)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def merge(self, output_name, memory_budget):
+        events = []
+        output_path = os.path.join(self.temp_dir.name, output_name)
+        extract_and_merge_pdfs(self.pdf_paths, None, output_path, memory_budget=memory_budget,
+                               observer=events.append)
+        job_end = [event for event in events if event["event"] == "job_end"]
+        self.assertEqual(len(job_end), 1)
+        return output_path, job_end[0]["peak_rss"]
+
+    def test_merge_spills_over_budget(self):
+        baseline = current_rss_bytes()
+        # The budgeted merge runs first, so its peak is not hidden by the peak of an unbudgeted merge
+        with mock.patch.object(create_file, "spill_document", wraps=create_file.spill_document) as spill_document:
+            budgeted_path, peak_rss = self.merge("budgeted.pdf", MEMORY_BUDGET)
+        unbudgeted_path, _ = self.merge("unbudgeted.pdf", None)
+
+        self.assertGreater(spill_document.call_count, 0)
+        self.assertEqual(rendered_pages(budgeted_path), rendered_pages(unbudgeted_path))
+
+        self.assertIsInstance(peak_rss, int)
+        self.assertGreaterEqual(peak_rss, baseline)
+        # Without spilling, the merged pages alone would take about the size of the sources
+        self.assertLess(peak_rss - baseline, self.sources_size / 2)
+
+
+class MemoryBudgetImageGridTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        unique_paths = []
+        for seed in range(GRID_IMAGE_COUNT):
+            generator = random.Random(seed)
+            path = os.path.join(self.temp_dir.name, f"image_{seed:03d}.png")
+            Image.frombytes("RGB", IMAGE_SIZE, generator.randbytes(IMAGE_SIZE[0] * IMAGE_SIZE[1] * 3)).save(path)
+            unique_paths.append(path)
+        # Every image shows up twice, so the converted images are reused from memory and from the spilled files
+        self.image_paths = unique_paths + unique_paths[::-1]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def render(self, output_name, memory_budget):
+        output_path = os.path.join(self.temp_dir.name, output_name)
+        create_file.add_images_to_pdf_in_grid(output_path, self.image_paths, columns=2, rows=2,
+                                              color_mode="gray", memory_budget=memory_budget)
+        return output_path
+
+    def test_grid_spills_over_budget(self):
+        with mock.patch.object(create_file.SplitCanvas, "spill", autospec=True,
+                               side_effect=create_file.SplitCanvas.spill) as canvas_spill, \
+                mock.patch.object(create_file.ReducedImages, "spill", autospec=True,
+                                  side_effect=create_file.ReducedImages.spill) as images_spill:
+            # A budget of one byte is exceeded by the first decoded image
+            budgeted_path = self.render("budgeted.pdf", 1)
+        unbudgeted_path = self.render("unbudgeted.pdf", None)
+
+        self.assertGreater(canvas_spill.call_count, 0)
+        self.assertGreater(images_spill.call_count, 0)
+        budgeted_pages = rendered_pages(budgeted_path)
+        self.assertEqual(len(budgeted_pages), len(self.image_paths) // 4)
+        self.assertEqual(budgeted_pages, rendered_pages(unbudgeted_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from page_selection import PageSelection
+
+PAGE_COUNT = 10
+# Expression -> selected 0-indexed pages of a document of PAGE_COUNT pages, in output order
+SELECTIONS = {
+    "": list(range(10)),
+    "7": [6],
+    "1-3,7": [0, 1, 2, 6],
+    "8-": [7, 8, 9],
+    "5-1": [4, 3, 2, 1, 0],
+    "last-3": [7, 8, 9],
+    "even": [1, 3, 5, 7, 9],
+    "odd": [0, 2, 4, 6, 8],
+    "reverse": [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+    "1-3,reverse": [2, 1, 0],
+    "9-12": [8, 9],
+}
+# The matches of the text parts, as page_index.selection_matches returns them
+TEXT_MATCHES = {"summary": [2, 6], "annex b": [9]}
+TEXT_SELECTIONS = {
+    "text:Summary": [2, 6],
+    "text:SUMMARY,1": [2, 6, 0],
+    "text:Annex  B,reverse": [9],
+    "text:Missing": [],
+}
+
+
+class PageSelectionTest(unittest.TestCase):
+    def test_pages(self):
+        for expression, pages in SELECTIONS.items():
+            with self.subTest(expression=expression):
+                selection = PageSelection.parse(expression)
+                self.assertEqual(list(selection.pages(PAGE_COUNT)), pages)
+                self.assertEqual(selection.page_set(PAGE_COUNT), set(pages))
+                self.assertEqual(selection.queries, ())
+
+    def test_text_pages(self):
+        for expression, pages in TEXT_SELECTIONS.items():
+            with self.subTest(expression=expression):
+                selection = PageSelection.parse(expression)
+                self.assertEqual(len(selection.queries), 1)
+                self.assertEqual(list(selection.pages(PAGE_COUNT, TEXT_MATCHES)), pages)
+
+    def test_invalid_expressions(self):
+        for expression in ("-3", "1--3", "1,,3", "page 3", "last-0", "text:"):
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    PageSelection.parse(expression)
+
+    def test_pages_outside_page_count(self):
+        for expression in ("0", "0-3", "11", "9-12", "last-11"):
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    PageSelection.parse(expression, page_count=PAGE_COUNT)
+
+
+if __name__ == "__main__":
+    unittest.main()
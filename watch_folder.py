@@ -0,0 +1,470 @@
+import argparse
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from create_file import add_images_to_pdf_in_grid, add_images_to_template
+from layout_template import LayoutTemplate
+from metrics import JOB_FAILURES, REGISTRY, metrics_observer, reset_worker_metrics
+
+logger = logging.getLogger(__name__)
+
+# Name of the optional per-folder configuration file, a JSON object overriding DEFAULT_CONFIG
+CONFIG_FILE_NAME = ".mingling.json"
+
+DEFAULT_CONFIG = {
+    "extensions": [".jpg", ".jpeg", ".png", ".tif", ".tiff"],
+    # Batching: a batch is closed when it has `batch_size` images or `batch_window` seconds after its first image
+    "batch_size": 12,
+    "batch_window": 30.0,
+    # A file is taken only after its size and modification time did not change for this many seconds
+    "settle_seconds": 2.0,
+    # Layout template (the name of a registered template or a dict of its arguments, see
+    # layout_template.LayoutTemplate), or None to lay out the images in the grid below
+    "template": None,
+    # Layout, passed to add_images_to_pdf_in_grid
+    "columns": 2,
+    "rows": 3,
+    "orientation": "portrait",
+    "page_margin": 0,
+    "image_margin": 0,
+    # "color", "gray" or "mono" (dithered black and white, the smallest spool for monochrome printers)
+    "color_mode": "color",
+    # Stamp, text and page numbers drawn on every page, e.g. {"stamp": "COPY", "page_numbers": true}, see
+    # create_file.OVERLAY_FIELDS
+    "overlay": None,
+    # Bytes of memory a batch may use before the pages generated so far are written to temporary files, None for
+    # no limit. Keeps huge batches from pushing a small print server into swap
+    "memory_budget": None,
+    # Output: relative paths are resolved against the watched folder
+    "output_dir": "printed",
+    "done_dir": "done",
+    # A batch which fails to render is tried again this many times, then its images are moved to `failed_dir`
+    "batch_retries": 2,
+    "failed_dir": "failed",
+    # Printing: the generated PDF is sent to `printer` (or the default printer if None) when `print` is True
+    "print": False,
+    "printer": None,
+    "copies": 1,
+    "duplex": False,
+    "flip_side": "long",
+}
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+def load_folder_config(folder):
+    """Returns DEFAULT_CONFIG updated with the configuration file of the folder, if there is one."""
+    config = dict(DEFAULT_CONFIG)
+    config_path = os.path.join(folder, CONFIG_FILE_NAME)
+    if os.path.exists(config_path):
+        with open(config_path) as config_file:
+            overrides = json.load(config_file)
+        unknown = set(overrides) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown options in {config_path}: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+    for key in ("output_dir", "done_dir", "failed_dir"):
+        config[key] = os.path.join(folder, config[key])
+    config["extensions"] = tuple(extension.lower() for extension in config["extensions"])
+    if config["template"] is not None:
+        # Computed once for all batches of the folder
+        config["template"] = LayoutTemplate.coerce(config["template"])
+    return config
+
+
+class PollingWatcher:
+    """Detects new and changed files in a folder by scanning it every `interval` seconds."""
+
+    def __init__(self, folder, interval=1.0):
+        self.folder = folder
+        self.interval = interval
+        self.snapshot = {}
+
+    def wait(self, timeout):
+        """Returns the paths of files which appeared or changed since the previous call."""
+        time.sleep(min(timeout, self.interval))
+        changed = []
+        snapshot = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                if self.snapshot.get(entry.path) != snapshot[entry.path]:
+                    changed.append(entry.path)
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Detects files written or moved into a folder with Linux inotify, without scanning the folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {folder}")
+        # Files which were already there before the service started
+        self.initial = [entry.path for entry in os.scandir(folder) if entry.is_file()]
+
+    def wait(self, timeout):
+        changed, self.initial = self.initial, []
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name:
+                changed.append(os.path.join(self.folder, os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(folder, force_polling=False):
+    """Returns an InotifyWatcher where inotify is available, otherwise a PollingWatcher."""
+    if not force_polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as error:
+            logger.warning("inotify is not available for %s (%s), falling back to polling", folder, error)
+    return PollingWatcher(folder)
+
+
+class Debouncer:
+    """
+    Holds back files which are still being written: a file is ready once its size and modification time
+    stayed the same for `settle_seconds` and it can be opened for reading.
+    """
+
+    def __init__(self, settle_seconds):
+        self.settle_seconds = settle_seconds
+        self.pending = {}  # path -> ((size, mtime), time of the last change)
+
+    def touch(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self.pending.get(path)
+        if previous is None or previous[0] != signature:
+            self.pending[path] = (signature, time.monotonic())
+
+    def ready(self):
+        now = time.monotonic()
+        ready = []
+        for path, (signature, changed_at) in list(self.pending.items()):
+            if now - changed_at < self.settle_seconds:
+                continue
+            # Re-check, a slow writer may have appended since the last event
+            self.touch(path)
+            if path not in self.pending or self.pending[path][0] != signature:
+                continue
+            try:
+                # On Windows a file which is still open for writing cannot be opened
+                with open(path, "rb"):
+                    pass
+            except OSError:
+                continue
+            del self.pending[path]
+            if signature[0] > 0:
+                ready.append(path)
+        return sorted(ready)
+
+
+def init_render_worker():
+    """
+    Initializer of the render workers. Ctrl+C stops the service in the main process, which then shuts the pool
+    down, so the workers ignore it. The metrics inherited from the main process are dropped, see
+    metrics.reset_worker_metrics.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    reset_worker_metrics()
+
+
+def render_batch(image_paths, output_path, config):
+    """
+    Creates the grid PDF of one batch, or fills the layout template of the folder. Runs in a worker process.
+
+    Returns:
+    - tuple: `output_path` and the metrics of the worker, drained after the batch (see MetricsRegistry.drain).
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    options = {"output_path": output_path, "image_paths": list(image_paths), "color_mode": config["color_mode"],
+               "overlay": config["overlay"], "memory_budget": config["memory_budget"], "observer": metrics_observer}
+    if config["template"] is not None:
+        add_images_to_template(config["template"], **options)
+    else:
+        add_images_to_pdf_in_grid(
+            columns=config["columns"],
+            rows=config["rows"],
+            orientation=config["orientation"],
+            page_margin=config["page_margin"],
+            image_margin=config["image_margin"],
+            **options,
+        )
+    return output_path, REGISTRY.drain()
+
+
+def print_batch(output_path, config):
+    # Imported here, so the service can run without the Windows printing modules when it does not print
+    from printer_utils import PrinterManager
+
+    printer_manager = PrinterManager(config["printer"])
+    printer_manager.print_pdf(output_path, copies=config["copies"], duplex=config["duplex"],
+                              flip_side=config["flip_side"])
+
+
+def unique_path(directory, file_name):
+    """
+    Returns the path of `file_name` in `directory`, or, if a file of that name exists there, the path with
+    the first free number appended to the name, e.g. "scan_2.jpg".
+    """
+    path = os.path.join(directory, file_name)
+    stem, extension = os.path.splitext(file_name)
+    number = 1
+    while os.path.exists(path):
+        number += 1
+        path = os.path.join(directory, f"{stem}_{number}{extension}")
+    return path
+
+
+class Throughput:
+    """Thread-safe counters of processed batches and images."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.batches = 0
+        self.images = 0
+        self.failures = 0
+        self.render_seconds = 0.0
+
+    def add(self, images, render_seconds):
+        with self.lock:
+            self.batches += 1
+            self.images += images
+            self.render_seconds += render_seconds
+
+    def add_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def summary(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {"batches": self.batches, "images": self.images, "failures": self.failures,
+                    "images_per_minute": self.images * 60 / elapsed,
+                    "mean_render_seconds": self.render_seconds / self.batches if self.batches else 0.0}
+
+
+class FolderService:
+    """
+    Watches one folder, groups arriving images into batches and hands every batch to a shared process pool.
+    Rendered batches are moved to the `done_dir` of the folder and, if configured, printed. A batch which keeps
+    failing is moved to the `failed_dir`, so no image stays in the folder unnoticed.
+    """
+
+    def __init__(self, folder, render_pool, print_pool, throughput, force_polling=False, metrics_file=None):
+        self.folder = os.path.abspath(folder)
+        self.metrics_file = metrics_file
+        self.config = load_folder_config(self.folder)
+        self.render_pool = render_pool
+        self.print_pool = print_pool
+        self.throughput = throughput
+        self.watcher = create_watcher(self.folder, force_polling)
+        self.debouncer = Debouncer(self.config["settle_seconds"])
+        self.batch = []
+        self.batch_started = None
+        self.claimed = set()  # files in batches which are not finished yet
+        self.batch_number = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"watch {self.folder}", daemon=True)
+
+    def start(self):
+        logger.info("Watching %s with %s", self.folder, type(self.watcher).__name__)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.watcher.close()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            for path in self.watcher.wait(timeout=0.5):
+                if path.lower().endswith(self.config["extensions"]) and path not in self.claimed:
+                    self.debouncer.touch(path)
+            for path in self.debouncer.ready():
+                if path not in self.claimed and path not in self.batch:
+                    if not self.batch:
+                        self.batch_started = time.monotonic()
+                    self.batch.append(path)
+            while len(self.batch) >= self.config["batch_size"]:
+                self.submit(self.batch[:self.config["batch_size"]])
+                self.batch = self.batch[self.config["batch_size"]:]
+                self.batch_started = time.monotonic()
+            if self.batch and time.monotonic() - self.batch_started >= self.config["batch_window"]:
+                self.submit(self.batch)
+                self.batch = []
+        # Do not lose the images which already arrived
+        if self.batch:
+            self.submit(self.batch)
+            self.batch = []
+
+    def submit(self, image_paths):
+        self.batch_number += 1
+        name = f"batch_{time.strftime('%Y%m%d_%H%M%S')}_{self.batch_number:04d}.pdf"
+        output_path = os.path.join(self.config["output_dir"], name)
+        self.claimed.update(image_paths)
+        self.render(image_paths, output_path, 1)
+        logger.info("Batch %s: %d images submitted", name, len(image_paths))
+
+    def render(self, image_paths, output_path, attempt):
+        submitted_at = time.monotonic()
+        future = self.render_pool.submit(render_batch, image_paths, output_path, self.config)
+        future.add_done_callback(lambda done: self.finish(done, image_paths, output_path, attempt, submitted_at))
+
+    def finish(self, future, image_paths, output_path, attempt, submitted_at):
+        retried = False
+        try:
+            try:
+                output_path, samples = future.result()
+            except Exception:
+                logger.exception("Batch of %d images from %s failed, attempt %d of %d", len(image_paths),
+                                 self.folder, attempt, self.config["batch_retries"] + 1)
+                self.throughput.add_failure()
+                JOB_FAILURES.inc(job="grid")
+                self.write_metrics()
+                retried = self.retry(image_paths, output_path, attempt)
+                return
+            REGISTRY.merge(samples)
+            self.write_metrics()
+
+            self.move_images(image_paths, self.config["done_dir"])
+            self.throughput.add(len(image_paths), time.monotonic() - submitted_at)
+            logger.info("Created %s, throughput: %s", output_path, self.throughput.summary())
+
+            if self.config["print"]:
+                self.print_pool.submit(self.print_output, output_path)
+        finally:
+            # Runs in the callback of the future, where exceptions are swallowed, so the images are released
+            # whatever happened, unless the batch is rendered again
+            if not retried:
+                self.claimed.difference_update(image_paths)
+
+    def retry(self, image_paths, output_path, attempt):
+        """
+        Renders a failed batch again, or moves its images to the `failed_dir` after the last attempt.
+        Returns True if the batch is rendered again.
+        """
+        if attempt <= self.config["batch_retries"]:
+            try:
+                self.render(image_paths, output_path, attempt + 1)
+                return True
+            except RuntimeError:
+                # The pool is shut down, the images stay in the folder and are batched again on the next start
+                logger.warning("Not retrying the batch of %d images, the service is stopping", len(image_paths))
+                return False
+        self.move_images(image_paths, self.config["failed_dir"])
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        logger.error("Moved the %d images of the failed batch to %s", len(image_paths), self.config["failed_dir"])
+        return False
+
+    def move_images(self, image_paths, directory):
+        """Moves images to a directory, renaming those whose name is taken there, e.g. by an earlier scan."""
+        os.makedirs(directory, exist_ok=True)
+        for image_path in image_paths:
+            try:
+                shutil.move(image_path, unique_path(directory, os.path.basename(image_path)))
+            except FileNotFoundError:
+                logger.warning("%s was removed before it could be moved to %s", image_path, directory)
+            except OSError:
+                logger.exception("Moving %s to %s failed", image_path, directory)
+
+    def print_output(self, output_path):
+        try:
+            print_batch(output_path, self.config)
+            logger.info("Printed %s", output_path)
+        except Exception:
+            logger.exception("Printing %s failed", output_path)
+            self.throughput.add_failure()
+            JOB_FAILURES.inc(job="print")
+        self.write_metrics()
+
+    def write_metrics(self):
+        """Updates the metrics file, if there is one, after every batch rendered or printed."""
+        if self.metrics_file:
+            try:
+                REGISTRY.write_textfile(self.metrics_file)
+            except OSError:
+                logger.exception("Writing the metrics to %s failed", self.metrics_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch images dropped into folders into grid PDFs and print them.")
+    parser.add_argument("folders", nargs="+", help=f"folders to watch, each may contain a {CONFIG_FILE_NAME} file")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes rendering batches")
+    parser.add_argument("--poll", action="store_true", help="scan the folders instead of using inotify")
+    parser.add_argument("--metrics-file", default=None,
+                        help="file the metrics are written to in the Prometheus text format, e.g. for the textfile "
+                             "collector of the node exporter")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    throughput = Throughput()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_render_worker) as render_pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="print") as print_pool:
+        # Printing is serialized: the spooler is one shared resource, and PrinterManager waits for the queue
+        services = [FolderService(folder, render_pool, print_pool, throughput, args.poll, args.metrics_file)
+                    for folder in args.folders]
+        for service in services:
+            service.start()
+        try:
+            while True:
+                time.sleep(60)
+                logger.info("Throughput: %s", throughput.summary())
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+        finally:
+            for service in services:
+                service.stop()
+    logger.info("Throughput: %s", throughput.summary())
+
+
+if __name__ == "__main__":
+    main()